@@ -0,0 +1,387 @@
+"""
+Balmorel Input Cache
+
+Converts a {scenario}_input_data.gdx into a columnar cache with one Arrow (feather) file per symbol,
+so subsequent steps can memory-map only the symbols they need instead of re-running GAMS.
+Also contains a size-bounded cache of filtered symbols, used by store_balmorel_input
+
+Created on 17.10.2026
+@author: Mathias Berg Rosendal, PhD Student at DTU Management (Energy Economics & Modelling)
+"""
+#%% ------------------------------- ###
+###        0. Script Settings       ###
+### ------------------------------- ###
+
+import os
+import json
+import hashlib
+import shutil
+import time
+import types
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+import gams.transfer as gt
+from contextlib import contextmanager
+from typing import Union, Callable
+
+CACHE_FOLDER = os.path.join('Data', 'BalmorelData', 'InputCache')
+SYMBOL_CACHE_FOLDER = os.path.join('Data', 'BalmorelData', 'SymbolCache')
+SYMBOL_CACHE_SIZE = 2*1024**3 # Maximum size of the symbol cache in bytes
+GAMS_EPS = 4.94065645841247E-300 # The value of EPS in a GamsDatabase
+
+#%% ------------------------------- ###
+###          1. Functions           ###
+### ------------------------------- ###
+
+def read_json(path: str, default: dict) -> dict:
+    """Read a JSON file shared by parallel jobs, returning default if it is missing or unreadable"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def write_json(path: str, data: dict):
+    """Write a JSON file shared by parallel jobs, replacing it atomically so it is never read half written"""
+    temp_path = path + '.%d.tmp'%os.getpid()
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+def gdx_hash(gdx_path: str, cache_folder: str = CACHE_FOLDER) -> str:
+    """Content hash of a GDX file
+
+    The hash is stored together with the size and modification time of the file,
+    so the file is only read again if it changed
+    """
+    gdx_path = os.path.abspath(gdx_path)
+    stat = os.stat(gdx_path)
+    hashes_path = os.path.join(cache_folder, 'hashes.json')
+
+    known = read_json(hashes_path, {}).get(gdx_path, {})
+    if known.get('size') == stat.st_size and known.get('mtime') == stat.st_mtime:
+        return known['hash']
+
+    # Hash the content in chunks
+    sha = hashlib.sha256()
+    with open(gdx_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            sha.update(chunk)
+
+    # Read again, keeping hashes stored by parallel jobs in the meantime
+    os.makedirs(cache_folder, exist_ok=True)
+    hashes = read_json(hashes_path, {})
+    hashes[gdx_path] = {'size' : stat.st_size, 'mtime' : stat.st_mtime, 'hash' : sha.hexdigest()}
+    write_json(hashes_path, hashes)
+
+    return sha.hexdigest()
+
+def transfer_records(symbol) -> pd.DataFrame:
+    """Convert the records of a gams.transfer symbol to the format of pybalmorel.utils.symbol_to_df"""
+    columns = list(symbol.domain_names)
+    if symbol.records is None:
+        df = pd.DataFrame(columns=columns)
+    else:
+        df = symbol.records.iloc[:, :len(columns)].astype(str)
+    df.columns = columns
+
+    if isinstance(symbol, gt.Parameter):
+        if symbol.records is None:
+            values = np.array([], dtype=float)
+        else:
+            values = symbol.records['value'].to_numpy(dtype=float, copy=True)
+
+        ## gams.transfer reads EPS as -0.0
+        values[(values == 0) & np.signbit(values)] = GAMS_EPS
+        df['Value'] = values
+
+    return df.reset_index(drop=True)
+
+
+#%% ------------------------------- ###
+###          2. The Cache           ###
+### ------------------------------- ###
+
+class BalmorelInputCache:
+    """Columnar cache of a Balmorel input database
+
+    Each symbol is stored as an uncompressed feather file, which is memory-mapped when loaded.
+    The cache is placed in a folder named after the content hash of the source GDX file,
+    so it is only rebuilt when the input data changes
+
+    Args:
+        path (str): The folder of an existing cache
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'symbols.json'), 'r') as f:
+            self.symbols = json.load(f)
+
+    @classmethod
+    def from_gdx(cls, gdx_path: str,
+                 gams_sysdir: Union[str, None] = None,
+                 cache_folder: str = CACHE_FOLDER):
+        """Get the cache of a GDX file, converting it if it has not been cached before"""
+        path = os.path.join(cache_folder, gdx_hash(gdx_path, cache_folder))
+        if os.path.exists(os.path.join(path, 'symbols.json')):
+            return cls(path)
+
+        print('\nCaching %s...\n'%gdx_path)
+        container = gt.Container(os.path.abspath(gdx_path), system_directory=gams_sysdir)
+
+        # Write to a temporary folder first, so an interrupted conversion is never used
+        temp_path = path + '.tmp'
+        if os.path.exists(temp_path):
+            shutil.rmtree(temp_path)
+        os.makedirs(temp_path)
+
+        metadata = {}
+        for name in container.listParameters() + container.listSets() + container.listAliases():
+            symbol = container[name]
+            df = transfer_records(symbol)
+            metadata[name] = {'type' : 'parameter' if isinstance(symbol, gt.Parameter) else 'set',
+                              'text' : symbol.description,
+                              'columns' : list(df.columns)}
+
+            # Use positional column names, as GAMS domains may repeat (e.g. *)
+            df.columns = [str(i) for i in range(len(df.columns))]
+            feather.write_feather(df, os.path.join(temp_path, '%s.feather'%name),
+                                  compression='uncompressed')
+
+        with open(os.path.join(temp_path, 'symbols.json'), 'w') as f:
+            json.dump(metadata, f)
+
+        os.replace(temp_path, path)
+
+        return cls(path)
+
+    @classmethod
+    def from_model(cls, model_path: str,
+                   scenario: str,
+                   gams_sysdir: Union[str, None] = None,
+                   cache_folder: str = CACHE_FOLDER):
+        """Get the cache of a Balmorel scenario, only running GAMS if {scenario}_input_data.gdx does not exist"""
+        gdx_path = os.path.join(model_path, scenario, 'model', '%s_input_data.gdx'%scenario)
+        if not(os.path.exists(gdx_path)):
+            from pybalmorel import Balmorel
+            print('\nLoading results into %s_input_data.gdx...\n'%scenario)
+            Balmorel(model_path, gams_system_directory=gams_sysdir).load_incfiles(scenario)
+
+        return cls.from_gdx(gdx_path, gams_sysdir, cache_folder)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.symbols
+
+    def is_parameter(self, symbol: str) -> bool:
+        return self.symbols[symbol]['type'] == 'parameter'
+
+    def text(self, symbol: str) -> str:
+        return self.symbols[symbol]['text']
+
+    def load(self, symbol: str, columns: Union[list, None] = None) -> pd.DataFrame:
+        """Load a symbol as a dataframe, like pybalmorel.utils.symbol_to_df
+
+        Args:
+            symbol (str): The symbol name
+            columns (list, optional): Rename the columns. Defaults to the GAMS domains (+ Value for parameters)
+        """
+        if not(symbol in self.symbols):
+            raise KeyError('%s is not in the Balmorel input cache %s'%(symbol, self.path))
+
+        df = feather.read_table(os.path.join(self.path, '%s.feather'%symbol), memory_map=True).to_pandas()
+        if columns is None:
+            df.columns = self.symbols[symbol]['columns']
+        else:
+            df.columns = columns
+
+        return df
+
+
+#%% ------------------------------- ###
+###        3. The Symbol Cache      ###
+### ------------------------------- ###
+
+def code_identity(code) -> list:
+    """The bytecode, constants and names of a code object, including nested code objects (e.g. comprehensions)"""
+    return [code.co_code.hex(), 
+            [code_identity(const) if hasattr(const, 'co_code') else repr(const) for const in code.co_consts],
+            list(code.co_names)]
+
+def value_identity(value, seen: tuple = ()):
+    """Identify a value captured by a filter function, i.e. a closure cell, default argument or global.
+    Raises a TypeError for values that can not be identified reliably from their contents, e.g. dataframes"""
+    if value is None or isinstance(value, (str, bytes, bool, int, float, complex)):
+        return repr(value)
+    elif isinstance(value, (list, tuple)):
+        return [type(value).__name__] + [value_identity(item, seen) for item in value]
+    elif isinstance(value, (set, frozenset)):
+        return [type(value).__name__] + sorted([json.dumps(value_identity(item, seen)) for item in value])
+    elif isinstance(value, dict):
+        return ['dict'] + [[value_identity(key, seen), value_identity(item, seen)] for key, item in value.items()]
+    elif isinstance(value, types.ModuleType):
+        return ['module', value.__name__]
+    elif isinstance(value, type):
+        return ['class', value.__module__, value.__qualname__]
+    elif isinstance(value, types.BuiltinFunctionType):
+        return ['builtin', value.__module__, value.__qualname__]
+    elif isinstance(value, types.FunctionType):
+        return ['function', value.__module__, value.__qualname__] if value in seen else function_identity(value, seen)
+    raise TypeError('Can not identify %s of type %s'%(repr(value)[:50], type(value).__name__))
+
+def function_identity(func: Callable, seen: tuple = ()) -> list:
+    """The code of a function and the values it uses from closures, default arguments and globals"""
+    seen = seen + (func,)
+    code = func.__code__
+    cells = [value_identity(cell.cell_contents, seen) for cell in (func.__closure__ or ())]
+    defaults = value_identity(func.__defaults__, seen)
+    kwdefaults = value_identity(func.__kwdefaults__, seen)
+    global_values = [[name, value_identity(func.__globals__[name], seen)] for name in code.co_names if name in func.__globals__]
+    return [func.__module__, func.__qualname__, code_identity(code), cells, defaults, kwdefaults, global_values]
+
+def filter_identity(filter_func: Union[Callable, None]) -> Union[str, None]:
+    """Identify a filter function by its code and the values it captures (closure cells, default arguments and globals), 
+    so two filters filtering differently are not confused. None if a captured value can not be identified, 
+    in which case the filtered symbol should not be cached"""
+    if filter_func is None:
+        return 'None'
+
+    try:
+        identity = json.dumps(function_identity(filter_func))
+    except (TypeError, ValueError, AttributeError):
+        return None
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+class SymbolCache:
+    """Cache of (filtered) Balmorel input symbols stored as parquet files
+
+    Entries are keyed on the model path, scenario, GDX hash, symbol, columns and filter function,
+    and listed in a manifest. The least recently used entries are evicted when the cache exceeds max_size
+
+    Args:
+        path (str, optional): The folder of the cache. Defaults to Data/BalmorelData/SymbolCache.
+        max_size (int, optional): The maximum size of the cache in bytes. Defaults to 2 GB.
+    """
+    def __init__(self, path: str = SYMBOL_CACHE_FOLDER,
+                 max_size: int = SYMBOL_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.manifest_path = os.path.join(path, 'manifest.json')
+        os.makedirs(path, exist_ok=True)
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self) -> dict:
+        return read_json(self.manifest_path, {'entries' : {}, 'hits' : 0, 'misses' : 0, 'evictions' : 0})
+
+    @contextmanager
+    def locked(self, timeout: float = 120, stale: float = 600):
+        """Hold the lock of the manifest while changing it, so parallel jobs do not drop each other's entries.
+        The manifest is read again when the lock is acquired and saved when it is released.
+        A lock older than stale seconds is assumed to be left by a crashed job and is removed"""
+        lock_path = self.manifest_path + '.lock'
+        start = time.time()
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > stale:
+                        os.remove(lock_path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if time.time() - start > timeout:
+                    raise TimeoutError('Could not lock %s within %d seconds'%(self.manifest_path, timeout))
+                time.sleep(0.05)
+
+        try:
+            self.manifest = self.load_manifest()
+            yield self.manifest
+            self.save_manifest()
+        finally:
+            os.close(fd)
+            os.remove(lock_path)
+
+    def save_manifest(self):
+        # Replace atomically, so parallel jobs never read half a manifest
+        write_json(self.manifest_path, self.manifest)
+
+    @staticmethod
+    def key(model_path: str, scenario: str, gdx_hash: str, symbol: str, 
+            columns: Union[list, None], filter_func: Union[Callable, None]) -> Union[str, None]:
+        """The key of a symbol, or None if the filter function can not be identified and the symbol should not be cached"""
+        identity = filter_identity(filter_func)
+        if identity is None:
+            return None
+        key = json.dumps([os.path.abspath(model_path), scenario, gdx_hash, symbol,
+                          columns, identity])
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key: str) -> Union[pd.DataFrame, None]:
+        with self.locked() as manifest:
+            entry = manifest['entries'].get(key)
+            if entry is None or not(os.path.exists(os.path.join(self.path, entry['file']))):
+                manifest['entries'].pop(key, None)
+                manifest['misses'] += 1
+                return None
+
+            entry['last_access'] = time.time()
+            entry['hits'] += 1
+            manifest['hits'] += 1
+
+        try:
+            return pd.read_parquet(os.path.join(self.path, entry['file']))
+        except FileNotFoundError:
+            # Evicted by a parallel job in the meantime
+            return None
+
+    def put(self, key: str, df: pd.DataFrame, **description):
+        # Write to a temporary file first, so evict never sees a parquet file that is not in the manifest yet
+        file = '%s_%s.parquet'%(description.get('symbol', 'symbol'), key[:16])
+        temp_path = os.path.join(self.path, file + '.%d.tmp'%os.getpid())
+        df.to_parquet(temp_path)
+
+        with self.locked() as manifest:
+            os.replace(temp_path, os.path.join(self.path, file))
+            manifest['entries'][key] = {'file' : file,
+                                        'size' : os.path.getsize(os.path.join(self.path, file)),
+                                        'created' : time.time(),
+                                        'last_access' : time.time(),
+                                        'hits' : 0,
+                                        **description}
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is within max_size, 
+        and parquet files that are not in the manifest, e.g. entries lost by earlier versions of the cache.
+        Must be called while holding the lock"""
+        entries = self.manifest['entries']
+        files = set(entry['file'] for entry in entries.values())
+        for file in os.listdir(self.path):
+            if file.endswith('.parquet') and not(file in files):
+                os.remove(os.path.join(self.path, file))
+                self.manifest['evictions'] += 1
+
+        size = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda key: entries[key]['last_access']):
+            if size <= self.max_size:
+                break
+            size -= entries[key]['size']
+            file = os.path.join(self.path, entries.pop(key)['file'])
+            if os.path.exists(file):
+                os.remove(file)
+            self.manifest['evictions'] += 1
+
+    def report(self) -> str:
+        self.manifest = self.load_manifest()
+        entries = self.manifest['entries']
+        size = sum(entry['size'] for entry in entries.values())
+        lines = ['Balmorel symbol cache: %s'%self.path,
+                 '%d entries, %0.1f of %0.1f MB'%(len(entries), size/1024**2, self.max_size/1024**2),
+                 '%d hits, %d misses, %d evictions'%(self.manifest['hits'], self.manifest['misses'], self.manifest['evictions'])]
+        for entry in sorted(entries.values(), key=lambda entry: -entry['last_access']):
+            lines.append('  %-20s %-10s %8.1f MB %4d hits, last used %s'%(entry.get('symbol', ''), entry.get('scenario', ''),
+                                                                     entry['size']/1024**2, entry['hits'],
+                                                                     time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_access']))))
+        return '\n'.join(lines)
@@ -0,0 +1,152 @@
+"""
+Cluster Hierarchy
+
+Keeps the region-to-cluster mappings of consecutive clusterings (first order, second order, ...) composed from the base resolution,
+together with the features and connectivity of the base regions. A higher order clustering can then build on the previous one
+without loading the Balmorel input data again, and any order can be aggregated with a single recode from the base regions
+
+Created on 17.10.2026
+@author: Mathias Berg Rosendal, PhD Student at DTU Management (Energy Economics & Modelling)
+"""
+#%% ------------------------------- ###
+###        0. Script Settings       ###
+### ------------------------------- ###
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from typing import Union
+
+HIERARCHY_FOLDER = os.path.join('ClusterOutput', 'Hierarchy')
+BASE_FEATURES = 'base_features.npz' # Features and connectivity of the base regions, see Submodules/feature_cache.py
+
+#%% ------------------------------- ###
+###           1. Mappings           ###
+### ------------------------------- ###
+
+def load_hierarchy(folder: str = HIERARCHY_FOLDER) -> tuple[Union[pd.DataFrame, None], dict]:
+    """The mappings (a base column and order_1, order_2, ... columns of cluster names) and the metadata of each order"""
+    if not(os.path.exists(os.path.join(folder, 'mapping.csv'))):
+        return None, {}
+
+    hierarchy = pd.read_csv(os.path.join(folder, 'mapping.csv'), dtype=str)
+    with open(os.path.join(folder, 'metadata.json'), 'r') as f:
+        metadata = json.load(f)
+
+    return hierarchy, metadata
+
+def check_previous_order(order: int, metadata: dict, previous_geofile: str, folder: str = HIERARCHY_FOLDER):
+    """Raise a ValueError if the previous order in the hierarchy is not the clustering saved as previous_geofile,
+    since cluster names (CL0, CL1, ...) are the same in every clustering and would be composed silently"""
+    stored_geofile = metadata.get(str(order - 1), {}).get('geofile')
+    if stored_geofile != previous_geofile:
+        raise ValueError('The order %d clustering in %s is %s, not %s that the order %d clustering was built on'%(order - 1, folder, stored_geofile, previous_geofile, order))
+
+def save_hierarchy(order: int,
+                   mapping: pd.Series,
+                   folder: str = HIERARCHY_FOLDER,
+                   previous_geofile: str = None,
+                   **metadata):
+    """Add a clustering to the hierarchy, replacing that order and any higher orders
+
+    Args:
+        order (int): The order of the clustering, 1 for clustering the base regions
+        mapping (pd.Series): The cluster name of each region of the previous order (index)
+        folder (str, optional): Where the hierarchy is stored. Defaults to ClusterOutput/Hierarchy.
+        previous_geofile (str, optional): The geofile of the previous order that this clustering was built on, required for orders above 1. Defaults to None.
+        metadata: Settings of the clustering, e.g. model_path, scenario, cluster_params, aggfuncs and geofile
+    """
+    if order == 1:
+        hierarchy, order_metadata = pd.DataFrame({'base' : mapping.index.astype(str), 'order_1' : mapping.values}), {}
+    else:
+        hierarchy, order_metadata = load_hierarchy(folder)
+        if hierarchy is None or not('order_%d'%(order - 1) in hierarchy.columns):
+            raise FileNotFoundError('No order %d clustering in %s to build the order %d clustering on'%(order - 1, folder, order))
+        check_previous_order(order, order_metadata, previous_geofile, folder)
+
+        # Compose with the previous orders
+        hierarchy = hierarchy[['base'] + ['order_%d'%i for i in range(1, order)]].copy()
+        hierarchy['order_%d'%order] = hierarchy['order_%d'%(order - 1)].map(mapping)
+        order_metadata = {key : value for key, value in order_metadata.items() if int(key) < order}
+
+    order_metadata[str(order)] = metadata
+
+    # Write to temporary files first, so an interrupted write is never used
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, 'mapping.csv')
+    hierarchy.to_csv(path + '.%d.tmp'%os.getpid(), index=False)
+    os.replace(path + '.%d.tmp'%os.getpid(), path)
+    path = os.path.join(folder, 'metadata.json')
+    with open(path + '.%d.tmp'%os.getpid(), 'w') as f:
+        json.dump(order_metadata, f, indent=2)
+    os.replace(path + '.%d.tmp'%os.getpid(), path)
+
+def composed_mapping(order: int, folder: str = HIERARCHY_FOLDER) -> pd.DataFrame:
+    """The cluster of each base region at an order, with base regions in the 'index' column and clusters in the 'cluster_name' column,
+    as in clustering.gpkg"""
+    hierarchy, metadata = load_hierarchy(folder)
+    if hierarchy is None or not('order_%d'%order in hierarchy.columns):
+        raise FileNotFoundError('No order %d clustering in %s'%(order, folder))
+
+    return (
+        hierarchy[['base', 'order_%d'%order]]
+        .dropna()
+        .rename(columns={'base' : 'index', 'order_%d'%order : 'cluster_name'})
+    )
+
+
+#%% ------------------------------- ###
+###          2. Aggregation         ###
+### ------------------------------- ###
+
+def collapse_adjacency(adjacency: sparse.spmatrix,
+                       nodes: np.ndarray,
+                       mapping: pd.Series) -> tuple[sparse.csr_matrix, pd.Index]:
+    """Connect clusters containing connected regions
+
+    Args:
+        adjacency (sparse.spmatrix): The connectivity between regions
+        nodes (np.ndarray): The regions in the order of the adjacency
+        mapping (pd.Series): The cluster of each region (index)
+
+    Returns:
+        tuple[sparse.csr_matrix, pd.Index]: The 0/1 adjacency between clusters and its (sorted) clusters
+    """
+    clusters = pd.Series(nodes).map(mapping)
+    keep = clusters.notna().values
+    codes, cluster_nodes = pd.factorize(clusters[keep], sort=True)
+    membership = sparse.csr_matrix((np.ones(len(codes)), (np.flatnonzero(keep), codes)),
+                                   shape=(len(nodes), len(cluster_nodes)))
+
+    collapsed = (membership.T @ sparse.csr_matrix(adjacency) @ membership).tocsr()
+    collapsed.setdiag(0)
+    collapsed.eliminate_zeros()
+    collapsed.data[:] = 1
+
+    return collapsed, pd.Index(cluster_nodes)
+
+def aggregate_features(features: np.ndarray,
+                       nodes: np.ndarray,
+                       feature_names: list,
+                       aggfuncs: dict,
+                       mapping: pd.Series) -> pd.DataFrame:
+    """Aggregate features of regions to clusters
+
+    Args:
+        features (np.ndarray): The (regions x features) matrix
+        nodes (np.ndarray): The regions in the order of the rows
+        feature_names (list): The names of the columns
+        aggfuncs (dict): Aggregation function of each feature name. Compressed timeseries (e.g. WND_VAR_T_0, WND_VAR_T_1, ...) 
+            can not be aggregated this way and must be compressed again from the profiles of the clusters
+        mapping (pd.Series): The cluster of each region (index)
+
+    Returns:
+        pd.DataFrame: The features of each cluster (index)
+    """
+    df = pd.DataFrame(features, index=nodes, columns=feature_names)
+    clusters = pd.Series(nodes, index=nodes).map(mapping)
+    aggfunc = {name : aggfuncs[name] for name in feature_names}
+
+    return df.groupby(clusters.values).agg(aggfunc)
@@ -0,0 +1,205 @@
+"""
+Clustering Backends
+
+Registry of clustering methods with a common interface: cluster labels of each region from the (regions x features) matrix
+and an optional sparse connectivity graph. Connectivity-constrained Ward keeps clusters contiguous, while spectral clustering
+on the adjacency graph and mini-batch k-means scale to node counts where the memory use of Ward does not.
+The profile_shape backend clusters full hourly profiles by their correlation instead
+
+Created on 17.10.2026
+@author: Mathias Berg Rosendal, PhD Student at DTU Management (Energy Economics & Modelling)
+"""
+#%% ------------------------------- ###
+###        0. Script Settings       ###
+### ------------------------------- ###
+
+import numpy as np
+from scipy import sparse
+from sklearn.cluster import AgglomerativeClustering, SpectralClustering, MiniBatchKMeans, kmeans_plusplus
+from sklearn.metrics import pairwise_distances_argmin, pairwise_distances_chunked
+
+#%% ------------------------------- ###
+###            1. Backends          ###
+### ------------------------------- ###
+
+def ward_labels(Y: np.ndarray,
+                n_clusters: int,
+                connectivity: sparse.csr_matrix = None,
+                linkage: str = 'Ward',
+                seed: int = 0) -> np.ndarray:
+    """Agglomerative clustering, constrained to connected regions if a connectivity graph is given"""
+    agg = AgglomerativeClustering(n_clusters=n_clusters, linkage=linkage.lower(),
+                                  connectivity=connectivity)
+    return agg.fit(Y).labels_
+
+def spectral_labels(Y: np.ndarray,
+                    n_clusters: int,
+                    connectivity: sparse.csr_matrix = None,
+                    linkage: str = 'Ward',
+                    seed: int = 0) -> np.ndarray:
+    """Spectral clustering of the connectivity graph, with connections weighted by the similarity of the features
+
+    Without connectivity, the graph of the 10 nearest neighbours in the feature space is used
+    """
+    if connectivity is None:
+        spectral = SpectralClustering(n_clusters=n_clusters, affinity='nearest_neighbors',
+                                      n_neighbors=min(10, len(Y) - 1), assign_labels='cluster_qr',
+                                      random_state=seed)
+        return spectral.fit(Y).labels_
+
+    # Gaussian similarity of connected regions, scaled by the median distance
+    connectivity = sparse.coo_matrix(connectivity)
+    distances = np.sum((Y[connectivity.row] - Y[connectivity.col])**2, axis=1)
+    scale = np.median(distances[distances > 0]) if np.any(distances > 0) else 1
+    affinity = sparse.csr_matrix((np.exp(-distances / scale), (connectivity.row, connectivity.col)),
+                                 shape=connectivity.shape)
+
+    spectral = SpectralClustering(n_clusters=n_clusters, affinity='precomputed',
+                                  assign_labels='cluster_qr', random_state=seed)
+    return spectral.fit(affinity).labels_
+
+def kmedoids_labels(Y: np.ndarray,
+                    n_clusters: int,
+                    connectivity: sparse.csr_matrix = None,
+                    linkage: str = 'Ward',
+                    seed: int = 0,
+                    max_iter: int = 100) -> np.ndarray:
+    """K-medoids (alternating) clustering, where each cluster is represented by one of its regions
+
+    Distances are computed in chunks, so no (regions x regions) matrix is needed. The connectivity is not used
+    """
+    centers, medoids = kmeans_plusplus(Y, n_clusters, random_state=seed)
+    for i in range(max_iter):
+        labels = pairwise_distances_argmin(Y, Y[medoids])
+
+        # The member with the smallest total distance to the other members becomes the medoid
+        new_medoids = medoids.copy()
+        for group in range(n_clusters):
+            members = np.flatnonzero(labels == group)
+            if len(members) == 0:
+                continue
+            costs = np.concatenate(list(pairwise_distances_chunked(Y[members],
+                                                                   reduce_func=lambda D, start: D.sum(axis=1))))
+            new_medoids[group] = members[np.argmin(costs)]
+
+        if np.all(new_medoids == medoids):
+            break
+        medoids = new_medoids
+
+    return pairwise_distances_argmin(Y, Y[medoids])
+
+def minibatch_labels(Y: np.ndarray,
+                     n_clusters: int,
+                     connectivity: sparse.csr_matrix = None,
+                     linkage: str = 'Ward',
+                     seed: int = 0) -> np.ndarray:
+    """Mini-batch k-means, suited for many regions or long feature vectors such as hourly profiles
+
+    The connectivity is not used
+    """
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=min(4096, len(Y)),
+                             n_init=3, random_state=seed)
+    return kmeans.fit_predict(Y)
+
+def profile_shape_labels(Y: np.ndarray,
+                         n_clusters: int,
+                         connectivity: sparse.csr_matrix = None,
+                         linkage: str = 'Ward',
+                         seed: int = 0,
+                         profiles: list = None,
+                         max_iter: int = 100,
+                         chunksize: int = 1000) -> np.ndarray:
+    """K-means of full hourly profiles with their correlation as similarity, so regions are clustered by the shape 
+    and not the level of their profiles. With several timeseries, the correlations of each are averaged
+
+    The profiles must be z-normalised (see profile_features.shape_normalise), so the correlation is a dot product
+    and the centre of a cluster is the normalised sum of its profiles (spherical k-means). 
+    Correlations are computed for chunks of regions. The features in Y and the connectivity are not used
+
+    Args:
+        profiles (list): A z-normalised (regions x timesteps) float32 matrix per timeseries, with regions in the order of Y
+    """
+    if not(profiles):
+        raise ValueError('The profile_shape backend needs timeseries in the cluster params, e.g. DE_VAR_T, WND_VAR_T or SOLE_VAR_T')
+    n_regions = len(profiles[0])
+
+    def similarity(centres: list) -> np.ndarray:
+        """Mean correlation (regions x centres) of the profiles with the centres of each timeseries"""
+        result = np.zeros((n_regions, len(centres[0])))
+        for block, block_centres in zip(profiles, centres):
+            for start in range(0, n_regions, chunksize):
+                result[start:start+chunksize] += block[start:start+chunksize] @ block_centres.T
+        return result / len(profiles)
+
+    # Initial centres as k-means++, drawing regions with probability proportional to 1 - correlation with the nearest centre
+    rng = np.random.default_rng(seed)
+    chosen = [rng.integers(n_regions)]
+    nearest = similarity([block[chosen] for block in profiles])[:, 0]
+    for i in range(1, n_clusters):
+        distance = np.clip(1 - nearest, 0, None)
+        chosen.append(rng.choice(n_regions, p=distance / distance.sum()) if distance.sum() > 0 else rng.integers(n_regions))
+        nearest = np.maximum(nearest, similarity([block[chosen[-1:]] for block in profiles])[:, 0])
+    centres = [block[chosen].astype(np.float64) for block in profiles]
+
+    labels = None
+    for i in range(max_iter):
+        correlations = similarity(centres)
+        new_labels = correlations.argmax(axis=1)
+
+        # Empty clusters get the regions least correlated with their centre
+        empty = np.setdiff1d(np.arange(n_clusters), new_labels)
+        if len(empty) > 0:
+            new_labels[np.argsort(correlations[np.arange(n_regions), new_labels])[:len(empty)]] = empty
+
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+
+        # Normalised sums of the members
+        members = sparse.csr_matrix((np.ones(n_regions), (labels, np.arange(n_regions))), shape=(n_clusters, n_regions))
+        centres = [members @ block.astype(np.float64) for block in profiles]
+        for block_centres in centres:
+            norms = np.linalg.norm(block_centres, axis=1, keepdims=True)
+            np.divide(block_centres, norms, out=block_centres, where=norms > 0)
+
+    return labels
+
+BACKENDS = {
+    'ward' : ward_labels,
+    'spectral' : spectral_labels,
+    'kmedoids' : kmedoids_labels,
+    'minibatch_kmeans' : minibatch_labels,
+    'profile_shape' : profile_shape_labels
+}
+
+def cluster_labels(Y: np.ndarray,
+                   n_clusters: int,
+                   backend: str = 'ward',
+                   connectivity: sparse.csr_matrix = None,
+                   linkage: str = 'Ward',
+                   seed: int = 0,
+                   profiles: list = None) -> np.ndarray:
+    """Cluster the regions (rows) of Y with one of the backends
+
+    Args:
+        Y (np.ndarray): The normalised (regions x features) matrix
+        n_clusters (int): The amount of clusters
+        backend (str, optional): 'ward', 'spectral', 'kmedoids', 'minibatch_kmeans' or 'profile_shape'. Defaults to 'ward'.
+        connectivity (sparse.csr_matrix, optional): Connections between regions, used by ward and spectral. Defaults to None.
+        linkage (str, optional): The linkage of the ward backend. Defaults to 'Ward'.
+        seed (int, optional): Random state of the stochastic backends. Defaults to 0.
+        profiles (list, optional): Z-normalised hourly profiles in the order of Y, used by profile_shape. Defaults to None.
+
+    Returns:
+        np.ndarray: The cluster of each region, from 0 to n_clusters-1
+    """
+    if not(backend in BACKENDS):
+        raise ValueError('Clustering backend %s not supported, choose between %s'%(backend, ', '.join(BACKENDS)))
+
+    if connectivity is not None and backend in ['kmedoids', 'minibatch_kmeans', 'profile_shape']:
+        print('Note: The %s backend does not use the connectivity, so clusters may not be contiguous'%backend)
+
+    if backend == 'profile_shape':
+        return profile_shape_labels(Y, n_clusters, connectivity, linkage, seed, profiles)
+
+    return BACKENDS[backend](Y, n_clusters, connectivity, linkage, seed)
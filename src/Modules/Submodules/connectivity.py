@@ -0,0 +1,137 @@
+"""
+Connectivity
+
+Sparse adjacency matrices between regions for connectivity-constrained clustering,
+derived from Balmorel grid data, polygon touches, Delaunay triangulation or k-nearest neighbours of centroids,
+so no dense N x N matrix is needed for fine spatial resolutions
+
+Created on 17.10.2026
+@author: Mathias Berg Rosendal, PhD Student at DTU Management (Energy Economics & Modelling)
+"""
+#%% ------------------------------- ###
+###        0. Script Settings       ###
+### ------------------------------- ###
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import xarray as xr
+import shapely
+from scipy import sparse
+from scipy.spatial import Delaunay
+from sklearn.neighbors import NearestNeighbors
+
+METHODS = ['balmorel', 'touches', 'delaunay', 'knn']
+PROJECTION = 'EPSG:3035' # For distances between centroids
+
+#%% ------------------------------- ###
+###       1. Sparse Adjacency       ###
+### ------------------------------- ###
+
+def edges_to_adjacency(rows: np.ndarray, columns: np.ndarray, n_nodes: int) -> sparse.csr_matrix:
+    """Symmetric 0/1 adjacency matrix from a list of edges, without self-connections"""
+    keep = rows != columns
+    adjacency = sparse.csr_matrix((np.ones(keep.sum()), (rows[keep], columns[keep])),
+                                  shape=(n_nodes, n_nodes))
+    adjacency = adjacency.maximum(adjacency.T)
+    adjacency.data[:] = 1
+    return adjacency
+
+def reindex_adjacency(adjacency: sparse.spmatrix, nodes: pd.Index, new_nodes: pd.Index) -> sparse.csr_matrix:
+    """Reorder an adjacency matrix to new_nodes, dropping nodes not in new_nodes and adding unconnected ones"""
+    adjacency = adjacency.tocoo()
+    position = pd.Index(new_nodes).get_indexer(nodes)
+    keep = (position[adjacency.row] != -1) & (position[adjacency.col] != -1)
+    return sparse.csr_matrix((adjacency.data[keep], (position[adjacency.row[keep]], position[adjacency.col[keep]])),
+                             shape=(len(new_nodes), len(new_nodes)))
+
+def touches_adjacency(geometries: gpd.GeoSeries) -> sparse.csr_matrix:
+    """Connect polygons that touch or overlap, found with the spatial index (STRtree)
+
+    Polygons touching no other polygon (e.g. islands) are connected to the nearest centroid,
+    so they are not left out of the connectivity graph
+    """
+    rows, columns = shapely.STRtree(geometries.values).query(geometries.values, predicate='intersects')
+    adjacency = edges_to_adjacency(rows, columns, len(geometries))
+
+    isolated = np.flatnonzero(adjacency.getnnz(axis=1) == 0)
+    if len(isolated) > 0 and len(geometries) > 1:
+        points = centroid_coordinates(geometries)
+        distances, neighbours = NearestNeighbors(n_neighbors=2).fit(points).kneighbors(points[isolated])
+        adjacency = adjacency + edges_to_adjacency(isolated, neighbours[:, 1], len(geometries))
+        adjacency.data[:] = 1
+
+    return adjacency
+
+def delaunay_adjacency(geometries: gpd.GeoSeries) -> sparse.csr_matrix:
+    """Connect centroids that share an edge in the Delaunay triangulation"""
+    points = centroid_coordinates(geometries)
+    if len(points) < 4:
+        # Too few points to triangulate, so everything is connected
+        rows, columns = np.meshgrid(np.arange(len(points)), np.arange(len(points)))
+        return edges_to_adjacency(rows.ravel(), columns.ravel(), len(points))
+
+    simplices = Delaunay(points).simplices
+    rows = np.concatenate([simplices[:, i] for i in [0, 1, 2]])
+    columns = np.concatenate([simplices[:, i] for i in [1, 2, 0]])
+    return edges_to_adjacency(rows, columns, len(points))
+
+def knn_adjacency(geometries: gpd.GeoSeries, n_neighbours: int = 4) -> sparse.csr_matrix:
+    """Connect each centroid to its n_neighbours nearest centroids (symmetric)"""
+    points = centroid_coordinates(geometries)
+    n_neighbours = min(n_neighbours, len(points) - 1)
+    distances, neighbours = NearestNeighbors(n_neighbors=n_neighbours + 1).fit(points).kneighbors(points)
+    rows = np.repeat(np.arange(len(points)), n_neighbours + 1)
+    return edges_to_adjacency(rows, neighbours.ravel(), len(points))
+
+def centroid_coordinates(geometries: gpd.GeoSeries) -> np.ndarray:
+    """(x, y) of centroids in meters"""
+    if geometries.crs is not None:
+        geometries = geometries.to_crs(PROJECTION)
+    centroids = geometries.centroid
+    return np.column_stack((centroids.x.values, centroids.y.values))
+
+def edge_list_adjacency(df: pd.DataFrame, from_column: str, to_column: str) -> tuple[sparse.csr_matrix, pd.Index]:
+    """Adjacency from a long table of connections, e.g. XINVCOST with IRRRE and IRRRI columns
+
+    Returns:
+        tuple[sparse.csr_matrix, pd.Index]: The adjacency and its (sorted) nodes
+    """
+    nodes = pd.Index(np.unique(np.concatenate((df[from_column].unique(), df[to_column].unique()))))
+    return edges_to_adjacency(nodes.get_indexer(df[from_column]), nodes.get_indexer(df[to_column]), len(nodes)), nodes
+
+def dataset_adjacency(connection: xr.DataArray) -> tuple[sparse.csr_matrix, pd.Index]:
+    """Adjacency from a (IRRRE, IRRRI) connection matrix, keeping its values
+
+    Returns:
+        tuple[sparse.csr_matrix, pd.Index]: The adjacency and its nodes
+    """
+    connection = connection.fillna(0)
+    nodes = pd.Index(connection.coords['IRRRE'].data)
+    connection = connection.reindex(IRRRI=nodes, fill_value=0).transpose('IRRRE', 'IRRRI')
+    return sparse.csr_matrix(connection.data), nodes
+
+def apply_corrections(adjacency: sparse.spmatrix, nodes: pd.Index, manual_corrections: list) -> sparse.csr_matrix:
+    """Set connections, e.g. [['Koebenhavn', 'Frederiksberg', 1], ...], in both directions"""
+    if len(manual_corrections) == 0:
+        return adjacency.tocsr()
+
+    adjacency = adjacency.tolil()
+    for from_node, to_node, value in manual_corrections:
+        i, j = nodes.get_loc(from_node), nodes.get_loc(to_node)
+        adjacency[i, j] = value
+        adjacency[j, i] = value
+    adjacency = adjacency.tocsr()
+    adjacency.eliminate_zeros()
+    return adjacency
+
+def geometric_adjacency(geometries: gpd.GeoSeries, method: str, n_neighbours: int = 4) -> sparse.csr_matrix:
+    """Adjacency between polygons by the touches, delaunay or knn method"""
+    if method == 'touches':
+        return touches_adjacency(geometries)
+    elif method == 'delaunay':
+        return delaunay_adjacency(geometries)
+    elif method == 'knn':
+        return knn_adjacency(geometries, n_neighbours)
+    else:
+        raise ValueError('Connectivity method %s not supported, choose between %s'%(method, ', '.join(METHODS[1:])))
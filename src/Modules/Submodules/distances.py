@@ -0,0 +1,128 @@
+"""
+Distances
+
+Distances between the centroids of regions - projected (Euclidean), great-circle or along the connections between regions -
+computed once per geofile and cached to disk as float32, so transmission and fuel transport costs derive from the same matrix.
+Connected pairs can be extracted as a sparse matrix
+
+Created on 17.10.2026
+@author: Mathias Berg Rosendal, PhD Student at DTU Management (Energy Economics & Modelling)
+"""
+#%% ------------------------------- ###
+###        0. Script Settings       ###
+### ------------------------------- ###
+
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from scipy import sparse
+from scipy.sparse.csgraph import shortest_path
+from scipy.spatial.distance import cdist
+
+DISTANCE_FOLDER = os.path.join('Data', 'Distances')
+METHODS = ['projected', 'great_circle', 'network']
+PROJECTION = 4328 # Metric coordinates for projected distances, as used for the Balmorel grid data
+EARTH_RADIUS = 6371008.8 # Mean radius in m
+
+#%% ------------------------------- ###
+###          1. Distances           ###
+### ------------------------------- ###
+
+def centroid_coordinates(geometries: gpd.GeoSeries, crs=PROJECTION) -> np.ndarray:
+    """(x, y) of the centroids of geometries in crs"""
+    centroids = shapely.centroid(geometries.to_crs(crs).values)
+    return np.column_stack((shapely.get_x(centroids), shapely.get_y(centroids)))
+
+def projected_distances(geometries: gpd.GeoSeries) -> np.ndarray:
+    """Euclidean distance (m) between centroids in the projected crs"""
+    points = centroid_coordinates(geometries)
+    return cdist(points, points)
+
+def great_circle_distances(geometries: gpd.GeoSeries) -> np.ndarray:
+    """Haversine distance (m) between centroids, where centroids are found in an equal area projection"""
+    centroids = gpd.GeoSeries(shapely.centroid(geometries.to_crs(6933).values), crs=6933).to_crs(4326)
+    lon, lat = np.radians(centroids.x.values), np.radians(centroids.y.values)
+    dlon = lon[:, None] - lon[None, :]
+    dlat = lat[:, None] - lat[None, :]
+    a = np.sin(dlat/2)**2 + np.cos(lat[:, None])*np.cos(lat[None, :])*np.sin(dlon/2)**2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def network_distances(geometries: gpd.GeoSeries, connectivity: sparse.spmatrix) -> np.ndarray:
+    """Shortest distance (m) along connected regions, where each connection has the projected distance between centroids.
+    Infinite between regions that are not connected through the network"""
+    connectivity = sparse.coo_matrix(connectivity)
+    points = centroid_coordinates(geometries)
+    lengths = np.linalg.norm(points[connectivity.row] - points[connectivity.col], axis=1)
+    graph = sparse.csr_matrix((lengths, (connectivity.row, connectivity.col)), shape=connectivity.shape)
+    return shortest_path(graph, method='D', directed=False)
+
+def distance_hash(geometries: gpd.GeoSeries, method: str, connectivity: sparse.spmatrix = None) -> str:
+    """Identify a distance matrix by the method, region names, polygons and (for network distances) connections"""
+    sha = hashlib.sha256(method.encode())
+    sha.update(str(geometries.crs).encode())
+    sha.update('\n'.join(geometries.index.astype(str)).encode())
+    for wkb in shapely.to_wkb(geometries.values):
+        sha.update(wkb)
+    if connectivity is not None:
+        connectivity = sparse.csr_matrix(connectivity)
+        connectivity.sort_indices()
+        for array in [connectivity.indptr, connectivity.indices]:
+            sha.update(array.astype(np.int64).tobytes())
+    return sha.hexdigest()
+
+def distance_matrix(geofile: gpd.GeoDataFrame,
+                    method: str = 'projected',
+                    connectivity: sparse.spmatrix = None,
+                    cache_folder: str = DISTANCE_FOLDER) -> pd.DataFrame:
+    """Get the distances (m) between the centroids of all regions in a geofile,
+    computing them if they have not been cached before
+
+    Args:
+        geofile (gpd.GeoDataFrame): The regions, with region names as index
+        method (str, optional): 'projected', 'great_circle' or 'network'. Defaults to 'projected'.
+        connectivity (sparse.spmatrix, optional): Connections between regions, in the order of the geofile, for network distances. Defaults to None.
+        cache_folder (str, optional): Where to cache the matrix. Defaults to Data/Distances.
+
+    Returns:
+        pd.DataFrame: The float32 (regions x regions) distances
+    """
+    if not(method in METHODS):
+        raise ValueError('Method %s not supported, choose between %s'%(method, ', '.join(METHODS)))
+    if method == 'network' and connectivity is None:
+        raise ValueError('Network distances need the connectivity between regions')
+
+    geometries = geofile.geometry
+    path = os.path.join(cache_folder, '%s.npy'%distance_hash(geometries, method, connectivity if method == 'network' else None))
+    if os.path.exists(path):
+        distances = np.load(path)
+    else:
+        if method == 'projected':
+            distances = projected_distances(geometries)
+        elif method == 'great_circle':
+            distances = great_circle_distances(geometries)
+        else:
+            distances = network_distances(geometries, connectivity)
+        distances = distances.astype(np.float32)
+
+        # Write to a temporary file first, so an interrupted write is never used
+        os.makedirs(cache_folder, exist_ok=True)
+        temp_path = path + '.%d.tmp'%os.getpid()
+        with open(temp_path, 'wb') as f:
+            np.save(f, distances)
+        os.replace(temp_path, path)
+
+    return pd.DataFrame(distances, index=geofile.index, columns=geofile.index)
+
+def connected_distances(distances: pd.DataFrame, connectivity: pd.DataFrame) -> sparse.coo_matrix:
+    """Distances of connected pairs only, as a sparse matrix in the order of distances
+
+    Args:
+        distances (pd.DataFrame): The (regions x regions) distances
+        connectivity (pd.DataFrame): Connections (non-zero) between regions, with region names as index and columns
+    """
+    connectivity = connectivity.reindex(index=distances.index, columns=distances.columns).fillna(0)
+    rows, columns = np.nonzero(connectivity.values)
+    return sparse.coo_matrix((distances.values[rows, columns], (rows, columns)), shape=distances.shape)
@@ -0,0 +1,97 @@
+"""
+Feature Cache
+
+Stores the prepared input of a clustering - the feature matrix before and after scaling, the scaler parameters,
+the node order and the sparse connectivity - as one .npz file, so clustering experiments with other cluster sizes,
+linkages or backends can skip gathering and preparing the data
+
+Created on 17.10.2026
+@author: Mathias Berg Rosendal, PhD Student at DTU Management (Energy Economics & Modelling)
+"""
+#%% ------------------------------- ###
+###        0. Script Settings       ###
+### ------------------------------- ###
+
+import os
+import json
+import hashlib
+import numpy as np
+from scipy import sparse
+from typing import Union
+
+FEATURE_CACHE_FOLDER = os.path.join('Data', 'BalmorelData', 'FeatureCache')
+FEATURE_CACHE_VERSION = 1 # Increase when the preparation of features changes, so old files are not used
+
+#%% ------------------------------- ###
+###          1. Functions           ###
+### ------------------------------- ###
+
+def feature_key(**settings) -> str:
+    """Identify prepared features by everything they were made from, e.g. cluster params, aggregation functions,
+    GDX hash and geofile"""
+    settings['version'] = FEATURE_CACHE_VERSION
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+def save_features(path: str,
+                  nodes: np.ndarray,
+                  feature_names: list,
+                  features: np.ndarray,
+                  Y: np.ndarray,
+                  mean: np.ndarray,
+                  scale: np.ndarray,
+                  connectivity: Union[sparse.csr_matrix, None]):
+    """Save prepared features
+
+    Args:
+        path (str): The .npz file
+        nodes (np.ndarray): The regions, in the order of the rows
+        feature_names (list): The names of the columns
+        features (np.ndarray): The (regions x features) matrix before scaling
+        Y (np.ndarray): The scaled matrix used for clustering
+        mean (np.ndarray): The mean of each feature used for scaling
+        scale (np.ndarray): The standard deviation of each feature used for scaling
+        connectivity (sparse.csr_matrix, None): Connections between regions, None if no connectivity is used
+    """
+    arrays = {'version' : np.array(FEATURE_CACHE_VERSION),
+              'nodes' : np.asarray(nodes, dtype=str),
+              'feature_names' : np.asarray(feature_names, dtype=str),
+              'features' : features,
+              'Y' : Y,
+              'mean' : mean,
+              'scale' : scale,
+              'has_connectivity' : np.array(connectivity is not None)}
+    if connectivity is not None:
+        connectivity = sparse.csr_matrix(connectivity)
+        arrays.update({'connectivity_data' : connectivity.data,
+                       'connectivity_indices' : connectivity.indices,
+                       'connectivity_indptr' : connectivity.indptr})
+
+    # Write to a temporary file first, so an interrupted write is never used
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.%d.tmp'%os.getpid()
+    with open(temp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(temp_path, path)
+
+def load_features(path: str) -> Union[dict, None]:
+    """Load prepared features, or None if they do not exist or are from another version
+
+    Returns:
+        dict: nodes, feature_names, features, Y, mean, scale and connectivity as given to save_features
+    """
+    if not(os.path.exists(path)):
+        return None
+
+    with np.load(path) as arrays:
+        if int(arrays['version']) != FEATURE_CACHE_VERSION:
+            return None
+
+        features = {name : arrays[name] for name in ['nodes', 'feature_names', 'features', 'Y', 'mean', 'scale']}
+        features['connectivity'] = None
+        if bool(arrays['has_connectivity']):
+            features['connectivity'] = sparse.csr_matrix((arrays['connectivity_data'],
+                                                          arrays['connectivity_indices'],
+                                                          arrays['connectivity_indptr']),
+                                                         shape=(len(features['nodes']), len(features['nodes'])))
+
+    return features
@@ -0,0 +1,308 @@
+"""
+Writing .inc Files
+
+Streams large GAMS tables to .inc files in chunks, instead of materialising DataFrame.to_string(),
+or writes them to .gdx files loaded by a small .inc stub if BALMOREL_OUTPUT_FORMAT=gdx
+
+Created on 17.10.2026
+@author: Mathias Berg Rosendal, PhD Student at DTU Management (Energy Economics & Modelling)
+"""
+#%% ------------------------------- ###
+###        0. Script Settings       ###
+### ------------------------------- ###
+
+import os
+import re
+import numpy as np
+import pandas as pd
+import pybalmorel
+from typing import TextIO
+
+CHUNKSIZE = 1000 # Rows formatted at a time
+OUTPUT_FORMAT = os.environ.get('BALMOREL_OUTPUT_FORMAT', 'inc').lower() # inc or gdx
+FLOAT_FORMAT = os.environ.get('BALMOREL_FLOAT_FORMAT', 'fixed').lower() # fixed (as DataFrame.to_string) or exact (full precision)
+PRECISION = 6 # Decimals of fixed floats, as DataFrame.to_string
+TABLE_DECLARATION = re.compile(r"^\s*TABLE\s+(\w+)\s*\(([^)]*)\)(.*)$", re.MULTILINE | re.IGNORECASE)
+PARAMETER_DECLARATION = re.compile(r"^\s*PARAMETER\s+(\w+)\s*\(([^)]*)\)(.*)$", re.MULTILINE | re.IGNORECASE)
+
+#%% ------------------------------- ###
+###       1. Table Formatting       ###
+### ------------------------------- ###
+
+def flat_labels(labels: pd.Index) -> np.ndarray:
+    """Labels as strings, where the levels of a MultiIndex are joined with ' . ' like pybalmorel.IncFile.body_prepare"""
+    if not(isinstance(labels, pd.MultiIndex)):
+        return labels.to_numpy().astype(str)
+
+    strings = labels.get_level_values(0).to_numpy().astype(str)
+    for level in range(1, labels.nlevels):
+        strings = np.char.add(np.char.add(strings, ' . '), labels.get_level_values(level).to_numpy().astype(str))
+    return strings
+
+def exponential_column(values: np.ndarray) -> bool:
+    """Whether DataFrame.to_string writes a float column in scientific notation, i.e. if it has values closer to zero than the precision,
+    or values above 1e6 and more than PRECISION + 6 characters after removing the trailing zeros that all values share"""
+    if values.dtype.kind != 'f':
+        return False
+    with np.errstate(invalid='ignore'):
+        absolute = np.abs(values)
+        if ((absolute < 10.0**-PRECISION) & (absolute > 0)).any():
+            return True
+        if not((absolute > 1e6).any()):
+            return False
+
+    finite = values[np.isfinite(values)]
+    strings = np.char.mod('%% .%df'%PRECISION, finite)
+    lengths = np.char.str_len(strings)
+    trim = min((lengths - np.char.str_len(np.char.rstrip(strings, '0'))).min(initial=PRECISION), PRECISION - 1)
+    return bool(lengths.max(initial=0) - trim > PRECISION + 6)
+
+def fixed_decimals(values: np.ndarray) -> int:
+    """Decimals DataFrame.to_string writes a float column with, i.e. PRECISION less the trailing zeros that all values share, leaving one"""
+    if values.dtype.kind != 'f':
+        return PRECISION
+    strings = np.char.mod('%%.%df'%PRECISION, values[np.isfinite(values)])
+    shared = (np.char.str_len(strings) - np.char.str_len(np.char.rstrip(strings, '0'))).min(initial=PRECISION)
+    return max(PRECISION - int(shared), 1)
+
+def trim_zeros(strings: np.ndarray) -> np.ndarray:
+    """Remove trailing zeros after the decimal point, leaving one"""
+    strings = np.char.rstrip(strings, b'0')
+    return np.where(np.char.endswith(strings, b'.'), np.char.add(strings, b'0'), strings)
+
+def format_values(values: np.ndarray, exponential: bool = False, float_format: str = FLOAT_FORMAT,
+                  decimals: int = None) -> np.ndarray:
+    """Format a column of values as GAMS readable ASCII strings
+
+    Floats are written like DataFrame.to_string, i.e. with the decimals of the column (see fixed_decimals),
+    or with 6 decimals and no trailing zeros if decimals is None, in scientific notation if exponential is True
+    (see exponential_column), or with the shortest representation that reads back to the same number if float_format is 'exact'.
+    Missing values are left empty and infinite values are written as INF
+    """
+    if values.dtype.kind == 'f':
+        if float_format == 'exact':
+            strings = values.astype('S32')
+        elif exponential:
+            strings = np.char.mod('%%.%de'%PRECISION, values).astype('S')
+        elif decimals is None:
+            strings = trim_zeros(np.char.mod('%%.%df'%PRECISION, values).astype('S'))
+        else:
+            strings = np.char.mod('%%.%df'%decimals, values).astype('S')
+        strings = strings.astype('S%d'%max(strings.dtype.itemsize, 4)) # Room for -INF
+        strings[np.isnan(values)] = b''
+        strings[np.isposinf(values)] = b'INF'
+        strings[np.isneginf(values)] = b'-INF'
+    elif values.dtype.kind in 'iub':
+        strings = values.astype('S')
+    else:
+        # Mixed types, e.g. numbers with '' or 'EPS', where DataFrame.to_string formats each float with 6 decimals
+        strings = values.astype(str).astype(object)
+        floats = np.frompyfunc(lambda value: isinstance(value, (float, np.floating)), 1, 1)(values).astype(bool)
+        strings[floats] = format_values(pd.to_numeric(values[floats], errors='coerce').astype(float),
+                                        float_format=float_format).astype(str)
+        strings[(strings == 'nan') | (strings == 'None')] = ''
+        strings = strings.astype('S')
+
+    return strings
+
+def to_chars(strings: np.ndarray) -> np.ndarray:
+    """Convert ASCII strings to a (rows, columns, characters) array of character codes, 0 after the end of a value"""
+    chars = np.ascontiguousarray(strings).view(np.uint8).reshape(strings.shape + (strings.dtype.itemsize,))
+    return chars[..., :max(1, (chars != 0).sum(axis=2).max(initial=0))]
+
+def align_rows(chars: np.ndarray, widths: np.ndarray, separator: int = 2) -> np.ndarray:
+    """Right-align values in columns of the given widths, returning one line of character codes per row"""
+    n_rows, n_columns, itemsize = chars.shape
+    lengths = (chars != 0).sum(axis=2)
+    lines = np.full((n_rows, int((widths + separator).sum())), ord(' '), dtype=np.uint8)
+    rows = np.arange(n_rows)[:, None]
+    offset = 0
+    for j, width in enumerate(widths):
+        offset += separator
+        position = np.arange(width)[None, :] - (width - lengths[:, j])[:, None]
+        block = chars[rows, j, np.clip(position, 0, itemsize - 1)]
+        lines[:, offset:offset+width] = np.where(position >= 0, block, ord(' '))
+        offset += width
+    return lines
+
+def write_table(f: TextIO, df: pd.DataFrame, chunksize: int = CHUNKSIZE):
+    """Write the body of a GAMS table, i.e. a header with the columns and a line per index
+
+    The layout is similar to DataFrame.to_string(), with values right-aligned under their column
+    and the levels of a MultiIndex joined with ' . '. Values are formatted with NumPy in chunks of rows, 
+    and kept as one byte per character until the widths of all columns are known
+
+    Args:
+        f (TextIO): The open file
+        df (pd.DataFrame): The table
+        chunksize (int, optional): Number of rows formatted at a time. Defaults to 1000.
+    """
+    index = flat_labels(df.index)
+    columns = flat_labels(df.columns)
+    index_width = np.char.str_len(index).max(initial=0)
+    exponential = [exponential_column(df.iloc[:, j].to_numpy()) for j in range(len(columns))]
+    decimals = [fixed_decimals(df.iloc[:, j].to_numpy()) for j in range(len(columns))]
+
+    # Format values and get widths of columns, so values are placed under their column name
+    widths = np.char.str_len(columns)
+    chunks = []
+    for start in range(0, len(df), chunksize):
+        chunk = df.iloc[start:start+chunksize]
+        strings = [format_values(chunk.iloc[:, j].to_numpy(), exponential[j], decimals=decimals[j]) for j in range(len(columns))]
+        chars = to_chars(np.column_stack(strings) if len(strings) > 0 else np.empty((len(chunk), 0), dtype='S1'))
+        widths = np.maximum(widths, (chars != 0).sum(axis=2).max(axis=0, initial=0))
+        chunks.append(chars)
+
+    # Header
+    f.write(' '*index_width)
+    for column, width in zip(columns, widths):
+        f.write('  ' + column.rjust(width))
+
+    # Rows
+    for start, chars in zip(range(0, len(df), chunksize), chunks):
+        lines = align_rows(chars, widths)
+        lines = lines.view('S%d'%lines.shape[1]).ravel().astype(str) if lines.shape[1] else np.full(len(lines), '')
+        labels = np.char.ljust(index[start:start+chunksize], index_width)
+        f.write('\n' + '\n'.join(map(''.join, zip(labels.tolist(), lines.tolist()))))
+
+def write_records(f: TextIO, records: pd.DataFrame, chunksize: int = CHUNKSIZE):
+    """Write the body of a GAMS parameter list, i.e. a 'label . label  value' line per record
+
+    Args:
+        f (TextIO): The open file
+        records (pd.DataFrame): A column per set and the values in the last column
+        chunksize (int, optional): Number of rows formatted at a time. Defaults to 1000.
+    """
+    exponential = exponential_column(records.iloc[:, -1].to_numpy())
+    decimals = fixed_decimals(records.iloc[:, -1].to_numpy())
+    for start in range(0, len(records), chunksize):
+        chunk = records.iloc[start:start+chunksize]
+        labels = chunk.iloc[:, 0].to_numpy().astype(str)
+        for column in range(1, len(chunk.columns) - 1):
+            labels = np.char.add(np.char.add(labels, ' . '), chunk.iloc[:, column].to_numpy().astype(str))
+        values = format_values(chunk.iloc[:, -1].to_numpy(), exponential, decimals=decimals).astype(str)
+        f.write('\n'.join(np.char.add(np.char.add(labels, '  '), values).tolist()) + '\n')
+
+
+#%% ------------------------------- ###
+###         2. GDX Output           ###
+### ------------------------------- ###
+
+def split_labels(labels: pd.Index) -> pd.DataFrame:
+    """Split table labels like 'S01 . T001', or the levels of a MultiIndex, into a column per set"""
+    return pd.Series(flat_labels(labels)).str.strip().str.split(r'\s*\.\s*', expand=True, regex=True)
+
+def table_records(body: pd.DataFrame) -> pd.DataFrame:
+    """Convert a table to records with a column per set and a value column, skipping empty cells"""
+    rows = split_labels(body.index)
+    columns = split_labels(body.columns)
+    values = body.to_numpy()
+    if values.dtype.kind not in 'fiub':
+        # Mixed types, e.g. numbers with '' or 'EPS'
+        cells = pd.DataFrame(values)
+        eps = cells.astype(str).apply(lambda column: column.str.strip().str.upper()).eq('EPS').to_numpy()
+        values = cells.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float, copy=True)
+        values[eps] = -0.0 # gams.transfer writes -0.0 as EPS
+    values = values.astype(float)
+
+    # Long format, row by row
+    keep = ~np.isnan(values.ravel())
+    records = pd.concat((rows.loc[np.repeat(np.arange(len(rows)), len(columns))].reset_index(drop=True),
+                         columns.loc[np.tile(np.arange(len(columns)), len(rows))].reset_index(drop=True)),
+                        axis=1, ignore_index=True)
+    records['value'] = values.ravel()
+
+    return records.loc[keep].reset_index(drop=True)
+
+def save_gdx(name: str, path: str, prefix: str, body: pd.DataFrame, suffix: str):
+    """Write the table declared in the prefix to {name}.gdx, and an .inc stub that loads it
+
+    The TABLE declaration is replaced with a PARAMETER declaration and $LOADDC, 
+    so the remaining prefix and suffix (e.g. assignments and $onmulti includes) are kept as they are
+    """
+
+    declaration = TABLE_DECLARATION.search(prefix)
+    if declaration is None:
+        raise ValueError('No TABLE declaration found in the prefix of %s'%name)
+
+    save_gdx_records(name, path, prefix, declaration, table_records(body), suffix)
+
+def save_gdx_records(name: str, path: str, prefix: str, declaration: re.Match, records: pd.DataFrame, suffix: str):
+    """Write records (a column per set and a value column) of the symbol declared in the prefix to {name}.gdx,
+    and an .inc stub that loads it"""
+    import gams.transfer as gt
+
+    symbol = declaration.group(1)
+    domains = [domain.strip() for domain in declaration.group(2).split(',')]
+    text = declaration.group(3).strip()
+
+    records = records.copy()
+    if len(records.columns) - 1 != len(domains):
+        raise ValueError('The labels of %s do not match the domains %s'%(name, ', '.join(domains)))
+    records.columns = ['%s_%d'%(domain, i) for i, domain in enumerate(domains)] + ['value']
+
+    gdx_name = name.replace('.inc', '') + '.gdx'
+    container = gt.Container()
+    gt.Parameter(container, symbol, domain=domains, records=records, description=text.strip('"\''))
+    container.write(os.path.join(path, gdx_name), eps_to_zero=False)
+
+    stub = '\n'.join([
+        "PARAMETER %s(%s) %s;"%(symbol, ','.join(domains), text),
+        "$if     EXIST '../data/%s' $GDXIN '../data/%s'"%(gdx_name, gdx_name),
+        "$if not EXIST '../data/%s' $GDXIN '../../base/data/%s'"%(gdx_name, gdx_name),
+        "$LOADDC %s"%symbol,
+        "$GDXIN",
+        ""
+    ])
+
+    with open(os.path.join(path, name), 'w') as f:
+        f.write(prefix[:declaration.start()] + stub + prefix[declaration.end():].lstrip('\n'))
+        # The table was ended by ;
+        f.write(re.sub(r'^\s*;', '', suffix, count=1))
+
+
+#%% ------------------------------- ###
+###          3. .inc Files          ###
+### ------------------------------- ###
+
+class IncFile(pybalmorel.IncFile):
+    """pybalmorel.IncFile that streams a DataFrame body with write_table, 
+    or saves it to a .gdx file if BALMOREL_OUTPUT_FORMAT=gdx and the prefix declares a TABLE"""
+
+    def save(self):
+        if type(self.body) != pd.DataFrame:
+            return super().save()
+
+        if self.name[-4:] != '.inc':
+            self.name += '.inc'
+
+        if OUTPUT_FORMAT == 'gdx' and TABLE_DECLARATION.search(self.prefix):
+            return save_gdx(self.name, self.path, self.prefix, self.body, self.suffix)
+
+        with open(os.path.join(self.path, self.name), 'w', buffering=2**20) as f:
+            f.write(self.prefix)
+            write_table(f, self.body)
+            f.write(self.suffix)
+
+def save_parameter(name: str, path: str, declaration: str, records: pd.DataFrame, suffix: str = ''):
+    """Write a sparse parameter as a list with one line per record, e.g. connections between regions as 'IRRRE . IRRRI  value',
+    or to a .gdx file if BALMOREL_OUTPUT_FORMAT=gdx
+
+    Args:
+        name (str): The name of the .inc file
+        path (str): The folder
+        declaration (str): E.g. "PARAMETER XCOST(IRRRE,IRRRI) 'Transmission cost between regions (Money/MWh)'"
+        records (pd.DataFrame): A column per set and the values in the last column
+        suffix (str, optional): Written after the parameter. Defaults to ''.
+    """
+    if name[-4:] != '.inc':
+        name += '.inc'
+
+    if OUTPUT_FORMAT == 'gdx':
+        prefix = declaration + '\n'
+        return save_gdx_records(name, path, prefix, PARAMETER_DECLARATION.search(prefix), records, ';' + suffix)
+
+    with open(os.path.join(path, name), 'w', buffering=2**20) as f:
+        f.write(declaration + '\n/\n')
+        write_records(f, records)
+        f.write('/;\n' + suffix)
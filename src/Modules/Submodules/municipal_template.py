@@ -21,6 +21,8 @@ from sklearn.neighbors import kneighbors_graph
 from pybalmorel.utils import symbol_to_df
 import gams
 import os
+from functools import lru_cache
+from geofiles import prepared_geofiles
 
 style = 'report'
 
@@ -35,48 +37,89 @@ elif style == 'ppt':
 ###  1. Template for Balmorel Input ###
 ### ------------------------------- ###
 
+RESOLUTIONS = {
+    # Name : (choice in prepared_geofiles, column with region names, dimension name)
+    'muni' : ('DKmunicipalities', 'NAME_2', 'municipality'),
+    'nuts1' : ('NUTS1', 'NUTS_ID', 'nuts1'),
+    'nuts2' : ('NUTS2', 'NUTS_ID', 'nuts2'),
+    'nuts3' : ('NUTS3', 'NUTS_ID', 'nuts3'),
+}
+
+@lru_cache(maxsize=None)
+def resolution_dataset(resolution: str) -> xr.Dataset:
+    """Polygons and centroids of a resolution, shared by all DataContainers in the process
+    
+    The polygons come from the geofile store of prepared_geofiles, so shapefiles are only read once
+    """
+    choice, names, dimension = RESOLUTIONS[resolution]
+    the_index, geofile, country_code = prepared_geofiles(choice)
+    
+    # Make xarray
+    dataset = xr.Dataset()
+    
+    # Get only names and geometries
+    temp = (
+        geofile.set_index(names)
+        .copy()
+        .geometry
+    )
+    temp.index.name = dimension
+    temp.index = temp.index.astype('category')
+    
+    # Assign to xarray
+    dataset['polygons'] = temp 
+    dataset['polygons'] = dataset.polygons.assign_attrs({'crs' : geofile.crs})
+    dataset['polygons'] = dataset.polygons.assign_attrs({'geo_crs' : geofile.crs})
+    dataset['polygons'] = dataset.polygons.assign_attrs({'pro_crs' : 'EPSG:4093'})
+
+    # Get lat and long of centroids as well
+    centroids = gpd.GeoDataFrame(geometry=dataset.polygons.to_pandas(), crs=geofile.crs).centroid
+    dataset.coords['lon'] = centroids.x
+    dataset.coords['lat'] = centroids.y
+    
+    return dataset
+
+@lru_cache(maxsize=None)
+def projected_polygons(resolution: str) -> gpd.GeoSeries:
+    """Polygons of a resolution in its projected crs, from the pre-projected geofile store"""
+    choice, names, dimension = RESOLUTIONS[resolution]
+    the_index, geofile, country_code = prepared_geofiles(choice, crs=resolution_dataset(resolution).polygons.pro_crs)
+    geometry = geofile.set_index(names).geometry
+    geometry.index.name = dimension
+    return geometry
+
 class DataContainer():
-    def __init__(self) -> None:    
+    """Balmorel input data per municipality, as an xarray Dataset in the muni attribute
 
-        # Load municipal shapefiles
-        muni_geofile = gpd.read_file('./Data/Shapefiles/Denmark/Adm/gadm36_DNK_2.shp')
-        
-        # Correcting Municipal Names
-        correct_names = {'Århus' : 'Aarhus',
-                         'Høje Taastrup' : 'Høje-Taastrup',
-                         'Vesthimmerland' : 'Vesthimmerlands'}
-        muni_geofile['NAME_2'] = muni_geofile['NAME_2'].replace(correct_names)
-        
-        # Make xarray
-        self.muni = xr.Dataset()
-        
-        # Get only municipal names and geometries
-        temp = (
-            muni_geofile.set_index('NAME_2')
-            .copy()
-            .geometry
-        )
-        temp.index.name = 'municipality'
-        temp.index = temp.index.astype('category')
-        
-        # Assign to xarray
-        self.muni['polygons'] = temp 
-        self.muni['polygons'] = self.muni.polygons.assign_attrs({'crs' : muni_geofile.crs})
-        self.muni['polygons'] = self.muni.polygons.assign_attrs({'geo_crs' : muni_geofile.crs})
-        self.muni['polygons'] = self.muni.polygons.assign_attrs({'pro_crs' : 'EPSG:4093'})
-
-        # Get lat and long of centroids as well
-        centroids = self.get_polygons(coord_system='geographic').centroid
-        self.muni.coords['lon'] = centroids.x
-        self.muni.coords['lat'] = centroids.y
+    The polygons are shared between containers, and other resolutions in RESOLUTIONS (e.g. nuts3)
+    are added as attributes the first time they are accessed
+    """
+    def __init__(self) -> None:    
+        # Shallow copy, so merging data into this container does not change the shared dataset
+        self.muni = resolution_dataset('muni').copy()
+
+    def __getattr__(self, name: str):
+        # Only called if the attribute does not exist yet
+        if name in RESOLUTIONS:
+            setattr(self, name, resolution_dataset(name).copy())
+            return getattr(self, name)
+        raise AttributeError("'DataContainer' object has no attribute '%s'"%name)
         
     def get_polygons(self, resolution: str = 'muni',
                     coord_system: str = 'geographic'):
-        geo = gpd.GeoDataFrame(geometry=getattr(self, resolution).polygons.to_pandas())
-        geo = geo.set_crs(getattr(self, resolution).polygons.geo_crs)
+        polygons = getattr(self, resolution).polygons
+        
+        if coord_system != 'geographic' and resolution in RESOLUTIONS and polygons.pro_crs == resolution_dataset(resolution).polygons.pro_crs:
+            # Pre-projected polygons, in the order of this container
+            geo = gpd.GeoDataFrame(geometry=projected_polygons(resolution).loc[polygons.to_pandas().index.astype(str)].values,
+                                   index=polygons.to_pandas().index, crs=polygons.pro_crs)
+            return geo
+        
+        geo = gpd.GeoDataFrame(geometry=polygons.to_pandas())
+        geo = geo.set_crs(polygons.geo_crs)
         
         if coord_system != 'geographic':
-            geo = geo.to_crs(getattr(self, resolution).polygons.pro_crs)
+            geo = geo.to_crs(polygons.pro_crs)
         
         return geo
         
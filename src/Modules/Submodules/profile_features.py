@@ -0,0 +1,191 @@
+"""
+Profile Features
+
+Features for clustering from full hourly profiles (e.g. DE_VAR_T, WND_VAR_T and SOLE_VAR_T) instead of annual scalars.
+The (region x timestep) profiles are compressed into a few features with piecewise aggregate approximation (PAA)
+or randomized PCA, processing chunks of regions so memory stays bounded for many regions
+
+Created on 17.10.2026
+@author: Mathias Berg Rosendal, PhD Student at DTU Management (Energy Economics & Modelling)
+"""
+#%% ------------------------------- ###
+###        0. Script Settings       ###
+### ------------------------------- ###
+
+import numpy as np
+import pandas as pd
+
+PROFILE_COLUMNS = {'DE_VAR_T' : ['R', 'DEUSER', 'S', 'T', 'Value'],
+                   'DH_VAR_T' : ['A', 'DHUSER', 'S', 'T', 'Value'],
+                   'WND_VAR_T' : ['A', 'S', 'T', 'Value'],
+                   'SOLE_VAR_T' : ['A', 'S', 'T', 'Value']}
+COMPRESSIONS = ['paa', 'pca']
+AGGFUNCS = {'sum' : (np.add, 0), 'mean' : (np.add, 0),
+            'max' : (np.maximum, -np.inf), 'min' : (np.minimum, np.inf)} # Scatter operation and initial value
+CHUNKSIZE = 1000 # Regions processed at a time
+ROW_CHUNKSIZE = 1000000 # Records of a symbol scattered into the profile matrix at a time
+
+#%% ------------------------------- ###
+###           1. Profiles           ###
+### ------------------------------- ###
+
+def label_codes(labels: pd.Series, categories: pd.Index) -> np.ndarray:
+    """Positions of labels in categories, factorizing the labels first so only their unique values are looked up"""
+    codes, uniques = pd.factorize(labels)
+    return categories.get_indexer(uniques)[codes]
+
+def profile_matrix(df: pd.DataFrame, aggfunc: str = 'sum', row_chunksize: int = ROW_CHUNKSIZE) -> tuple[pd.Index, np.ndarray]:
+    """The (region x timestep) float32 matrix of a Balmorel timeseries symbol
+
+    Areas are converted to regions as in clustering.apply_filters, and users or areas within the same region
+    are aggregated with aggfunc ('sum', 'mean', 'max' or 'min'). The records are scattered into the matrix 
+    for chunks of rows, so the matrix (and the counts of records for 'mean' and 'max'/'min') is the only array 
+    of the size of the profiles, besides the symbol itself
+
+    Returns:
+        tuple[pd.Index, np.ndarray]: The regions and their profiles, with timesteps in S, T order
+    """
+    if not(aggfunc in AGGFUNCS):
+        raise ValueError('Aggregation %s of profiles not supported, choose between %s'%(aggfunc, ', '.join(AGGFUNCS)))
+    column = 'A' if 'A' in df.columns else 'R'
+
+    # Regions, seasons and terms from the unique labels only
+    areas = pd.Index(pd.unique(df[column]))
+    area_regions = areas.str.split('_', n=1).str[0] if column == 'A' else areas
+    area_codes, region_names = pd.factorize(area_regions, sort=True)
+    seasons = pd.Index(pd.unique(df['S'])).sort_values()
+    terms = pd.Index(pd.unique(df['T'])).sort_values()
+    n_times = len(seasons)*len(terms)
+
+    # Scatter chunks of records into the matrix on a single integer key
+    ufunc, initial = AGGFUNCS[aggfunc]
+    profiles = np.full((len(region_names), n_times), initial, dtype=np.float32)
+    counts = np.zeros(profiles.shape, dtype=np.uint32) if aggfunc != 'sum' else None
+    present = np.zeros(n_times, dtype=bool)
+    for start in range(0, len(df), row_chunksize):
+        chunk = df.iloc[start:start+row_chunksize]
+        times = label_codes(chunk['S'], seasons).astype(np.int64)*len(terms) + label_codes(chunk['T'], terms)
+        key = area_codes[label_codes(chunk[column], areas)].astype(np.int64)*n_times + times
+        ufunc.at(profiles.ravel(), key, chunk['Value'].to_numpy(dtype=np.float32))
+        if counts is not None:
+            np.add.at(counts.ravel(), key, 1)
+        present[times] = True
+
+    if aggfunc == 'mean':
+        np.divide(profiles, counts, out=profiles, where=counts > 0)
+    elif counts is not None:
+        profiles[counts == 0] = 0
+
+    # Only the timesteps in the symbol
+    if not(present.all()):
+        profiles = profiles[:, present]
+
+    return pd.Index(region_names, name='R'), profiles
+
+def normalise_profiles(profiles: np.ndarray, chunksize: int = CHUNKSIZE) -> np.ndarray:
+    """Divide each profile by its mean (in place), so profiles are compared by shape and not by level"""
+    for start in range(0, len(profiles), chunksize):
+        chunk = profiles[start:start+chunksize]
+        means = chunk.mean(axis=1, keepdims=True)
+        np.divide(chunk, means, out=chunk, where=means != 0)
+    return profiles
+
+def shape_normalise(profiles: np.ndarray, chunksize: int = CHUNKSIZE) -> np.ndarray:
+    """Subtract the mean of each profile and divide by its norm (in place), 
+    so the dot product of two profiles is their correlation. Constant profiles become zeros"""
+    for start in range(0, len(profiles), chunksize):
+        chunk = profiles[start:start+chunksize]
+        chunk -= chunk.mean(axis=1, keepdims=True)
+        norms = np.linalg.norm(chunk, axis=1, keepdims=True)
+        np.divide(chunk, norms, out=chunk, where=norms > 0)
+    return profiles
+
+
+#%% ------------------------------- ###
+###          2. Compression         ###
+### ------------------------------- ###
+
+def paa(profiles: np.ndarray, n_segments: int, chunksize: int = CHUNKSIZE) -> np.ndarray:
+    """Piecewise aggregate approximation: The mean of n_segments (almost) equally long periods"""
+    n_segments = min(n_segments, profiles.shape[1])
+    bounds = np.linspace(0, profiles.shape[1], n_segments + 1).astype(int)
+    lengths = np.diff(bounds)
+
+    features = np.empty((len(profiles), n_segments), dtype=np.float32)
+    for start in range(0, len(profiles), chunksize):
+        features[start:start+chunksize] = np.add.reduceat(profiles[start:start+chunksize], bounds[:-1], axis=1) / lengths
+    return features
+
+def randomized_pca(profiles: np.ndarray,
+                   n_components: int,
+                   n_oversamples: int = 10,
+                   n_iter: int = 2,
+                   chunksize: int = CHUNKSIZE,
+                   seed: int = 0) -> np.ndarray:
+    """Scores of the first principal components, from a randomized SVD (Halko et al., 2011)
+
+    The centered matrix is never formed: All products with it are computed for chunks of regions
+    """
+    n_regions, n_timesteps = profiles.shape
+    n_components = min(n_components, n_regions, n_timesteps)
+    n_random = min(n_components + n_oversamples, n_regions, n_timesteps)
+    mean = np.zeros(n_timesteps)
+    for start in range(0, n_regions, chunksize):
+        mean += profiles[start:start+chunksize].sum(axis=0, dtype=np.float64)
+    mean /= n_regions
+
+    def right_product(matrix: np.ndarray) -> np.ndarray:
+        """(profiles - mean) @ matrix"""
+        result = np.empty((n_regions, matrix.shape[1]))
+        for start in range(0, n_regions, chunksize):
+            result[start:start+chunksize] = (profiles[start:start+chunksize] - mean) @ matrix
+        return result
+
+    def left_product(matrix: np.ndarray) -> np.ndarray:
+        """matrix.T @ (profiles - mean)"""
+        result = np.zeros((matrix.shape[1], n_timesteps))
+        for start in range(0, n_regions, chunksize):
+            result += matrix[start:start+chunksize].T @ (profiles[start:start+chunksize] - mean)
+        return result
+
+    # Range of the centered profiles, refined with power iterations
+    Q, R = np.linalg.qr(right_product(np.random.default_rng(seed).normal(size=(n_timesteps, n_random))))
+    for i in range(n_iter):
+        Q, R = np.linalg.qr(left_product(Q).T)
+        Q, R = np.linalg.qr(right_product(Q))
+
+    U, S, Vt = np.linalg.svd(left_product(Q), full_matrices=False)
+    return ((Q @ U[:, :n_components]) * S[:n_components]).astype(np.float32)
+
+def profile_features(df: pd.DataFrame,
+                     value_name: str,
+                     aggfunc: str = 'sum',
+                     compression: str = 'paa',
+                     n_components: int = 12,
+                     chunksize: int = CHUNKSIZE) -> pd.DataFrame:
+    """Compress the profiles of a Balmorel timeseries symbol into a block of features
+
+    Args:
+        df (pd.DataFrame): The symbol, with columns as in PROFILE_COLUMNS
+        value_name (str): Prefix of the feature names, e.g. DE_VAR_T gives DE_VAR_T_0, DE_VAR_T_1, ...
+        aggfunc (str, optional): Aggregation of users or areas within a region. Defaults to 'sum'.
+        compression (str, optional): 'paa' or 'pca'. Defaults to 'paa'.
+        n_components (int, optional): Number of segments or principal components. Defaults to 12.
+        chunksize (int, optional): Regions processed at a time. Defaults to 1000.
+
+    Returns:
+        pd.DataFrame: The features, with regions (R) as index
+    """
+    if not(compression in COMPRESSIONS):
+        raise ValueError('Compression %s not supported, choose between %s'%(compression, ', '.join(COMPRESSIONS)))
+
+    regions, profiles = profile_matrix(df, aggfunc)
+    profiles = normalise_profiles(profiles, chunksize)
+
+    if compression == 'paa':
+        features = paa(profiles, n_components, chunksize)
+    else:
+        features = randomized_pca(profiles, n_components, chunksize=chunksize)
+
+    return pd.DataFrame(features, index=regions,
+                        columns=['%s_%d'%(value_name, i) for i in range(features.shape[1])])
@@ -0,0 +1,220 @@
+"""
+Spatial Weights
+
+Sparse weight matrices from the cells of a regular lon/lat grid (e.g. an atlite cutout) to regions (e.g. municipalities),
+so gridded timeseries can be aggregated to regions with sparse matrix products over chunks of the time axis.
+The matrices are cached to disk per grid, geofile and method
+
+Created on 17.10.2026
+@author: Mathias Berg Rosendal, PhD Student at DTU Management (Energy Economics & Modelling)
+"""
+#%% ------------------------------- ###
+###        0. Script Settings       ###
+### ------------------------------- ###
+
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import xarray as xr
+import shapely
+from scipy import sparse
+
+WEIGHTS_FOLDER = os.path.join('Data', 'SpatialWeights')
+METHODS = ['mean', 'area_mean', 'area_share'] # Cells inside the region weighted equally, by the overlapping area or by the share of the cell inside the region
+CHUNKSIZE = 1000 # Time steps aggregated at a time
+
+#%% ------------------------------- ###
+###        1. Weight Matrices       ###
+### ------------------------------- ###
+
+def grid_points(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Points of all cells in the grid, in the (y, x) order of the data"""
+    xx, yy = np.meshgrid(x, y)
+    return shapely.points(xx.ravel(), yy.ravel())
+
+def grid_cells(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Boxes of all cells in the grid, in the (y, x) order of the data, assuming a regular grid"""
+    dx = np.median(np.diff(np.sort(x))) if len(x) > 1 else 0
+    dy = np.median(np.diff(np.sort(y))) if len(y) > 1 else 0
+    xx, yy = np.meshgrid(x, y)
+    return shapely.box(xx.ravel() - dx/2, yy.ravel() - dy/2,
+                       xx.ravel() + dx/2, yy.ravel() + dy/2)
+
+def nearest_cells(points: np.ndarray, geometries: np.ndarray) -> np.ndarray:
+    """The index of the grid point nearest to the centroid of each geometry"""
+    return shapely.STRtree(points).nearest(shapely.centroid(geometries))
+
+def centroid_weights(x: np.ndarray, y: np.ndarray, geofile: gpd.GeoDataFrame) -> sparse.csr_matrix:
+    """Weight 1 for cells with their centre inside a region
+
+    Regions without any cell centres, e.g. small islands, get the cell closest to their centroid
+    """
+    points = grid_points(x, y)
+    geometries = geofile.geometry.values
+    regions, cells = shapely.STRtree(points).query(geometries, predicate='contains')
+
+    empty = np.setdiff1d(np.arange(len(geometries)), regions)
+    if len(empty) > 0:
+        nearest = nearest_cells(points, geometries[empty])
+        for region, cell in zip(empty, nearest):
+            print('No points within %s!'%geofile.index[region],
+                  'The closest point was %0.2f degrees away..'%shapely.distance(shapely.centroid(geometries[region]), points[cell]))
+        regions = np.concatenate((regions, empty))
+        cells = np.concatenate((cells, nearest))
+
+    return sparse.csr_matrix((np.ones(len(cells)), (cells, regions)),
+                             shape=(len(points), len(geometries)))
+
+def area_weights(x: np.ndarray, y: np.ndarray, geofile: gpd.GeoDataFrame, share: bool = False) -> sparse.csr_matrix:
+    """Weight equal to the area (km2) of the cell overlapping a region, 
+    or the share of the cell area inside the region if share is True
+
+    Regions outside the grid get the cell closest to their centroid, 
+    with weight 1 or the area of the region relative to the cell if share is True
+    """
+    boxes = gpd.GeoSeries(grid_cells(x, y), crs='EPSG:4326').to_crs(6933).values # To an equal area projection
+    geometries = geofile.geometry.to_crs(6933).values
+    regions, cells = shapely.STRtree(boxes).query(geometries, predicate='intersects')
+    areas = shapely.area(shapely.intersection(boxes[cells], geometries[regions])) / 1e6
+
+    keep = areas > 0
+    regions, cells, areas = regions[keep], cells[keep], areas[keep]
+    if share:
+        areas = areas / (shapely.area(boxes[cells]) / 1e6)
+
+    empty = np.setdiff1d(np.arange(len(geometries)), regions)
+    if len(empty) > 0:
+        nearest = nearest_cells(grid_points(x, y), geofile.geometry.values[empty])
+        regions = np.concatenate((regions, empty))
+        cells = np.concatenate((cells, nearest))
+        if share:
+            areas = np.concatenate((areas, np.minimum(shapely.area(geometries[empty]) / shapely.area(boxes[nearest]), 1)))
+        else:
+            areas = np.concatenate((areas, np.ones(len(empty))))
+
+    return sparse.csr_matrix((areas, (cells, regions)),
+                             shape=(len(boxes), len(geometries)))
+
+def weights_hash(x: np.ndarray, y: np.ndarray, geofile: gpd.GeoDataFrame, method: str) -> str:
+    """Identify a weight matrix by the grid coordinates, the regions and their polygons"""
+    sha = hashlib.sha256(method.encode())
+    sha.update(np.asarray(x, dtype=float).tobytes())
+    sha.update(np.asarray(y, dtype=float).tobytes())
+    sha.update('\n'.join(geofile.index.astype(str)).encode())
+    for wkb in shapely.to_wkb(geofile.geometry.values):
+        sha.update(wkb)
+    return sha.hexdigest()
+
+def weight_matrix(x: np.ndarray,
+                  y: np.ndarray,
+                  geofile: gpd.GeoDataFrame,
+                  method: str = 'mean',
+                  cache_folder: str = WEIGHTS_FOLDER) -> sparse.csr_matrix:
+    """Get the (cells x regions) weight matrix of a lon/lat grid and the regions of a geofile,
+    computing it if it has not been cached before
+
+    Args:
+        x (np.ndarray): The longitudes of the grid
+        y (np.ndarray): The latitudes of the grid
+        geofile (gpd.GeoDataFrame): The regions, with region names as index
+        method (str, optional): 'mean' for cells inside regions, 'area_mean' for the overlapping area
+            and 'area_share' for the share of the cell inside the region. Defaults to 'mean'.
+        cache_folder (str, optional): Where to cache the matrix. Defaults to Data/SpatialWeights.
+
+    Returns:
+        sparse.csr_matrix: The weights, with cells in (y, x) order
+    """
+    if not(method in METHODS):
+        raise ValueError('Method %s not supported, choose between %s'%(method, ', '.join(METHODS)))
+
+    if geofile.crs is not None:
+        geofile = geofile.to_crs('EPSG:4326') # Same as the grid
+
+    path = os.path.join(cache_folder, '%s.npz'%weights_hash(x, y, geofile, method))
+    if os.path.exists(path):
+        return sparse.load_npz(path).tocsr()
+
+    if method == 'mean':
+        weights = centroid_weights(x, y, geofile)
+    else:
+        weights = area_weights(x, y, geofile, share=method == 'area_share')
+
+    # Write to a temporary file first, so an interrupted write is never used
+    os.makedirs(cache_folder, exist_ok=True)
+    temp_path = path + '.%d.tmp'%os.getpid()
+    with open(temp_path, 'wb') as f:
+        sparse.save_npz(f, weights)
+    os.replace(temp_path, path)
+
+    return weights
+
+def share_matrix(x: np.ndarray,
+                 y: np.ndarray,
+                 geofile: gpd.GeoDataFrame,
+                 dim: str) -> xr.DataArray:
+    """The share of each cell inside each region as a (region, y, x) DataArray,
+    i.e. what atlite's Cutout.availabilitymatrix gives without any exclusions
+
+    Args:
+        x (np.ndarray): The longitudes of the grid
+        y (np.ndarray): The latitudes of the grid
+        geofile (gpd.GeoDataFrame): The regions, with region names as index
+        dim (str): The name of the region dimension
+    """
+    weights = weight_matrix(x, y, geofile, 'area_share')
+    return xr.DataArray(weights.T.toarray().reshape(len(geofile), len(y), len(x)),
+                        dims=[dim, 'y', 'x'],
+                        coords={dim : geofile.index.values, 'y' : y, 'x' : x})
+
+
+#%% ------------------------------- ###
+###          2. Aggregation         ###
+### ------------------------------- ###
+
+def apply_weights(data: xr.DataArray,
+                  weights: sparse.csr_matrix,
+                  regions: pd.Index,
+                  normalise: bool = True,
+                  chunksize: int = CHUNKSIZE) -> xr.DataArray:
+    """Weighted mean (or sum) of gridded data in each region, skipping missing values
+
+    The data is aggregated in chunks of the first dimension (e.g. time), 
+    so lazily loaded data is only read one chunk at a time
+
+    Args:
+        data (xr.DataArray): Data with y and x dimensions, e.g. (time, y, x)
+        weights (sparse.csr_matrix): The (cells x regions) weights from weight_matrix
+        regions (pd.Index): The region names, its name is used as dimension
+        normalise (bool, optional): Weighted mean if True, weighted sum if False. Defaults to True.
+        chunksize (int, optional): Steps of the first dimension aggregated at a time. Defaults to 1000.
+
+    Returns:
+        xr.DataArray: The data with a region dimension instead of y and x, e.g. (region, time)
+    """
+    other_dims = [dim for dim in data.dims if not(dim in ['y', 'x'])]
+    data = data.transpose(*other_dims, 'y', 'x')
+    n_cells = len(data.y)*len(data.x)
+    weights = sparse.csr_matrix(weights.T)
+
+    chunks = []
+    for start in range(0, data.shape[0] if len(other_dims) > 0 else 1, chunksize):
+        block = data[start:start+chunksize] if len(other_dims) > 0 else data
+        values = np.asarray(block.values, dtype=float).reshape(-1, n_cells).T
+
+        # Normalise with the weights of non-missing cells
+        missing = np.isnan(values)
+        totals = weights @ np.where(missing, 0, values)
+        if normalise:
+            counts = weights @ (~missing).astype(float)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                totals = totals / counts
+        chunks.append(totals)
+    aggregated = np.concatenate(chunks, axis=1)
+
+    return xr.DataArray(aggregated.reshape((len(regions),) + data.shape[:-2]),
+                        dims=[regions.name] + other_dims,
+                        coords={regions.name : regions.values,
+                                **{dim : data.coords[dim].data for dim in other_dims if dim in data.coords}},
+                        name=data.name)
@@ -15,9 +15,8 @@ import pickle
 import numpy as np
 from matplotlib import colormaps
 from pybalmorel import Balmorel
-from pybalmorel.utils import symbol_to_df
 import geopandas as gpd
-from gams import GamsWorkspace
+from Submodules.balmorel_cache import BalmorelInputCache, SymbolCache, gdx_hash
 import os
 try:
     import cmcrameri
@@ -124,41 +123,55 @@ def store_balmorel_input(symbol: str,
                          load_again: bool = False,
                          filter_func: Tuple[None, callable] = None,
                          save: bool = True,
-                         gams_system_directory: str = '/opt/gams/48.5'):
+                         gams_system_directory: str = '/opt/gams/48.5',
+                         cache: Tuple[SymbolCache, None] = None):
+    """Load a symbol from Balmorel input data, using the symbol cache if the same symbol, columns 
+    and filter has been loaded from the same input data before
+
+    Args:
+        load_again (bool, optional): Run GAMS to load the input data and ignore cached symbols. Defaults to False.
+        filter_func (callable, optional): Function applied to the dataframe before caching it. Defaults to None.
+        save (bool, optional): Store the symbol in the cache. Defaults to True.
+        cache (SymbolCache, optional): The cache to use. Defaults to Data/BalmorelData/SymbolCache.
+    """
     
     balm = Balmorel(balmorel_model_path, gams_system_directory=gams_system_directory)
     
-    # Check if the symbol.gzip exists
-    if '%s.gzip'%symbol in os.listdir('Data/BalmorelData'):
-        print('\n%s.gzip already exists\n'%symbol)
-        f = pd.read_parquet('Data/BalmorelData/%s.gzip'%symbol)
+    # Check Balmorel input has been loaded
+    balm_input_path1 = os.path.join(balm.path, scenario, 'model', '%s_input_data.gdx'%scenario)
+    balm_input_path2 = os.path.join('Data', 'BalmorelData', '%s_input_data.gdx'%scenario)
+    if (not(os.path.exists(balm_input_path1)) and not(os.path.exists(balm_input_path2))) or load_again == True:      
+        print('\nLoading results into %s_input_data.gdx...\n'%scenario)
+        balm.load_incfiles(scenario)
+        balm_input_path = balm_input_path1
+    elif os.path.exists(balm_input_path2):
+        balm_input_path = balm_input_path2
     else:
-        # Check Balmorel input has been loaded
-        balm_input_path1 = os.path.join(balm.path, scenario, 'model', '%s_input_data.gdx'%scenario)
-        balm_input_path2 = os.path.join('Data', 'BalmorelData', '%s_input_data.gdx'%scenario)
-        if (not(os.path.exists(balm_input_path1)) and not(os.path.exists(balm_input_path2))) or load_again == True:      
-            print('\nLoading results into %s_input_data.gdx...\n'%scenario)
-            balm.load_incfiles(scenario)
-        else:
-            if os.path.exists(balm_input_path2):
-                balm_input_path = balm_input_path2
-            else:
-                balm_input_path = balm_input_path1
-                
-            print('\n%s_input_data.gdx already loaded!'%scenario)
-            print('Loading %s...\n'%(balm_input_path))
-            
-            # Load the input
-            ws = GamsWorkspace(system_directory=gams_system_directory)
-            balm.input_data[scenario] = ws.add_database_from_gdx(os.path.abspath(balm_input_path))
-
-        # Get symbol
-        f = symbol_to_df(balm.input_data[scenario], symbol, columns)
-        if filter_func != None:
-            f = filter_func(f)
-            
-        if save:
-            f.to_parquet('Data/BalmorelData/%s.gzip'%symbol)
+        balm_input_path = balm_input_path1
+    
+    # Check if the symbol is cached 
+    if cache is None:
+        cache = SymbolCache()
+    key = cache.key(balmorel_model_path, scenario, gdx_hash(balm_input_path), 
+                    symbol, columns, filter_func)
+    if key is None:
+        print('\nThe filter of %s uses values that can not be identified, so it is not cached\n'%symbol)
+        save = False
+    elif not(load_again):
+        f = cache.get(key)
+        if f is not None:
+            print('\n%s loaded from cache\n'%symbol)
+            return f
+
+    # Get symbol
+    print('\nLoading %s from %s...\n'%(symbol, balm_input_path))
+    f = BalmorelInputCache.from_gdx(balm_input_path, gams_system_directory).load(symbol, columns)
+    if filter_func != None:
+        f = filter_func(f)
+        
+    if save:
+        cache.put(key, f, symbol=symbol, scenario=scenario, 
+                  model_path=os.path.abspath(balmorel_model_path), columns=columns)
         
     return f
 
@@ -17,11 +17,12 @@ import numpy as np
 import geopandas as gpd
 import click
 from typing import Union
-from pybalmorel import Balmorel, IncFile
-from pybalmorel.utils import symbol_to_df
-import gams
+from pybalmorel import IncFile
+from Submodules.balmorel_cache import BalmorelInputCache
+from Submodules.cluster_hierarchy import load_hierarchy, composed_mapping, check_previous_order
 from typing import Tuple
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 #%% ------------------------------- ###
 ###          1. Functions           ###
@@ -57,144 +58,298 @@ def get_symbols_to_aggregate(symbols: list,
         
     return symbols, aggfuncs, fillnas
 
-def merge_RRR_names(df: pd.DataFrame,
-                    clustering: gpd.GeoDataFrame):
-    
-    old_column = 'RRR'
-    new_column = 'RRR_new'
-
-    clustering.columns = [old_column, new_column]
-    df = (
-        df
-        .merge(clustering, on=old_column, how='outer')
-        .drop(columns=old_column)
-        .rename(columns={new_column : old_column})
-    )
-
-    return df
-
-def merge_IRRRI_names(df: pd.DataFrame,
-                    clustering: gpd.GeoDataFrame):
-    
-    old_columns = ['IRRRI', 'IRRRE']
-    new_columns = ['IRRRI_new', 'IRRRE_new']
-
-    for i in range(2):
-        
-        old_column = old_columns[i]
-        new_column = new_columns[i]
-        
-        clustering.columns = [old_column, new_column]
-
-        df = (
-            df
-            .merge(clustering, on=old_column, how='outer')
-            .drop(columns=old_column)
-            .rename(columns={new_column : old_column})
-        )
-        
-    # Make sure that there are no connections to itself
-    idx = df.query('IRRRI == IRRRE').index
-    df.loc[idx, 'Value'] = np.NaN
+#%% ------------------------------- ###
+###      2. Aggregation Engine      ###
+### ------------------------------- ###
 
-    return df
+# Losses are averaged over the connections that can carry transmission capacity, not over all pairs of regions
+CAPACITY_SYMBOLS = {'XLOSS' : ['XINVCOST', 'XKFX'],
+                    'XH2LOSS' : ['XH2INVCOST', 'XH2KFX']}
 
-def merge_IAAAI_names(df: pd.DataFrame,
-                    clustering: gpd.GeoDataFrame):
-    
-    old_columns = ['IAAAI', 'IAAAE']
-    new_columns = ['IAAAI_new', 'IAAAE_new']
-    clustering['index'] = clustering['index'] + '_A'
-    clustering['cluster_name'] = clustering['cluster_name'] + '_A'
+def connected_rows(db: BalmorelInputCache, df: pd.DataFrame, symbols: list) -> np.ndarray:
+    """Rows of an (IRRRE, IRRRI) parameter between regions with (possible) transmission capacity in any of the symbols.
+    All rows if none of the symbols are in the input data"""
+    symbols = [symbol for symbol in symbols if symbol in db]
+    if len(symbols) == 0:
+        return np.ones(len(df), dtype=bool)
 
+    pairs = pd.concat([db.load(symbol)[['IRRRE', 'IRRRI']] for symbol in symbols])
+    return pd.MultiIndex.from_frame(df[['IRRRE', 'IRRRI']]).isin(pd.MultiIndex.from_frame(pairs))
 
-    for i in range(2):
-        
-        old_column = old_columns[i]
-        new_column = new_columns[i]
-        
-        clustering.columns = [old_column, new_column]
-
-        df = (
-            df
-            .merge(clustering, on=old_column, how='outer')
-            .drop(columns=old_column)
-            .rename(columns={new_column : old_column})
-        )
-        
-    # Make sure that there are no connections to itself
-    idx = df.query('IAAAI == IAAAE').index
-    df.loc[idx, 'Value'] = np.NaN
+class AreaTranslation(dict):
+    """Translation from old area names to cluster names, where names are translated the first time they are looked up
 
-    return df
+    The region prefix of an area is replaced by its cluster name, keeping the suffix (e.g. _A, _IND-HT or _IDVU-SPACEHEAT).
+    All offshore areas in a cluster are collected in one _OFF area, otherwise some with the same OFF-numbers would be aggregated, while others wouldn't.
+    Raises a KeyError for areas in regions that are not part of the clustering.
+    """
+    def __init__(self, regions: dict):
+        super().__init__(DENMARK='DENMARK')
+        self.regions = regions
 
-def loop_and_replace_names(df: pd.DataFrame,
-                    clustering: gpd.GeoDataFrame,
-                    old_column: str):
-    
-    new_column = '%s_new'%old_column # The column containing the new cluster names
-    clustering.columns = [old_column, new_column] # old_column: name to be replaced by cluster name, new_column: cluster name
-    clustering = clustering.set_index(old_column)
-    
-    for area in df[old_column].unique():
-        if area == 'DENMARK':
-            continue
-        
+    def __missing__(self, area: str) -> str:
         try:
             suffix = '_' + area.split('_')[1]
             region = area.split('_')[0]
         except IndexError:
             suffix = ''
             region = area
-            
-        new_name = clustering.loc[region, new_column]
-        
-        # Make sure to aggregate offshore regions (otherwise, some with same OFF-numbers will be aggregated, while others won't)
+
         if 'OFF' in suffix:
             suffix = '_OFF'
-        
-        # Replace names
-        idx = df[old_column] == area 
-        df.loc[idx, old_column] = new_name + suffix
 
-    return df
+        self[area] = self.regions[region] + suffix
+        return self[area]
+
+def get_translation_index(clustering: pd.DataFrame) -> dict:
+    """Translations from old region and area names to cluster names for each geographic set, made once per clustering
+
+    Args:
+        clustering (pd.DataFrame): Old region names in the 'index' column and cluster names in the 'cluster_name' column
+
+    Returns:
+        dict: Translations for region names (RRR, IRRRE, IRRRI) and area names (AAA, CCCRRRAAA, IAAAE, IAAAI)
+    """
+    regions = dict(zip(clustering['index'], clustering['cluster_name']))
+    areas = AreaTranslation(regions)
+    interconnected_areas = dict(zip(clustering['index'] + '_A', clustering['cluster_name'] + '_A'))
+
+    return {'RRR' : regions, 'IRRRE' : regions, 'IRRRI' : regions,
+            'AAA' : areas, 'CCCRRRAAA' : areas,
+            'IAAAE' : interconnected_areas, 'IAAAI' : interconnected_areas}
+
+def translate_names(names: pd.Series, translation: dict) -> pd.Series:
+    """Translate names with one lookup per unique name, NaN where a name is not part of the translation"""
+    codes, uniques = pd.factorize(names)
+    translated = pd.Series(uniques, dtype=object).map(translation).values
+
+    return pd.Series(np.append(translated, np.nan)[codes], index=names.index, name=names.name)
+
+def encode_names(names: pd.Series,
+                 translation: Union[dict, None] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Integer codes of (translated) names, pointing into a sorted array of the new names
+
+    Only the unique names are translated, so the cost does not scale with the amount of rows.
+    Codes are -1 where the name is NaN or not part of the translation.
+    """
+    if translation is None:
+        return pd.factorize(names, sort=True)
+
+    codes, uniques = pd.factorize(names)
+    new_codes, labels = pd.factorize(pd.Series(uniques, dtype=object).map(translation), sort=True)
+
+    # Appending -1 makes missing names (code -1) point to -1 as well
+    return np.append(new_codes, -1)[codes], labels
+
+def merge_order(df: pd.DataFrame, columns: list) -> np.ndarray:
+    """Row order after consecutive outer merges on columns, which pandas groups by order of first appearance
+
+    The order matters, since the grouped reductions are compensated sums that depend on the order of summation
+    """
+    order = np.arange(len(df))
+    for column in columns:
+        codes = pd.factorize(df[column].values[order])[0]
+        order = order[np.argsort(codes, kind='stable')]
+
+    return order
+
+def grouped_sum(group: np.ndarray,
+                values: np.ndarray,
+                n_groups: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Kahan-compensated sum and count of non-NaN values per group, identical to pandas' groupby sum
+
+    Rows are summed in the order they are given. The compensation is vectorised across groups,
+    so the Python loop only runs over the size of the largest group
+    """
+    valid = ~np.isnan(values)
+    group = group[valid]
+    values = values[valid]
+    counts = np.bincount(group, minlength=n_groups)
 
-def aggregate_parameter(db: gams.GamsDatabase, 
+    # Position of each row within its group
+    sorter = np.argsort(group, kind='stable')
+    rank = np.empty(len(group), dtype=np.int64)
+    rank[sorter] = np.arange(len(group)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    # Add the n'th row of every group at the same time
+    total = np.zeros(n_groups)
+    compensation = np.zeros(n_groups)
+    by_rank = np.argsort(rank, kind='stable')
+    start = 0
+    for stop in np.cumsum(np.bincount(rank)):
+        rows = by_rank[start:stop]
+        g = group[rows]
+        y = values[rows] - compensation[g]
+        t = total[g] + y
+        c = t - total[g] - y
+        c[np.isnan(c)] = 0 # Happens for +/- infinite values
+        compensation[g] = c
+        total[g] = t
+        start = stop
+
+    return total, counts
+
+def grouped_median(group: np.ndarray,
+                   values: np.ndarray,
+                   n_groups: int) -> np.ndarray:
+    """Median of non-NaN values per group"""
+    valid = ~np.isnan(values)
+    group = group[valid]
+    values = values[valid]
+    counts = np.bincount(group, minlength=n_groups)
+
+    # Sort values within groups and pick the middle one(s)
+    values = values[np.lexsort((values, group))]
+    starts = np.cumsum(counts) - counts
+
+    median = np.full(n_groups, np.nan)
+    idx = counts > 0
+    lower = values[starts[idx] + (counts[idx] - 1) // 2]
+    upper = values[starts[idx] + counts[idx] // 2]
+    median[idx] = np.where(counts[idx] % 2 == 1, upper, (upper + lower) / 2)
+
+    return median
+
+def grouped_reduce(group: np.ndarray,
+                   values: np.ndarray,
+                   n_groups: int,
+                   aggfunc: str) -> np.ndarray:
+    """Reduce values to one per group with the aggregation function, skipping NaN's like pandas does"""
+    if aggfunc == 'sum':
+        return grouped_sum(group, values, n_groups)[0]
+    elif aggfunc == 'mean':
+        total, counts = grouped_sum(group, values, n_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, total / counts, np.nan)
+    elif aggfunc == 'median':
+        return grouped_median(group, values, n_groups)
+    else:
+        return (
+            pd.Series(values)
+            .groupby(group)
+            .aggregate(aggfunc)
+            .reindex(np.arange(n_groups))
+            .values
+        )
+
+def aggregate_codes(codes: list,
+                    labels: list,
+                    names: list,
+                    values: np.ndarray,
+                    aggfunc: str,
+                    order: Union[np.ndarray, None] = None) -> pd.DataFrame:
+    """Aggregate values over the unique combinations of integer coded columns
+
+    Equivalent to df.groupby(names).aggregate({'Value' : aggfunc}), where each column of df is
+    given by labels[i][codes[i]], and rows with a missing label (code -1) are dropped
+
+    Args:
+        codes (list): Integer codes for each column
+        labels (list): Sorted labels that the codes of each column point to
+        names (list): The column names
+        values (np.ndarray): The values to aggregate
+        aggfunc (str): The aggregation function, 'sum', 'mean' and 'median' are vectorised
+        order (Union[np.ndarray, None], optional): The order rows should be reduced in. Defaults to None, i.e. the current order.
+
+    Returns:
+        pd.DataFrame: The aggregated values in a 'Value' column, indexed by the sorted unique combinations of labels
+    """
+    if order is not None:
+        codes = [column_codes[order] for column_codes in codes]
+        values = values[order]
+
+    # Drop rows that were not translated
+    valid = np.all([column_codes >= 0 for column_codes in codes], axis=0)
+    codes = [column_codes[valid] for column_codes in codes]
+    values = values[valid].astype(float)
+
+    # Unique combinations of codes, sorted like the labels
+    sizes = [max(len(column_labels), 1) for column_labels in labels]
+    try:
+        flat = np.ravel_multi_index(codes, sizes)
+        unique_flat, group = np.unique(flat, return_inverse=True)
+        unique_codes = np.unravel_index(unique_flat, sizes)
+    except ValueError:
+        # Too many combinations for a flat index
+        unique_rows, group = np.unique(np.column_stack(codes), axis=0, return_inverse=True)
+        unique_codes = unique_rows.T
+    group = group.reshape(-1)
+
+    result = grouped_reduce(group, values, len(group) and group.max() + 1, aggfunc)
+
+    # Make index with the new labels
+    arrays = [np.asarray(labels[i], dtype=object)[unique_codes[i]] for i in range(len(names))]
+    if len(names) > 1:
+        index = pd.MultiIndex.from_arrays(arrays, names=names)
+    else:
+        index = pd.Index(arrays[0], name=names[0])
+
+    return pd.DataFrame({'Value' : result}, index=index)
+
+def aggregate_parameter(db: BalmorelInputCache,
                       symbol: str,
                       clustering: gpd.GeoDataFrame,
                       aggfunc: str,
                       unique_names: dict,
                       second_order: bool,
-                      fillna: Tuple[float, int, str] = 'EPS'):
-    
+                      fillna: Tuple[float, int, str] = 'EPS',
+                      translation_index: Union[dict, None] = None):
+
     # Load dataframe
-    df = symbol_to_df(db, symbol)
+    df, text = db.load(symbol), db.text(symbol)
+    if symbol in CAPACITY_SYMBOLS:
+        df = df.loc[connected_rows(db, df, CAPACITY_SYMBOLS[symbol])].reset_index(drop=True)
     symbol_columns = list(df.columns)
     value_sum_before = df.Value.sum()
-    
+
+    if translation_index is None:
+        translation_index = get_translation_index(clustering)
+
     # How to define this? Search for _, if that exists then its areas otherwise regions assumed? What about CCCRRRAAA
+    # Regions and interconnections are merged (outer join), while areas are translated row by row
     if 'RRR' in symbol_columns:
-        df = merge_RRR_names(df, clustering)
+        geo_columns, outer_join = ['RRR'], True
     elif 'IRRRE' in symbol_columns:
-        df = merge_IRRRI_names(df, clustering)
+        geo_columns, outer_join = ['IRRRI', 'IRRRE'], True
     elif 'IAAAE' in symbol_columns:
-        df = merge_IAAAI_names(df, clustering)
+        geo_columns, outer_join = ['IAAAI', 'IAAAE'], True
     elif 'CCCRRRAAA' in symbol_columns:
-        df = loop_and_replace_names(df, clustering, 'CCCRRRAAA')
+        geo_columns, outer_join = ['CCCRRRAAA'], False
     elif 'AAA' in symbol_columns:
-        df = loop_and_replace_names(df, clustering, 'AAA')
+        geo_columns, outer_join = ['AAA'], False
     else:
         print("No geographic data in here", "\nPassed %s"%symbol)
         return
 
-    # Aggregate and convert names
+    # Regions without data still get a (NaN) value, as in an outer merge, if there are no other dimensions
+    if outer_join and len(geo_columns) == 1 and len(symbol_columns) == 2:
+        existing = set(df[geo_columns[0]])
+        missing = [name for name in translation_index[geo_columns[0]] if not(name in existing)]
+        df = pd.concat((df, pd.DataFrame({geo_columns[0] : missing, 'Value' : np.nan})),
+                       ignore_index=True)
+
+    # Encode old names as integer codes of the new cluster names
+    codes, labels = [], []
+    for column in symbol_columns[:-1]:
+        column_codes, column_labels = encode_names(df[column], translation_index[column] if column in geo_columns else None)
+        codes.append(column_codes)
+        labels.append(column_labels)
+    values = df.Value.values.astype(float)
+
+    if len(geo_columns) == 2:
+        # Make sure that there are no connections to itself
+        i, j = [symbol_columns.index(column) for column in geo_columns]
+        same = (codes[i] >= 0) & (codes[j] >= 0)
+        same[same] = np.asarray(labels[i], dtype=object)[codes[i][same]] == np.asarray(labels[j], dtype=object)[codes[j][same]]
+        values[same] = np.nan
+
+    # Aggregate with the same order of summation as merging and grouping in pandas
     df = (
-        df
-        .groupby(symbol_columns[:-1])
-        .aggregate({'Value' : aggfunc})
+        aggregate_codes(codes, labels, symbol_columns[:-1], values, aggfunc,
+                        order=merge_order(df, geo_columns) if outer_join else None)
         .fillna(fillna)
     )
-    
+
     # Writing eps if fillna == EPS
     if fillna == 'EPS':
         idx = df.query('Value == "EPS"').index
@@ -210,7 +365,7 @@ def aggregate_parameter(db: gams.GamsDatabase,
         raise('Error in aggregation')
     
     # Make IncFile
-    prefix = "TABLE %s(%s) '%s'\n"%(symbol, ", ".join(symbol_columns[:-1]), db[symbol].text)
+    prefix = "TABLE %s(%s) '%s'\n"%(symbol, ", ".join(symbol_columns[:-1]), text)
     suffix = '\n;'
     
     if symbol in unique_names:
@@ -241,22 +396,26 @@ def aggregate_parameter(db: gams.GamsDatabase,
         
     f.save()
     
-def aggregate_sets(db: gams.GamsDatabase, 
+def aggregate_sets(db: BalmorelInputCache, 
                    symbol: str,
-                   clustering: gpd.GeoDataFrame,):
+                   clustering: gpd.GeoDataFrame,
+                   translation_index: Union[dict, None] = None):
      
     # Load dataframe
-    df = symbol_to_df(db, symbol)
+    df, text = db.load(symbol), db.text(symbol)
     symbol_columns = list(df.columns)
 
-    # Convert old names to new cluster names
+    if translation_index is None:
+        translation_index = get_translation_index(clustering)
+
+    # Convert old names to new cluster names (regions are translated like areas without a suffix)
     for column in symbol_columns:
         if column in ['CCCRRRAAA', 'RRR', 'AAA']:
-            df = loop_and_replace_names(df, clustering, column)
+            df[column] = translate_names(df[column], translation_index['AAA'])
     
     # Make IncFile
     prefix = '\n'.join([
-        "SET %s(%s) '%s'\n/"%(symbol, ", ".join(symbol_columns), db[symbol].text),
+        "SET %s(%s) '%s'\n/"%(symbol, ", ".join(symbol_columns), text),
         ""
     ])
     suffix = '\n/\n;'
@@ -273,6 +432,41 @@ def aggregate_sets(db: gams.GamsDatabase,
     f.body = "\n".join([value for value in df.values])
     
     f.save()
+
+def aggregate_symbol(db: Union[BalmorelInputCache, str],
+                     symbol: str,
+                     clustering: pd.DataFrame,
+                     aggfunc: str,
+                     unique_names: dict,
+                     second_order: bool,
+                     fillna: Tuple[float, int, str] = 'EPS',
+                     translation_index: Union[dict, None] = None) -> Tuple[str, float]:
+    """Aggregate a parameter or set and return the time it took
+
+    Can run in a worker process, by passing the path of the BalmorelInputCache as db
+    """
+    t0 = time.time()
+    if isinstance(db, str):
+        db = BalmorelInputCache(db)
+    if translation_index is None:
+        translation_index = get_translation_index(clustering)
+
+    if db.is_parameter(symbol):
+        aggregate_parameter(db,
+                        symbol, 
+                        clustering,
+                        aggfunc=aggfunc,
+                        unique_names=unique_names,
+                        second_order=second_order,
+                        fillna=fillna,
+                        translation_index=translation_index)
+    else:
+        aggregate_sets(db,
+                       symbol,
+                       clustering,
+                       translation_index=translation_index)
+
+    return symbol, time.time() - t0
     
 @click.pass_context
 def plot_transmission_invcost(ctx, symbol: str,
@@ -286,7 +480,11 @@ def plot_transmission_invcost(ctx, symbol: str,
         cluster_file += '_2nd-order'
     
     geo_union = gpd.read_file(cluster_file + '.gpkg')
-    geo_union['coord'] = geo_union.centroid
+    if not('centroid_lon' in geo_union.columns):
+        # Geofiles from before centroids were stored by clustering.new_geofile
+        geo_union['centroid_lon'] = geo_union.centroid.x
+        geo_union['centroid_lat'] = geo_union.centroid.y
+    coords = geo_union.set_index('cluster_name')[['centroid_lon', 'centroid_lat']]
     
     fig, ax = plt.subplots()
     geo_union.plot(ax=ax)
@@ -297,10 +495,8 @@ def plot_transmission_invcost(ctx, symbol: str,
         if line in exclusion or line[0] == line[1]:
             continue
         
-        coords = geo_union.query('cluster_name == @line[0] or cluster_name == @line[1]')['coord']
-
-        x1, x2 = coords.x
-        y1, y2 = coords.y
+        x1, x2 = coords.loc[[line[0], line[1]], 'centroid_lon']
+        y1, y2 = coords.loc[[line[0], line[1]], 'centroid_lat']
         
         l, = ax.plot([x1,x2], [y1,y2], color = 'r', linewidth = cap['Value']*1e-5)
         # lines.append(l)
@@ -312,7 +508,7 @@ def plot_transmission_invcost(ctx, symbol: str,
 
 
 #%% ------------------------------- ###
-###            2. Main              ###
+###            3. Main              ###
 ### ------------------------------- ###
 
 @click.command()
@@ -328,13 +524,19 @@ def plot_transmission_invcost(ctx, symbol: str,
 @click.option('--cluster-params', type=str, required=True, help='Comma-separated list of Balmorel input data to cluster (use the symbol names, e.g. DE for annual electricity demand)')
 @click.option('--second-order', type=bool, required=True, help='Second order clustering or not?')
 @click.option('--gams-sysdir', type=str, required=False, help='GAMS system directory')
+@click.option('--workers', type=int, required=False, default=1, help='Number of processes aggregating symbols in parallel')
+@click.option('--from-base', type=bool, required=False, default=False, help='Aggregate a second order clustering directly from the Balmorel input of the first order clustering, using the composed region-to-cluster mapping')
+@click.option('--first-order-geofile', type=str, required=False, default='', help='The geofile from first order clustering, which the cluster hierarchy must be built on when using --from-base')
 def main(ctx, model_path: str, scenario: str, exceptions: str, 
          mean_aggfuncs: str, median_aggfuncs: str, 
          zero_fillnas: str, only_symbols: Union[str, None], 
          cluster_size: int,
          cluster_params: str,
          second_order: bool,
-         gams_sysdir: str = '/opt/gams/48.5'):
+         gams_sysdir: str = '/opt/gams/48.5',
+         workers: int = 1,
+         from_base: bool = False,
+         first_order_geofile: str = ''):
     
     # Make configuration lists
     ctx.ensure_object(dict)
@@ -352,12 +554,21 @@ def main(ctx, model_path: str, scenario: str, exceptions: str,
                     'FLEXYDEMAND' : 'FLEXDEM_FLEXYDEMAND'} # Symbols that have a different incfile name
     
     # Load input data, cluster geofile and symbols to aggregate
-    m = Balmorel(model_path,gams_system_directory=gams_sysdir)
-    m.load_incfiles(scenario)
-    if second_order:
+    if second_order and from_base:
+        ## Recode the base regions directly to second order clusters
+        hierarchy, metadata = load_hierarchy()
+        if not('1' in metadata):
+            raise FileNotFoundError('No first order clustering in the cluster hierarchy, run a first order clustering first')
+        check_previous_order(2, metadata, first_order_geofile)
+        db = BalmorelInputCache.from_model(metadata['1']['model_path'], metadata['1']['scenario'], gams_sysdir)
+        clusters = composed_mapping(2)
+        symbols = open('Data/Configurations/1stOrderClusteringFiles.txt', 'r').read().replace('.inc', '').replace('ClusterOutput/', '').splitlines()
+    elif second_order:
+        db = BalmorelInputCache.from_model(model_path, scenario, gams_sysdir)
         clusters = gpd.read_file('ClusterOutput/clustering_2nd-order.gpkg')
         symbols = open('Data/Configurations/2ndOrderClusteringFiles.txt', 'r').read().replace('.inc', '').replace('ClusterOutput/', '').splitlines()
     else:
+        db = BalmorelInputCache.from_model(model_path, scenario, gams_sysdir)
         clusters = gpd.read_file('ClusterOutput/clustering.gpkg')
         symbols = open('Data/Configurations/1stOrderClusteringFiles.txt', 'r').read().replace('.inc', '').replace('ClusterOutput/', '').splitlines()
         
@@ -367,27 +578,35 @@ def main(ctx, model_path: str, scenario: str, exceptions: str,
     if only_symbols != None:
         symbols = only_symbols.replace(' ', '').split(',')
 
+    # Translation from old to new names, made once for all symbols
+    translation_index = get_translation_index(clusters)
+
     # Aggregating parameters and sets
     print('Will attempt to aggregate..\n%s\n'%(','.join(symbols)))
-    for symbol in symbols:
-        t0 = time.time()
-        if type(m.input_data[scenario][symbol]) == gams.GamsParameter:
-            aggregate_parameter(m.input_data[scenario],
-                            symbol, 
-                            clusters[['index', 'cluster_name']],
-                            aggfunc=aggfuncs[symbol],
-                            unique_names=unique_names,
-                            second_order=second_order,
-                            fillna=fillnas[symbol])
-        elif type(m.input_data[scenario][symbol] == gams.GamsSet):
-            aggregate_sets(m.input_data[scenario],
-                           symbol,
-                           clusters[['index', 'cluster_name']])   
-        else:
-            print('%s is not a set or a parameter, not aggregated'%symbol)
-        t1 = time.time()
-        if (t1 - t0) > 60:
-            print('%s took %0.2f minutes!'%(symbol, (t1 - t0)/60))
+    clusters = clusters[['index', 'cluster_name']]
+    t_start = time.time()
+    timings = {}
+    if workers > 1:
+        # Workers load the symbols they need from the input cache
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(aggregate_symbol, db.path, symbol, clusters,
+                                       aggfuncs[symbol], unique_names, second_order,
+                                       fillnas[symbol]) for symbol in symbols]
+            for future in as_completed(futures):
+                symbol, seconds = future.result()
+                timings[symbol] = seconds
+                print('%s aggregated in %0.2f s'%(symbol, seconds))
+    else:
+        for symbol in symbols:
+            symbol, seconds = aggregate_symbol(db, symbol, clusters,
+                                               aggfuncs[symbol], unique_names, second_order,
+                                               fillnas[symbol], translation_index)
+            timings[symbol] = seconds
+    
+    for symbol, seconds in timings.items():
+        if seconds > 60:
+            print('%s took %0.2f minutes!'%(symbol, seconds/60))
+    print('Aggregated %d symbols in %0.2f s using %d worker(s)'%(len(timings), time.time() - t_start, workers))
         
 if __name__ == '__main__':
     main()
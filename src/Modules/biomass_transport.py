@@ -13,12 +13,12 @@ Created on 11.10.2024
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
-from Submodules.municipal_template import DataContainer
-from grids import get_distance_matrix
+from grids import get_distance_matrix, municipality_polygons
 import xarray as xr
 import click
-from pybalmorel import IncFile
 from Submodules.utils import convert_names
+from Submodules.distances import connected_distances
+from Submodules.incfiles import save_parameter
 
 @click.group()
 @click.option('--dark-style', is_flag=True, required=False, help='Dark plot style')
@@ -48,11 +48,15 @@ def CLI(ctx, dark_style: bool, plot_ext: str):
 
 @CLI.command()
 @click.argument('transport-cost', type=float)
-def transport(transport_cost: float):
+@click.option('--distance-method', type=click.Choice(['projected', 'great_circle', 'network']), default='projected', required=False, help='Distance between region centroids, the same as used for the grid')
+@click.option('--fuels', type=str, default='STRAW, WOOD', required=False, help='Transported fuels, optionally with their own cost in €/GJ/km, e.g. "STRAW, WOOD, WOODCHIPS: 0.02"')
+def transport(transport_cost: float, distance_method: str = 'projected', fuels: str = 'STRAW, WOOD'):
     """Producing transport costs for fuels
 
     Args:
         transport_cost (_type_): the cost of transport in €/GJ/km
+        distance_method (str): Distances between region centroids, shared with grids.py through the distance cache
+        fuels (str): Transported fuels, where fuels without a cost use transport_cost
     """
     
     # Load connectivity
@@ -61,45 +65,49 @@ def transport(transport_cost: float):
                       f, 'connection')
     
     # Get Distance Matrix
-    x = DataContainer()
-    geofile = x.get_polygons()
-    geofile.index = (
-        geofile
-        .index
-        .str.replace('Æ', 'Ae')
-        .str.replace('Ø', 'Oe')
-        .str.replace('Å', 'Aa')
-        .str.replace('æ', 'ae')
-        .str.replace('ø', 'oe')
-        .str.replace('å', 'aa')
-    )
-    d = get_distance_matrix(geofile)
+    geofile = municipality_polygons()
+    d = get_distance_matrix(geofile, distance_method, 
+                            fnew.connection.to_pandas())
     
-    # Get cost matrix
-    C = d * transport_cost / 1e3
-    C.index.name=''
-    C.columns.name=''
-    C = C.astype('object')
-
-    # Yes.. lazy and slow for loop to disable regions not connected
-    for reg1 in C.index:
-        for reg2 in C.columns:
-            if fnew.connection.loc[reg1, reg2].data == 0:
-                C.loc[reg1, reg2] = ''
+    # Distances (km) of connected regions only
+    connections = connected_distances(d, fnew.connection.to_pandas())
+    regions = d.index.to_numpy().astype(str)
+    lengths = connections.data.astype(float) / 1e3
+    
+    # Cost of each fuel on each connection
+    costs = get_fuel_costs(fuels, transport_cost)
+    records = pd.DataFrame({
+        'FFF' : np.repeat(list(costs.keys()), connections.nnz),
+        'IRRRE' : np.tile(regions[connections.row], len(costs)),
+        'IRRRI' : np.tile(regions[connections.col], len(costs)),
+        'value' : np.concatenate([lengths * cost for cost in costs.values()])
+    })
     
     # Make IncFile
-    C.index = 'STRAW . ' + pd.Series(C.index) 
-    f = IncFile(name='FUELTRANSPORT_COST', path='Output',
-                prefix="TABLE FUELTRANSPORT_COST(FFF, IRRRE, IRRRI) 'Cost of transporting one GJ of fuel F from region IRRRE to IRRRI'\n",
-                body=C,
-                suffix='\n;\nFUELTRANSPORT_COST("WOOD", IRRRE, IRRRI) = FUELTRANSPORT_COST("STRAW", IRRRE, IRRRI);\n')
-    f.save()
+    save_parameter('FUELTRANSPORT_COST', 'Output',
+                   "PARAMETER FUELTRANSPORT_COST(FFF, IRRRE, IRRRI) 'Cost of transporting one GJ of fuel F from region IRRRE to IRRRI'",
+                   records)
 
 
 #%% ------------------------------- ###
 ###            2. Utils             ###
 ### ------------------------------- ###
 
+def get_fuel_costs(fuels: str, transport_cost: float) -> dict:
+    """Transport cost (€/GJ/km) of each fuel in a string like "STRAW, WOOD, WOODCHIPS: 0.02",
+    where fuels without a cost get transport_cost"""
+    costs = {}
+    for fuel in fuels.replace(' ', '').split(','):
+        if fuel == '':
+            continue
+        fuel, _, cost = fuel.partition(':')
+        costs[fuel] = float(cost) if cost != '' else transport_cost
+    
+    if len(costs) == 0:
+        raise ValueError('No fuels to make transport costs for')
+    
+    return costs
+
 @click.pass_context
 def plot_style(ctx, fig: plt.figure, ax: plt.axes, name: str):
     
@@ -13,20 +13,28 @@ Created on 11.09.2024
 import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcol
-from pybalmorel import Balmorel, IncFile
-from pybalmorel.utils import symbol_to_df
+from pybalmorel import IncFile
 from Submodules.utils import convert_names
+from Submodules.balmorel_cache import BalmorelInputCache
 from typing import Tuple
+import heapq
+import os
 import click
 import pandas as pd
 import numpy as np
 import xarray as xr
 import gams
 import geopandas as gpd
-from geofiles import prepared_geofiles
-from scipy.sparse import csr_matrix
+from geofiles import prepared_geofiles, area_attributes, source_fingerprint
+import shapely
+from Submodules.connectivity import edge_list_adjacency, dataset_adjacency, reindex_adjacency, apply_corrections, geometric_adjacency, METHODS as CONNECTIVITY_METHODS
 from Submodules.municipal_template import DataContainer
 from exo_heat_demand import DistrictHeatAAU
+from Submodules.profile_features import profile_features, profile_matrix, shape_normalise, PROFILE_COLUMNS, COMPRESSIONS
+from Submodules.clustering_backends import cluster_labels, BACKENDS
+from Submodules.feature_cache import feature_key, save_features, load_features, FEATURE_CACHE_FOLDER
+from Submodules.cluster_hierarchy import load_hierarchy, save_hierarchy, collapse_adjacency, aggregate_features, HIERARCHY_FOLDER, BASE_FEATURES
+from Submodules.spatial_weights import weight_matrix, apply_weights
 from sklearn.cluster import AgglomerativeClustering
 from sklearn.preprocessing import StandardScaler
 try:
@@ -49,33 +57,51 @@ def truncate_colormap(cmap, minval=0.0, maxval=1.0, n=100):
 ###      1. Utility Functions       ###
 ### ------------------------------- ###
 
-def correct_VRE_data(path_to_file, generation_name: str):
+def correct_VRE_data(path_to_file, generation_name: str, geofile: gpd.GeoDataFrame = None):
+    """VRE generation of municipalities per week and hour of week in 2012, normalised to the maximum of each municipality
+
+    Args:
+        path_to_file (str): Generation of municipalities (id dimension), or of a lon/lat grid (y and x dimensions)
+        generation_name (str): The name of the generation variable
+        geofile (gpd.GeoDataFrame, optional): Municipalities to aggregate gridded generation to, with names as index. Defaults to None.
+    """
     vredata  = xr.load_dataset(path_to_file)
+    
+    if 'x' in vredata.dims and 'y' in vredata.dims:
+        if geofile is None:
+            raise ValueError('%s is gridded, so municipalities are needed to aggregate it'%path_to_file)
+        # Mean of overlapping cells, with sparse weights cached for the grid and geofile
+        weights = weight_matrix(vredata.x.data, vredata.y.data, geofile, 'area_mean')
+        vredata = apply_weights(vredata['specific generation'], weights, pd.Index(geofile.index.values, name='id')).to_dataset()
+    
     vredata  = vredata.rename({'id': 'municipality',
-                                'specific generation' : generation_name})
+                                'specific generation' : generation_name})[generation_name]
     
     # Rename municipalities 
     correct_names = {'Århus' : 'Aarhus',
                 'Høje Taastrup' : 'Høje-Taastrup',
                 'Vesthimmerland' : 'Vesthimmerlands'}
-
-    vredata = vredata.to_dataframe().reset_index()
-    vredata['municipality'] = vredata['municipality'].replace(correct_names)
+    vredata['municipality'] = pd.Index(vredata.municipality.values).map(lambda name: correct_names.get(name, name))
     
     # Get dates
-    vredata['week'] = vredata.time.dt.isocalendar()['week']
-    vredata['day'] = vredata.time.dt.isocalendar()['day']
-    vredata['hour'] = vredata.time.dt.hour + 1 + (vredata['day'] - 1)*24 
-    
     date0 = pd.to_datetime("2012-01-02 00:00")
     date1 = pd.to_datetime("2012-12-31 00:00")
+    vredata = vredata.sel(time=(vredata.time >= date0) & (vredata.time < date1))
+    dates = vredata.time.dt.isocalendar()
     vredata = (
         vredata
-        .query('time >= @date0 and time < @date1')
-        .pivot_table(index=['municipality', 'week', 'hour'],
-                     values=generation_name)
-        .to_xarray()
+        .assign_coords(week=('time', dates.week.data),
+                       hour=('time', (vredata.time.dt.hour + 1 + (dates.weekday - 1)*24).data))
+        .set_index(time=['week', 'hour'])
+        .unstack('time')
     )
+    # Renamed municipalities may coincide with existing ones, so average those.
+    # Grouping unique labels squeezes the dimension away in older xarray
+    if vredata.indexes['municipality'].has_duplicates:
+        vredata = vredata.groupby('municipality').mean()
+    else:
+        vredata = vredata.sortby('municipality')
+    vredata = vredata.to_dataset()
     
     # Normalise
     vredata = vredata / vredata.max(dim=['week', 'hour'])
@@ -173,88 +199,140 @@ columns = {'DE' : ['Y', 'R', 'DEUSER', 'Value'],
            'WNDFLH' : ['A', 'Value'],
            'SOLEFLH' : ['A', 'Value']}
 
-def gather_data(db: gams.GamsDatabase,  
+def gather_data(db: BalmorelInputCache,  
                 cluster_params: list,
-                aggfuncs: list):
+                aggfuncs: list,
+                profile_compression: str = 'paa',
+                profile_components: int = 12):
+    """Collect one feature per region for each of the cluster_params, 
+    or a block of compressed profile features for timeseries (e.g. DE_VAR_T, WND_VAR_T, SOLE_VAR_T)
+    """
     
     for i in range(len(cluster_params)):
-        try:
-            df = symbol_to_df(db, cluster_params[i], columns[cluster_params[i]])
-        except KeyError:
-            print('Column names not found for %s'%cluster_params[i])
-            df = symbol_to_df(db, cluster_params[i])        
+        if cluster_params[i] in PROFILE_COLUMNS:
+            df = db.load(cluster_params[i], PROFILE_COLUMNS[cluster_params[i]])
+            features = profile_features(df, cluster_params[i], aggfuncs[i], 
+                                        profile_compression, profile_components)
+        else:
+            try:
+                df = db.load(cluster_params[i], columns[cluster_params[i]])
+            except KeyError:
+                print('Column names not found for %s'%cluster_params[i])
+                df = db.load(cluster_params[i])        
+            features = apply_filters(df, cluster_params[i], aggfunc=aggfuncs[i])
             
         if i == 0:
-            collected_data = apply_filters(df, cluster_params[i], aggfunc=aggfuncs[i])
+            collected_data = features
             continue
             
         collected_data = collected_data.join(
-            apply_filters(df, cluster_params[i], aggfunc=aggfuncs[i]),
+            features,
             how='outer'
         )
         
     return collected_data.to_xarray().rename({'R':'IRRRE'})
 
-def cluster(model: Balmorel,
-            scenario: str,
-            collected_data: pd.DataFrame,
-            n_clusters: int,
-            use_connectivity: bool = True,
-            manual_corrections: list = [],
-            linkage: str = 'Ward',
-            connection_remark: str = 'connec. included + artifical',
-            data_remark: str = 'all combined + xy coords',
-            include_coordinates: bool = True,
-            second_order: bool = False,
-            first_order_geofile: str = ''):
+def gather_profiles(db: BalmorelInputCache,
+                    cluster_params: list,
+                    aggfuncs: list,
+                    regions: pd.Index) -> list:
+    """The full hourly profiles of the timeseries in cluster_params for the profile_shape backend,
+    z-normalised and in the order of regions. Regions without a profile get zeros
+    """
+    profiles = []
+    for param, aggfunc in zip(cluster_params, aggfuncs):
+        if not(param in PROFILE_COLUMNS):
+            continue
+        names, matrix = profile_matrix(db.load(param, PROFILE_COLUMNS[param]), aggfunc)
+        matrix = shape_normalise(matrix)
+        if not(names.equals(regions)):
+            rows = names.get_indexer(regions)
+            block = np.zeros((len(regions), matrix.shape[1]), dtype=np.float32)
+            block[rows >= 0] = matrix[rows[rows >= 0]]
+            matrix = block
+        profiles.append(matrix)
+    
+    return profiles
+
+def cluster_geofile(second_order: bool = False, first_order_geofile: str = '') -> gpd.GeoDataFrame:
+    """The polygons of the regions to cluster, with region names (IRRRE) as index"""
+    if second_order:
+        geofiles = gpd.read_file('ClusterOutput/%s'%first_order_geofile)
+        geofiles.index = geofiles.cluster_name
+    else:
+        the_index, geofiles, c = prepared_geofiles('DKmunicipalities_names')
+    geofiles.index.name = 'IRRRE'
+    
+    return geofiles
+
+def geofile_identity(second_order: bool = False, first_order_geofile: str = '') -> str:
+    """Identify the regions to cluster and their connectivity data by the source files"""
+    if second_order:
+        stat = os.stat('ClusterOutput/%s'%first_order_geofile)
+        return '%s_%d_%d'%(first_order_geofile, stat.st_size, stat.st_mtime_ns)
+    
+    stat = os.stat('Data/BalmorelData/municipal_connectivity.nc')
+    return '%s_%d_%d'%(source_fingerprint('DKmunicipalities_names'), stat.st_size, stat.st_mtime_ns)
+
+def prepare_data(db: BalmorelInputCache,
+                 collected_data: pd.DataFrame,
+                 use_connectivity: bool = True,
+                 manual_corrections: list = [],
+                 include_coordinates: bool = True,
+                 second_order: bool = False,
+                 first_order_geofile: str = '',
+                 connectivity_method: str = 'balmorel',
+                 n_neighbours: int = 4,
+                 adjacency: tuple = None):
+    """Combine the clustering data with polygons and coordinates, and make the connectivity graph
+
+    The Balmorel connectivity is loaded from the input data, unless an (adjacency, nodes) tuple is given
+
+    Returns:
+        X (xr.Dataset): The data and polygons of each region
+        Y (np.ndarray): The normalised (regions x features) matrix to cluster
+        knn_graph (sparse.csr_matrix): The connectivity between regions, None if no connectivity is used
+    """
 
     # collected_data = collected_data.drop_sel(IRRRE='Christiansoe')
 
     # Connectivity
-    if use_connectivity:
+    if use_connectivity and connectivity_method == 'balmorel':
         ## Use connectivity from Balmorel (Submodules/get_grid.py)
-        if second_order:
-            connectivity = symbol_to_df(model.input_data[scenario], 'XINVCOST')
-            connectivity['connection'] = 1
-            connectivity = connectivity.drop(columns=['YYY', 'Value']).pivot_table(index=['IRRRE', 'IRRRI'], values='connection').to_xarray()
-            connectivity = connectivity.fillna(0)
+        if adjacency is not None:
+            knn_graph, nodes = adjacency
+        elif second_order:
+            knn_graph, nodes = edge_list_adjacency(db.load('XINVCOST'), 'IRRRE', 'IRRRI')
         else:
             connectivity = xr.load_dataset('Data/BalmorelData/municipal_connectivity.nc')
             connectivity_old, connectivity = convert_names('Modules/Submodules/exo_grid_conversion_dictionaries.pkl', connectivity, 'connection') # Convert æøå
-
-            ## Manual Corrections
-            for manual_connection in manual_corrections:
-                connectivity.connection.loc[manual_connection[0], manual_connection[1]] = manual_connection[2]
-                connectivity.connection.loc[manual_connection[1], manual_connection[0]] = manual_connection[2]
+            knn_graph, nodes = dataset_adjacency(connectivity.connection)
             
-        print('Is matrix symmetric?', np.all(connectivity.connection.data == connectivity.connection.data.T))
-        
-        ## Make symmetric index, so the indices fit
-        collected_data = collected_data.assign_coords(IRRRI=collected_data.coords['IRRRE'].data)
-        
-        ## Combine with data
-        # connectivity = connectivity.drop_sel(IRRRE='Christiansoe', IRRRI='Christiansoe')
-        X = collected_data.merge(connectivity)
+        ## Manual Corrections
+        knn_graph = apply_corrections(knn_graph, nodes, manual_corrections)
+        print('Is matrix symmetric?', (knn_graph != knn_graph.T).nnz == 0)
         
-        ## Make symmetric connectivity graph 
-        knn_graph = X.connection.data # get numpy array
-        print('Is matrix still symmetric?', np.all(knn_graph == knn_graph.T))
-        knn_graph = csr_matrix(knn_graph) # make dense format
-        
-        ## Drop the connection variable again
-        X = X.drop_vars('connection')
+        ## Combine with data, adding regions only in the connectivity as before
+        X = collected_data.merge(xr.Dataset(coords={'IRRRE' : nodes.values}))
     else:
-        knn_graph = None # don't apply connectivity constraints
         X = collected_data
     
     ## Combine with polygons for plotting and possible coordinate data
-    if second_order:
-        geofiles = gpd.read_file('ClusterOutput/%s'%first_order_geofile)
-        geofiles.index = geofiles.cluster_name
-    else:
-        the_index, geofiles, c = prepared_geofiles('DKmunicipalities_names')
-    geofiles.index.name = 'IRRRE'
+    geofiles = cluster_geofile(second_order, first_order_geofile)
     X = X.merge(geofiles['geometry'].to_xarray())
+    
+    ## Make sparse connectivity graph in the order of the data
+    if not(use_connectivity):
+        knn_graph = None # don't apply connectivity constraints
+    elif connectivity_method == 'balmorel':
+        knn_graph = reindex_adjacency(knn_graph, nodes, pd.Index(X.coords['IRRRE'].data))
+        print('Is matrix still symmetric?', (knn_graph != knn_graph.T).nnz == 0)
+    else:
+        nodes = pd.Index(X.coords['IRRRE'].data)
+        knn_graph = geometric_adjacency(gpd.GeoSeries(X.geometry.data, crs=geofiles.crs), 
+                                        connectivity_method, n_neighbours)
+        knn_graph = apply_corrections(knn_graph, nodes, manual_corrections)
+        print('%d connections between %d regions from %s'%(knn_graph.nnz/2, len(nodes), connectivity_method))
     if include_coordinates:
         ## Get coordinates 
         coords = gpd.GeoDataFrame(geometry=X.geometry.data).centroid
@@ -270,14 +348,139 @@ def cluster(model: Balmorel,
     # X[:,0] = X[:,0]*10000
     # X[:,1] = X[:,1]*10000
     
-    
-    # Perform Clustering
-    agg = AgglomerativeClustering(n_clusters=n_clusters, linkage=linkage.lower(),
-                                connectivity=knn_graph)
-    agg.fit(Y)
+    return X, Y, knn_graph
+
+def cached_data(db: BalmorelInputCache,
+                cluster_params: list,
+                aggfuncs: list,
+                profile_compression: str = 'paa',
+                profile_components: int = 12,
+                use_connectivity: bool = True,
+                manual_corrections: list = [],
+                include_coordinates: bool = True,
+                second_order: bool = False,
+                first_order_geofile: str = '',
+                connectivity_method: str = 'balmorel',
+                n_neighbours: int = 4,
+                cache_folder: str = FEATURE_CACHE_FOLDER):
+    """The output of prepare_data from the feature cache, gathering and preparing the data if it has not been cached before
+    
+    The cache is keyed by the cluster params, aggregation functions, the Balmorel input (GDX hash), the geofile 
+    and the connectivity settings
+    """
+    key = feature_key(cluster_params=cluster_params, aggfuncs=aggfuncs, 
+                      gdx_hash=os.path.basename(os.path.normpath(db.path)),
+                      geofile=geofile_identity(second_order, first_order_geofile),
+                      profile_compression=profile_compression, profile_components=profile_components,
+                      use_connectivity=use_connectivity, manual_corrections=manual_corrections,
+                      include_coordinates=include_coordinates, second_order=second_order,
+                      connectivity_method=connectivity_method, n_neighbours=n_neighbours)
+    path = os.path.join(cache_folder, '%s.npz'%key)
+    
+    features = load_features(path)
+    if features is not None:
+        print('Loading prepared features from %s'%path)
+        X = xr.Dataset({name : ('IRRRE', features['features'][:, i]) for i, name in enumerate(features['feature_names'])},
+                       coords={'IRRRE' : features['nodes']})
+        X['geometry'] = ('IRRRE', cluster_geofile(second_order, first_order_geofile).geometry.reindex(features['nodes']).values)
+        return X, features['Y'], features['connectivity']
+    
+    collected = gather_data(db, cluster_params, aggfuncs,
+                            profile_compression, profile_components)
+    X, Y, knn_graph = prepare_data(db, collected, use_connectivity, manual_corrections, 
+                                   include_coordinates, second_order, first_order_geofile,
+                                   connectivity_method, n_neighbours)
+    
+    save_prepared(path, X, Y, knn_graph)
+    
+    return X, Y, knn_graph
+
+def save_prepared(path: str, X: xr.Dataset, Y: np.ndarray, knn_graph):
+    """Save the output of prepare_data with Submodules/feature_cache.py"""
+    feature_names = [variable for variable in X.data_vars if not(variable in ['geometry', 'cluster_groups'])]
+    feature_matrix = np.vstack([X.get(variable).data for variable in feature_names]).T.astype(float)
+    scaler = StandardScaler().fit(np.nan_to_num(feature_matrix))
+    save_features(path, X.coords['IRRRE'].data, feature_names, feature_matrix, Y,
+                  scaler.mean_, scaler.scale_, knn_graph)
+
+def hierarchy_data(db: BalmorelInputCache,
+                   cluster_params: list,
+                   aggfuncs: list,
+                   first_order_geofile: str,
+                   profile_compression: str = 'paa',
+                   profile_components: int = 12,
+                   use_connectivity: bool = True,
+                   manual_corrections: list = [],
+                   include_coordinates: bool = True,
+                   connectivity_method: str = 'balmorel',
+                   n_neighbours: int = 4,
+                   folder: str = HIERARCHY_FOLDER):
+    """The output of prepare_data for a second order clustering, built from the first order clustering in the hierarchy
+    
+    The features of the base regions are aggregated to the first order clusters and the connectivity between base regions 
+    is collapsed to connectivity between clusters, so the Balmorel input data is not loaded again.
+    Returns None if the hierarchy does not contain a first order clustering of the same data, settings and geofile,
+    or if timeseries are clustered, since compressed profiles of clusters can not be aggregated from those of their regions
+    """
+    if any([param in PROFILE_COLUMNS for param in cluster_params]):
+        return None
+    
+    hierarchy, metadata = load_hierarchy(folder)
+    first_order = metadata.get('1', {})
+    if (hierarchy is None or first_order.get('geofile') != first_order_geofile
+        or first_order.get('cluster_params') != cluster_params or first_order.get('aggfuncs') != aggfuncs
+        or first_order.get('profile_compression') != profile_compression
+        or first_order.get('profile_components') != profile_components):
+        return None
+    
+    base = load_features(os.path.join(folder, BASE_FEATURES))
+    if base is None or (use_connectivity and connectivity_method == 'balmorel' and base['connectivity'] is None):
+        return None
+    print('Building second order clustering on the first order clustering in %s'%folder)
+    
+    # Features of first order clusters, where coordinates are computed from the cluster polygons in prepare_data
+    mapping = hierarchy.set_index('base')['order_1']
+    feature_names = [name for name in base['feature_names'] if not(name in ['lon', 'lat'])]
+    collected = aggregate_features(base['features'][:, [list(base['feature_names']).index(name) for name in feature_names]],
+                                   base['nodes'], feature_names, dict(zip(cluster_params, aggfuncs)), mapping)
+    collected.index.name = 'IRRRE'
+    
+    adjacency = None
+    if use_connectivity and connectivity_method == 'balmorel':
+        adjacency = collapse_adjacency(base['connectivity'], base['nodes'], mapping)
+    
+    return prepare_data(db, collected.to_xarray(), use_connectivity, manual_corrections,
+                        include_coordinates, True, first_order_geofile,
+                        connectivity_method, n_neighbours, adjacency)
+
+def update_hierarchy(clustering: gpd.GeoDataFrame,
+                     prepared: tuple,
+                     second_order: bool,
+                     first_order_geofile: str = '',
+                     folder: str = HIERARCHY_FOLDER,
+                     **metadata):
+    """Add a clustering to the hierarchy, storing the features and connectivity of the base regions for a first order clustering.
+    A second order clustering is only added if the first order clustering in the hierarchy is first_order_geofile"""
+    if second_order:
+        try:
+            save_hierarchy(2, clustering['cluster_name'], folder, previous_geofile=first_order_geofile, **metadata)
+        except (FileNotFoundError, ValueError) as error:
+            print('Second order clustering not added to the cluster hierarchy:', error)
+    else:
+        X, Y, knn_graph = prepared
+        save_prepared(os.path.join(folder, BASE_FEATURES), X, Y, knn_graph)
+        save_hierarchy(1, clustering['cluster_name'], folder, **metadata)
+
+def plot_clustering(X: xr.Dataset,
+                    labels: np.ndarray,
+                    n_clusters: int,
+                    knn_graph = None,
+                    linkage: str = 'Ward',
+                    connection_remark: str = 'connec. included + artifical',
+                    data_remark: str = 'all combined + xy coords'):
     
     # Merge labels to xarray
-    X['cluster_groups'] = (['IRRRE'], agg.labels_)
+    X['cluster_groups'] = (['IRRRE'], labels)
     
     # Plot the different clustering techniques
     
@@ -331,19 +534,130 @@ def cluster(model: Balmorel,
     
     return fig, ax, clustering
 
-def new_geofile(clustering: gpd.GeoDataFrame, plot: bool = False):
+def cluster(db: BalmorelInputCache,
+            collected_data: pd.DataFrame,
+            n_clusters: int,
+            use_connectivity: bool = True,
+            manual_corrections: list = [],
+            linkage: str = 'Ward',
+            connection_remark: str = 'connec. included + artifical',
+            data_remark: str = 'all combined + xy coords',
+            include_coordinates: bool = True,
+            second_order: bool = False,
+            first_order_geofile: str = '',
+            connectivity_method: str = 'balmorel',
+            n_neighbours: int = 4,
+            backend: str = 'ward',
+            prepared: tuple = None,
+            profiles: list = None):
+    
+    if prepared is None:
+        prepared = prepare_data(db, collected_data, use_connectivity, manual_corrections, 
+                                include_coordinates, second_order, first_order_geofile,
+                                connectivity_method, n_neighbours)
+    X, Y, knn_graph = prepared
+    
+    # Perform Clustering
+    labels = cluster_labels(Y, n_clusters, backend, knn_graph, linkage, profiles=profiles)
+    
+    return plot_clustering(X, labels, n_clusters, knn_graph, method_name(backend, linkage), connection_remark, data_remark)
+
+def method_name(backend: str, linkage: str) -> str:
+    """Name of the clustering method for plot titles"""
+    return linkage if backend == 'ward' else backend
+
+def cut_tree(children: np.ndarray, n_leaves: int, n_clusters: int) -> np.ndarray:
+    """Labels of n_clusters from the merges (children_) of a full agglomerative clustering tree
+
+    Gives the same labels as fitting AgglomerativeClustering with n_clusters, by undoing the last merges
+    """
+    # The n_clusters top nodes, largest node first as in sklearn
+    nodes = [-(np.max(children[-1]) + 1)]
+    for i in range(n_clusters - 1):
+        these_children = children[-nodes[0] - n_leaves]
+        heapq.heappush(nodes, -these_children[0])
+        heapq.heappushpop(nodes, -these_children[1])
+    
+    # Leaves below each top node
+    parents = np.arange(n_leaves + len(children))
+    parents[children.ravel()] = np.repeat(np.arange(n_leaves, n_leaves + len(children)), 2)
+    top = np.full(len(parents), -1)
+    for i, node in enumerate(nodes):
+        top[-node] = i
+    
+    # Walk up from every leaf until reaching a top node, all leaves at once
+    labels = np.arange(n_leaves)
+    while np.any(top[labels] == -1):
+        labels = np.where(top[labels] == -1, parents[labels], labels)
+    
+    return top[labels]
+
+def cluster_sweep(db: BalmorelInputCache,
+                  collected_data: pd.DataFrame,
+                  cluster_sizes: list,
+                  use_connectivity: bool = True,
+                  manual_corrections: list = [],
+                  linkage: str = 'Ward',
+                  connection_remark: str = 'connec. included + artifical',
+                  data_remark: str = 'all combined + xy coords',
+                  include_coordinates: bool = True,
+                  second_order: bool = False,
+                  first_order_geofile: str = '',
+                  connectivity_method: str = 'balmorel',
+                  n_neighbours: int = 4,
+                  backend: str = 'ward',
+                  prepared: tuple = None,
+                  profiles: list = None):
+    """Cluster into each of the cluster_sizes, from a single fit of the full tree for the ward backend
+    
+    Yields:
+        n_clusters, fig, ax, clustering: As cluster() for each size
+    """
+    if prepared is None:
+        prepared = prepare_data(db, collected_data, use_connectivity, manual_corrections, 
+                                include_coordinates, second_order, first_order_geofile,
+                                connectivity_method, n_neighbours)
+    X, Y, knn_graph = prepared
+    
+    # Perform Clustering once
+    if backend == 'ward':
+        agg = AgglomerativeClustering(n_clusters=min(cluster_sizes), linkage=linkage.lower(),
+                                      connectivity=knn_graph, compute_full_tree=True)
+        agg.fit(Y)
+    
+    for n_clusters in cluster_sizes:
+        if backend == 'ward':
+            labels = cut_tree(agg.children_, len(Y), n_clusters)
+        else:
+            labels = cluster_labels(Y, n_clusters, backend, knn_graph, linkage, profiles=profiles)
+        yield (n_clusters,) + plot_clustering(X.copy(), labels, n_clusters, knn_graph, method_name(backend, linkage), connection_remark, data_remark)
+
+def new_geofile(clustering: gpd.GeoDataFrame, plot: bool = False, 
+                simplify_tolerance: float = 0):
+    """Dissolve the regions of each cluster into one polygon, with centroid_lon, centroid_lat and area_km2 attributes
+
+    Args:
+        clustering (gpd.GeoDataFrame): The regions with a cluster_name column
+        plot (bool, optional): Plot before and after. Defaults to False.
+        simplify_tolerance (float, optional): Simplify the cluster polygons, keeping shared borders 
+        between clusters where shapely supports it (>= 2.1). In units of the crs. Defaults to 0 (no simplification).
+    """
+    
+    new_geofile = (
+        clustering[['cluster_name', 'geometry']]
+        .dissolve(by='cluster_name', sort=False)
+        .reset_index()
+    )
     
-    new_geofile = gpd.GeoDataFrame(columns=['cluster_name', 'geometry'],
-                                   geometry='geometry',
-                                   index=np.arange(len(clustering.cluster_name.unique())),
-                                   crs=clustering.crs)
+    if simplify_tolerance > 0:
+        if hasattr(shapely, 'coverage_simplify'):
+            new_geofile['geometry'] = gpd.GeoSeries(shapely.coverage_simplify(new_geofile.geometry.values, simplify_tolerance),
+                                                    index=new_geofile.index, crs=new_geofile.crs)
+        else:
+            new_geofile['geometry'] = new_geofile.geometry.simplify(simplify_tolerance, preserve_topology=True)
     
-    i = 0
-    for cluster in clustering.cluster_name.unique():
-        new_shape = clustering.query('cluster_name == @cluster').geometry.union_all()
-        new_geofile.loc[i, 'geometry'] = new_shape 
-        new_geofile.loc[i, 'cluster_name'] = cluster 
-        i += 1
+    if new_geofile.crs is not None:
+        new_geofile = new_geofile.join(area_attributes(new_geofile.geometry))
         
     if plot:     
         fig, ax = plt.subplots()
@@ -359,13 +673,14 @@ def new_geofile(clustering: gpd.GeoDataFrame, plot: bool = False):
     return new_geofile
         
 
-def region_area_connection(input_data: gams.GamsDatabase,
-                           clustering: gpd.GeoDataFrame):
+def region_area_connection(input_data: BalmorelInputCache,
+                           clustering: gpd.GeoDataFrame,
+                           path: str = 'ClusterOutput'):
     """Creates connections between regions and areas in a 2nd order clustering
     """
     
     # Old geographic sets
-    RRRAAA = symbol_to_df(input_data, 'RRRAAA')
+    RRRAAA = input_data.load('RRRAAA')
     
     # Convert old regions to second order aggregated regions
     RRRAAA_new = (
@@ -386,26 +701,71 @@ def region_area_connection(input_data: gams.GamsDatabase,
     
     # Save
     IncFile(name='CCCRRRAAA',
-            path='ClusterOutput',
+            path=path,
             prefix="SET CCCRRRAAA(CCCRRRAAA) 'All geographical entities (CCC + RRR + AAA)'\n/\n",
             body="DENMARK\n" + "\n".join(RRR + AAA),
             suffix='\n/;').save()
     IncFile(name='CCCRRR',
-            path='ClusterOutput',
+            path=path,
             prefix="SET CCCRRR(CCC, RRR) 'Regions in countries'\n/\n",
             body=RRRAAA_new[['CCCRRR']].style.set_properties(**{'text-align' : 'left'}).hide(axis='index').hide(axis='columns').to_string(),
             suffix='\n/;').save()
     IncFile(name='RRR',
-            path='ClusterOutput',
+            path=path,
             prefix="SET RRR(CCCRRRAAA) 'All regions'\n/\n",
             body="\n".join(RRR),
             suffix='\n/;').save()
     RAInc = IncFile(name='RRRAAA',
-            path='ClusterOutput',
+            path=path,
             prefix="SET RRRAAA(RRR, AAA) 'Areas in regions'\n/\n",
             body=RRRAAA_new[['RRRAAA']].style.set_properties(**{'text-align' : 'left'}).hide(axis='index').hide(axis='columns').to_string(),
             suffix="\n/;").save()
 
+def save_clustering(input_data: BalmorelInputCache,
+                    clustering: gpd.GeoDataFrame,
+                    cluster_params_list: list,
+                    cluster_size: int,
+                    second_order: bool,
+                    sweep: bool = False,
+                    simplify_tolerance: float = 0):
+    """Name the clusters and save the clustering, the aggregated geofile and, for 2nd order clustering, the geographic sets
+
+    Files of a cluster-size sweep get the cluster size in their name, or are saved in a folder for each cluster size
+
+    Returns:
+        str: The filename of the aggregated geofile
+    """
+    
+    # Name clusters
+    clustering['cluster_name'] = 'CL' + clustering.cluster_group.astype(str)
+    
+    # Name filenames
+    clustering_filename  = 'clustering'
+    aggregated_clustering_filename = '%s_%dcluster_geofile'%('-'.join(cluster_params_list), cluster_size)
+    incfile_path = 'ClusterOutput'
+    if sweep:
+        clustering_filename += '_%dcluster'%cluster_size
+        incfile_path = os.path.join(incfile_path, '%dcluster'%cluster_size)
+    if second_order:
+        clustering_filename += '_2nd-order'
+        aggregated_clustering_filename += '_2nd-order'
+    
+    clustering.to_file('ClusterOutput/%s.gpkg'%clustering_filename)
+    
+    # Create new geofile
+    gf = new_geofile(clustering, simplify_tolerance=simplify_tolerance)
+    
+    ## Save
+    gf.to_file('ClusterOutput/%s.gpkg'%aggregated_clustering_filename)
+    
+    if second_order:
+        os.makedirs(incfile_path, exist_ok=True)
+        region_area_connection(input_data,
+                               clustering,
+                               incfile_path)
+    
+    return aggregated_clustering_filename + '.gpkg'
+
 #%% ------------------------------- ###
 ###             2. Main             ###
 ### ------------------------------- ###
@@ -420,6 +780,12 @@ def region_area_connection(input_data: gams.GamsDatabase,
 @click.option('--first-order-geofile', type=str, required=False, help='The geofile from first order clusterig')
 @click.option('--plot-style', type=str, required=False, help='Style of the plot. Options are "report" (bright background) or "ppt" (dark background)')
 @click.option('--gams-sysdir', type=str, required=False, help='GAMS system directory')
+@click.option('--connectivity', type=click.Choice(CONNECTIVITY_METHODS), required=False, default='balmorel', help='Connectivity from the Balmorel grid, or from polygon touches, Delaunay triangulation or k-nearest neighbours of centroids')
+@click.option('--backend', type=click.Choice(list(BACKENDS)), required=False, default='ward', help='Clustering method: connectivity-constrained Ward, spectral clustering of the connectivity graph, k-medoids, mini-batch k-means, or k-means of the correlation between full hourly profiles of the timeseries in --cluster-params')
+@click.option('--profile-compression', type=click.Choice(COMPRESSIONS), required=False, default='paa', help='Compression of timeseries in --cluster-params (DE_VAR_T, DH_VAR_T, WND_VAR_T, SOLE_VAR_T): piecewise aggregate approximation or randomized PCA')
+@click.option('--profile-components', type=int, required=False, default=12, help='Number of features each compressed timeseries is reduced to')
+@click.option('--simplify-tolerance', type=float, required=False, default=0, help='Simplify the polygons of the aggregated geofile with this tolerance in degrees, 0 for no simplification')
+@click.option('--cluster-sizes', type=str, required=False, default='', help='Comma-separated list of cluster sizes, cut from the same clustering tree, to save in addition to --cluster-size')
 def main(model_path: str, 
          scenario: str, 
          cluster_params: str,
@@ -428,7 +794,13 @@ def main(model_path: str,
          second_order: bool,
          first_order_geofile: str = '',
          plot_style: str = 'report',
-         gams_sysdir: str = '/opt/gams/48.5'):
+         gams_sysdir: str = '/opt/gams/48.5',
+         connectivity: str = 'balmorel',
+         cluster_sizes: str = '',
+         backend: str = 'ward',
+         profile_compression: str = 'paa',
+         profile_components: int = 12,
+         simplify_tolerance: float = 0):
 
     # Convert comma-separated string to list
     cluster_params_list = cluster_params.replace(' ', '').split(',')
@@ -443,42 +815,56 @@ def main(model_path: str,
         fc = 'none'
 
     # Collect Balmorel input data from scenario
-    model = Balmorel(model_path, gams_system_directory=gams_sysdir)
-    model.load_incfiles(scenario)
+    db = BalmorelInputCache.from_model(model_path, scenario, gams_sysdir)
 
-    # Get parameters for clustering    
-    collected = gather_data(model.input_data[scenario], 
-                            cluster_params_list, aggfuncs)
+    # Get parameters for clustering, prepared for clustering
+    prepared = None
+    if second_order:
+        ## Build on the first order clustering, if it clustered the same data
+        prepared = hierarchy_data(db, cluster_params_list, aggfuncs, first_order_geofile,
+                                  profile_compression, profile_components,
+                                  connectivity_method=connectivity)
+    if prepared is None:
+        prepared = cached_data(db, cluster_params_list, aggfuncs,
+                               profile_compression, profile_components,
+                               second_order=second_order, first_order_geofile=first_order_geofile,
+                               connectivity_method=connectivity)
+    profiles = None
+    if backend == 'profile_shape':
+        profiles = gather_profiles(db, cluster_params_list, aggfuncs, pd.Index(prepared[0].coords['IRRRE'].data))
+    metadata = {'model_path' : model_path, 'scenario' : scenario, 
+                'cluster_params' : cluster_params_list, 'aggfuncs' : aggfuncs,
+                'profile_compression' : profile_compression, 'profile_components' : profile_components}
+    
+    if cluster_sizes:
+        # Cut one linkage tree at every cluster size, including cluster_size
+        sizes = sorted(set([int(size) for size in cluster_sizes.replace(' ', '').split(',')] + [cluster_size]), reverse=True)
+        for size, fig, ax, clustering in cluster_sweep(db, None, sizes, connection_remark='', data_remark=cluster_params, 
+                                                       include_coordinates=True, second_order=second_order, first_order_geofile=first_order_geofile,
+                                                       connectivity_method=connectivity, backend=backend,
+                                                       prepared=prepared, profiles=profiles):
+            fig.savefig('ClusterOutput/Figures/clustering_%dcluster.pdf'%size, transparent=True, bbox_inches='tight')
+            plt.close(fig)
+            save_clustering(db, clustering, cluster_params_list, size, second_order, sweep=True, 
+                            simplify_tolerance=simplify_tolerance)
+            
+            # The chosen cluster size is also saved as the output of a single clustering
+            if size == cluster_size:
+                geofile = save_clustering(db, clustering, cluster_params_list, size, second_order, 
+                                          simplify_tolerance=simplify_tolerance)
+                update_hierarchy(clustering, prepared, second_order, first_order_geofile, geofile=geofile, **metadata)
+        return
     
     # Do clustering
-    fig, ax, clustering = cluster(model, scenario, collected, cluster_size, connection_remark='', data_remark=cluster_params, 
-                                  include_coordinates=True, second_order=second_order, first_order_geofile=first_order_geofile)
+    fig, ax, clustering = cluster(db, None, cluster_size, connection_remark='', data_remark=cluster_params, 
+                                  include_coordinates=True, second_order=second_order, first_order_geofile=first_order_geofile,
+                                  connectivity_method=connectivity, backend=backend,
+                                  prepared=prepared, profiles=profiles)
     fig.savefig('ClusterOutput/Figures/clustering.pdf', transparent=True, bbox_inches='tight')
     
-    # Name clusters
-    clustering['cluster_name'] = ''
-    for cluster_grouping in clustering.cluster_group.unique():
-        idx = clustering.query('cluster_group == @cluster_grouping').index 
-        clustering.loc[idx, 'cluster_name'] = 'CL%d'%cluster_grouping
-    
-    # Name filenames
-    clustering_filename  = 'clustering'
-    aggregated_clustering_filename = '%s_%dcluster_geofile'%('-'.join(cluster_params_list), cluster_size)
-    if second_order:
-        clustering_filename += '_2nd-order'
-        aggregated_clustering_filename += '_2nd-order'
-    
-    clustering.to_file('ClusterOutput/%s.gpkg'%clustering_filename)
-    
-    # Create new geofile
-    gf = new_geofile(clustering)
-    
-    ## Save
-    gf.to_file('ClusterOutput/%s.gpkg'%aggregated_clustering_filename)
-    
-    if second_order:
-        region_area_connection(model.input_data[scenario],
-                               clustering)
+    geofile = save_clustering(db, clustering, cluster_params_list, cluster_size, second_order, 
+                              simplify_tolerance=simplify_tolerance)
+    update_hierarchy(clustering, prepared, second_order, first_order_geofile, geofile=geofile, **metadata)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
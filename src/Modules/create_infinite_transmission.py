@@ -16,6 +16,8 @@ import numpy as np
 import click
 import geopandas as gpd
 
+CHUNKSIZE = 100000 # Pairs of regions formatted at a time
+
 @click.group()
 @click.option('--dark-style', is_flag=True, required=False, help='Dark plot style')
 @click.option('--plot-ext', type=str, default='.pdf', required=False, help='The extension of the plot, defaults to ".pdf"')
@@ -48,28 +50,39 @@ def trans(cluster_file: str, cap: float):
     
     # The cluster file
     gf = gpd.read_file(cluster_file)
-    print(gf.columns)
+    
+    # Regions of each cluster, in the order of the cluster file
+    regions = gf[['cluster_name', 'index']].drop_duplicates()
     
     # The output
-    f = open('ClusterOutput/transmisson_relaxation.inc', 'w')
-        
-    for cluster in gf.cluster_name.unique():
-        
-        nodes = gf.query('cluster_name == @cluster')['index'].unique()
-        nodes_j = list(nodes.copy())
-        # print('\nNodes in %s: %s'%(cluster, ', '.join(nodes)))
-        
-        
-        for node_i in nodes:
-            for node_j in [node_j for node_j in nodes_j if node_j != node_i]:
-                f.write("XKFX(YYY,'%s','%s') = %0.2f;\n"%(node_i, node_j, cap))
-                f.write("XKFX(YYY,'%s','%s') = %0.2f;\n"%(node_j, node_i, cap))
-            nodes_j.remove(node_i)
+    n_pairs = 0
+    with open('ClusterOutput/transmisson_relaxation.inc', 'w', buffering=2**20) as f:
+        for cluster, nodes in regions.groupby('cluster_name', sort=False)['index']:
+            n_pairs += write_relaxation(f, nodes.to_numpy().astype(str), cap)
+    
+    print('Wrote XKFX = %0.2f for %d pairs of regions within %d clusters'%(cap, n_pairs, regions.cluster_name.nunique()))
             
 #%% ------------------------------- ###
 ###            2. Utils             ###
 ### ------------------------------- ###
 
+def write_relaxation(f, nodes: np.ndarray, cap: float, chunksize: int = CHUNKSIZE) -> int:
+    """Write XKFX in both directions between all pairs of nodes, returning the number of pairs"""
+    
+    node_i, node_j = np.triu_indices(len(nodes), k=1)
+    value = "') = %0.2f;"%cap
+    for start in range(0, len(node_i), chunksize):
+        i = nodes[node_i[start:start+chunksize]]
+        j = nodes[node_j[start:start+chunksize]]
+        
+        # Both directions after each other
+        from_nodes = np.column_stack((i, j)).ravel()
+        to_nodes = np.column_stack((j, i)).ravel()
+        lines = np.char.add(np.char.add(np.char.add(np.char.add("XKFX(YYY,'", from_nodes), "','"), to_nodes), value)
+        f.write('\n'.join(lines.tolist()) + '\n')
+    
+    return len(node_i)
+
 @click.pass_context
 def plot_style(ctx, fig: plt.figure, ax: plt.axes, name: str, legend: bool = True):
     
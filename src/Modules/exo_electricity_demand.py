@@ -18,7 +18,7 @@ Created on 22.08.2024
 import click
 from Submodules.utils import convert_names, transform_xrdata 
 import xarray as xr
-from pybalmorel import IncFile
+from Submodules.incfiles import IncFile
 
 
 #%% ------------------------------- ###
@@ -20,7 +20,8 @@ import cartopy.crs as ccrs
 from pyproj import Proj
 import numpy as np
 import matplotlib.pyplot as plt
-from geofiles import prepared_geofiles
+from geofiles import prepared_geofiles, assign_points_to_areas
+from Submodules.incfiles import IncFile
 import copy
 
 #%% ----------------------------- ###
@@ -593,178 +594,126 @@ pp = pp[~pp.G.isna()]
 ### 3. Load Geodata and Pre-process ###
 ### ------------------------------- ###
 
+def plot_powerplants(pp: gpd.GeoDataFrame, areas: gpd.GeoDataFrame, 
+                     types: str = 'main_fuel'):
+    """Plot power plants on top of the areas, coloured by the column types"""
+    # Set projection
+    crs = ccrs.UTM(32)
+
+    # Make figure
+    fig, ax = plt.subplots(figsize=(10, 10), subplot_kw={"projection": crs},
+                            dpi=200)
+
+    # Add areas
+    ax.add_geometries(areas.geometry, crs = crs,
+                      facecolor=[.9, .9,.9], edgecolor='grey',
+                      linewidth=.2)
+
+    # Add power plants according to some type
+    for typ in pp[types].unique():
+        idx = pp[types] == typ
+        ax.plot(pp.loc[idx, 'Lon'],pp.loc[idx, 'Lat'], 'o', markersize=.7, markeredgecolor='None')
+
+    # Formatting the plot
+    lines = ax.get_lines()
+    new_ax = []
+    for line in lines:
+        new = copy.copy(line)
+        new.set_markersize(4)
+        new_ax.append(new)
+    ax.legend(new_ax, pp[types].unique())
+    ax.set_xlim(7.5,16)      
+    ax.set_ylim(54.4,58)  
+
+    return fig, ax
 
 the_index, areas, country_code = prepared_geofiles(choice)
 areas.plot()
 
-# ## 3.1 Choose geodata file
-# # DKmunicipal 
-# if choice == 'DK Municipalities':
-# # Filter away unnescescary columns
-# # areas = areas[['NAME_1', 'NAME_2', 'geometry']]
-#     areas = gpd.read_file('Denmark/Adm/gadm36_DNK_2.shp')
-#     # Aggregate hovedstaden - MODIFY TO USE NUTS3 AREAS FOR CAPITAL REGION
-#     idx = (areas.NAME_1 == 'Hovedstaden') & (areas.NAME_2 != 'Bornholm') & (areas.NAME_2 != 'Christiansø')
-#     hovedstaden = MultiPolygon(areas[idx].geometry.cascaded_union)
-    
-#     areas = areas.drop(index=list(areas.index[idx]))
-#     areas = pd.concat((areas, gpd.GeoDataFrame({'NAME_1' : 'Hovedstaden', 
-#                           'NAME_2' : 'København',
-#                           'geometry' : [hovedstaden]})))
-    
-# # NUTS 
-# # NUTS areas are useful for a high-res european model
-# elif choice == 'NUTS3':
-#     areas = gpd.read_file('NUTS_RG_01M_2021_4326.shp')
-#     areas = areas[(areas.LEVL_CODE == 3) & (areas.NUTS_ID.str.find('DK') != -1)] # Only DK
-
-# else:
-#     print("You didn't choose any geodata! Check spelling")
-    
-    
-    
-    
-# ### 3.2 Visualise current areas and power plants
-# # Set projection
-crs = ccrs.UTM(32)
-# # Make compatible with geopandas
-# # projection = crs.proj4_init # doesn't work, so actually cartopy is useless - continuing only with geopandas
-
-# Make figure
-fig, ax = plt.subplots(figsize=(10, 10), subplot_kw={"projection": crs},
-                        dpi=200)
-
-
-# Add areas
-ax.add_geometries(areas.geometry, crs = crs,
-                  facecolor=[.9, .9,.9], edgecolor='grey',
-                  linewidth=.2)
-
-# Add power plants according to some type
-types = 'main_fuel'
-for typ in pp[types].unique():
-    idx = pp[types] == typ
-    ax.plot(pp.loc[idx, 'Lon'],pp.loc[idx, 'Lat'], 'o', markersize=.7, markeredgecolor='None')
-
-# Formatting the plot
-lines = ax.get_lines()
-new_ax = []
-for line in lines:
-    new = copy.copy(line)
-    new.set_markersize(4)
-    new_ax.append(new)
-ax.legend(new_ax, pp[types].unique())
-ax.set_xlim(7.5,16)      
-ax.set_ylim(54.4,58)  
+### 3.1 Visualise current areas and power plants
+fig, ax = plot_powerplants(pp, areas)
 fig.savefig('Output/Figures/anlæg.pdf', bbox_inches='tight')
 
 
 
-# ### Check what municipality the offshore wind turbine belongs to (DK Municipality assumption)
-# # mun = pp.loc[pp.unit_type == 'Havvindmølle', 'town'].unique()
-# # Is it in the shapefile used?
-# # for m in mun:
-# #     print(m in areas['NAME_2'].unique())
-
-
-# ## Figure out where each powerplant is located (intersection with municipality)
-# # How do i get from here though? 
-# # a = MultiPoint(pp.geometry).intersection(areas.geometry[0])
-
-
-
 #%% ------------------------------- ###
 ###          4. Aggregation         ###
 ### ------------------------------- ###
 
-# NOTE: This might be an incredibly stupid way to go!
-#       Try using spatial join (gpd.sjoin)
-#       This could, e.g., create a new gpd, where areas (on the left) is joined with
-#       powerplants if it's inside (using op='contains')
-#       Or the other way around:
-#       powerplants on the left are joined with an area (using op='within')
-#       Use the 'inner' option for deleting powerplants/areas that did not contain/within
-#       any of it's counterparts, or 'left' to keep those powerplants/areas with
-#       NaN values, to not lose data
-
-### 4.1 Assign areas
-temp_pp = pp.copy()
-for i,row in areas.iterrows():
-    # Iterate through each polygon (could be multipolygon)
-    # Assign polygon to powerplants
-    idx = pp.geometry.intersects(row.geometry)
-    
-    # Assign area    
-    pp.loc[idx, 'area'] = row[the_index]
+def assign_areas(pp: gpd.GeoDataFrame, areas: gpd.GeoDataFrame, the_index: str) -> gpd.GeoDataFrame:
+    """Assign the area that each powerplant is within, and the nearest area to the rest (typically offshore plants)"""
+    pp = pp.copy()
+    pp['area'] = assign_points_to_areas(pp, areas, the_index)
+    return pp
+
+def plot_assignment(pp: gpd.GeoDataFrame, ax):
+    """Plot powerplants coloured by their assigned area, to see if assignment was succesful"""
+    for a in pp.loc[:,'area'].unique():
+        idx = pp.loc[:, 'area'] == a
+        ax.plot(pp[idx].geometry.x,pp[idx].geometry.y, 'o', markersize=2)
+
+def create_GKFX(pp: gpd.GeoDataFrame, Ymax: int) -> pd.DataFrame:
+    """Aggregate electric capacities to areas and technologies, 
+    and sum from the last decommissioning year to get GKFX from 2020 to Ymax"""
+    GKFX = pp.pivot_table(values='electric_capacity_MW', index=['area', 'G'], columns=['decommissioning'], aggfunc=np.sum)
+
+    ## Cleaning up
+    # New index as combined columns
+    GKFX.index = ['_A . '.join(map(str,i)) for i in GKFX.index.tolist()]
+    GKFX[GKFX.isna()] = 0 # All years where no capacity is present
+    GKFX.columns.name = ''
+
+    # Make summation from last decommissioning year, to get GKFX
+    GKFX = GKFX.iloc[:,::-1].cumsum(axis=1) # Sums from last year to 2020
+    GKFX = GKFX.iloc[:,::-1] # Turn back around to 2020 -> 
         
-# Assign the missing powerplants to nearest polygon (could be used for all, but this way is probably faster)
-# Typically offshore plants
-idx = pp['area'].isna()
-for i,row in pp[idx].iterrows():
-    
-    # Calculate distances
-    dist = {r[0] : r[1].geometry.distance(row.geometry) for r in areas.iterrows()}
-    
-    # Get index in areas
-    ind = min(dist, key=dist.get)
-
-    # Assign area
-    pp.loc[i, 'area'] = areas.loc[ind, the_index]
-
-# Plot to see if assignment was succesful
-for a in pp.loc[:,'area'].unique():
-    idx = pp.loc[:, 'area'] == a
-    ax.plot(pp[idx].geometry.x,pp[idx].geometry.y, 'o', markersize=2)
+    # Have capacity from 2020 at least
+    Ymin = GKFX.columns.min()
+    if Ymin > 2020:
+        for i in range(2020, Ymin):
+            GKFX[i] = GKFX[Ymin]
+        
+    # Sort columns for readability
+    GKFX = GKFX[GKFX.columns.sort_values()]
+
+    # Delete all years after Ymax
+    GKFX = GKFX[np.arange(GKFX.columns.min(), Ymax+1)]
+
+    return GKFX
+
+def save_GKFX(GKFX: pd.DataFrame, path: str = './Output'):
+    IncFile(name='GKFX', path=path,
+            prefix="\n".join([
+                "PARAMETER GKFX(YYY,AAA,GGG)        'Capacity of generation technologies';",
+                "TABLE GKFX1(AAA,GGG,YYY)           'Capacity of generation technologies' ",
+                ""
+            ]),
+            body=GKFX,
+            suffix="\n".join([
+                "",
+                ";",
+                "GKFX(YYY,AAA,GGG) = GKFX1(AAA,GGG,YYY);",
+                "GKFX1(AAA,GGG,YYY)=0;"
+            ])).save()
 
+### 4.1 Assign areas
+pp = assign_areas(pp, areas, the_index)
+plot_assignment(pp, ax)
 
 #%% 4.2 Do aggregation
-GKFX = pp.pivot_table(values='electric_capacity_MW', index=['area', 'G'], columns=['decommissioning'], aggfunc=np.sum)
-
-## Cleaning up
-# New index as combined columns
-GKFX.index = ['_A . '.join(map(str,i)) for i in GKFX.index.tolist()]
-GKFX[GKFX.isna()] = 0 # All years where no capacity is present
-GKFX.columns.name = ''
-
-# Make summation from last decommissioning year, to get GKFX
-GKFX = GKFX.iloc[:,::-1].cumsum(axis=1) # Sums from last year to 2020
-GKFX = GKFX.iloc[:,::-1] # Turn back around to 2020 -> 
-     
-# Have capacity from 2020 at least
-Ymin = GKFX.columns.min()
-if Ymin > 2020:
-    for i in range(2020, Ymin):
-        GKFX[i] = GKFX[Ymin]
-    
-# Sort columns for readability
-GKFX = GKFX[GKFX.columns.sort_values()]
-
-# Delete all years after Ymax
-GKFX = GKFX[np.arange(GKFX.columns.min(), Ymax+1)]
-
+GKFX = create_GKFX(pp, Ymax)
 
 #%% 4.3 Save as GKFX.inc
-with open('./Output/GKFX.inc', 'w') as f:
-    f.write("PARAMETER GKFX(YYY,AAA,GGG)        'Capacity of generation technologies';\n")
-    f.write("TABLE GKFX1(AAA,GGG,YYY)           'Capacity of generation technologies' \n")
-    dfAsString = GKFX.to_string(header=True, index=True)
-    f.write(dfAsString)
-    f.write('\n;')
-    f.write('\nGKFX(YYY,AAA,GGG) = GKFX1(AAA,GGG,YYY);')
-    f.write('\nGKFX1(AAA,GGG,YYY)=0;')
-                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                      
-                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                          
-                                                                                                                                   
+save_GKFX(GKFX)
+
 #%% Test cascaded_union
 # Make figure
-fig, ax = plt.subplots(figsize=(10, 10), subplot_kw={"projection": crs},
+fig, ax = plt.subplots(figsize=(10, 10), subplot_kw={"projection": ccrs.UTM(32)},
                        dpi=200)
 
 # Add danish municipalities
-ax.add_geometries(areas.geometry, crs = crs,
+ax.add_geometries(areas.geometry, crs = ccrs.UTM(32),
                   facecolor=[.9, .9,.9], edgecolor='grey',
                   linewidth=.2)
-ax.plot(temp_pp['Lon'], temp_pp['Lat'], 'k+', markersize=3)
+ax.plot(pp['Lon'], pp['Lat'], 'k+', markersize=3)
 fig.savefig('Output/Figures/exo_powerplants_plot2.png')
-
-# dist = {r[0] : r[1].geometry.distance(areas.geometry.iloc[0]) for r in temp_pp.iterrows()}
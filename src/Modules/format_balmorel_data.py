@@ -15,6 +15,7 @@ from Submodules.utils import cmap
 from clustering import convert_municipal_code_to_name
 from geofiles import prepared_geofiles
 from Submodules.utils import store_balmorel_input
+from Submodules.balmorel_cache import SymbolCache
 from onshore_vre_func import onshore_vre_func
 import numpy as np
 from pybalmorel import IncFile
@@ -37,7 +38,8 @@ import matplotlib.pyplot as plt
 @click.option("--model-path", type=str, required=False, default='.', help="Path of the Balmorel model")
 @click.option("--scenario", type=str, required=False, default='base', help="Scenario to load results from")
 @click.option("--load-again", type=bool, required=False, help="Load scenario results again and overwrite previously loaded .gdx?")
-def main(ctx, model_path: str, scenario: str, load_again: bool = False):
+@click.option("--cache-stats", is_flag=True, required=False, help="Print statistics of the Balmorel symbol cache when done")
+def main(ctx, model_path: str, scenario: str, load_again: bool = False, cache_stats: bool = False):
     """CLI to convert Balmorel data from previous studies"""
     
     # Load Geodataframe with municipal codes and names
@@ -60,6 +62,9 @@ def main(ctx, model_path: str, scenario: str, load_again: bool = False):
     ctx.obj['scenario'] = scenario
     ctx.obj['load_again'] = load_again
     ctx.obj['mun'] = mun
+    
+    if cache_stats:
+        ctx.call_on_close(lambda: print(SymbolCache().report()))
      
     
 @main.command()
@@ -78,7 +83,7 @@ def grids(ctx):
     if not(os.path.exists(file)):
         XINVCOST = store_balmorel_input('XINVCOST',
                             ['Y', 'RE', 'RI', 'connection'],
-                            ctx.obj['balmorel_model_path'], ctx.obj['scenario'], ctx.obj['load_again'],
+                            ctx.obj['model_path'], ctx.obj['scenario'], ctx.obj['load_again'],
                             lambda x: x.query("Y == '2050' and (RE.str.contains('DK_') and RI.str.contains('DK_'))"), # Hardcoded for old database
                             False)
 
@@ -12,15 +12,23 @@ See the following documentation, for understanding how this script works:
 """
 
 from typing import Union
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import geopandas as gpd
+import shapely
+from scipy import sparse
+from concurrent.futures import ProcessPoolExecutor
 try:
     import cartopy.crs as ccrs
 except ModuleNotFoundError:
     pass
-from pyproj import Proj
+from pyproj import Proj, CRS
 import os
+import json
+import hashlib
+import inspect
+from functools import lru_cache
 
 style = 'report'
 
@@ -31,38 +39,27 @@ elif style == 'ppt':
     plt.style.use('dark_background')
     fc = 'none'
 
+GEOFILE_STORE = os.path.join('Data', 'Shapefiles', 'GeofileStore')
+GEOFILE_PROJECTIONS = [4328, 4093, 3035, 6933] # Projections stored next to the original geometries
+GEOFILE_SOURCES = {
+    'dkmunicipalities' : 'Data/Shapefiles/Denmark/Adm/gadm36_DNK_2.shp',
+    'dkmunicipalities_names' : 'Data/Shapefiles/Denmark/Adm/gadm36_DNK_2.shp',
+    'nuts1' : './Data/Shapefiles/NUTS_RG_01M_2021_4326/NUTS_RG_01M_2021_4326.shp',
+    'nuts2' : './Data/Shapefiles/NUTS_RG_01M_2021_4326/NUTS_RG_01M_2021_4326.shp',
+    'nuts3' : 'Data/Shapefiles/NUTS_RG_01M_2021_4326/NUTS_RG_01M_2021_4326.shp',
+    'nordpool' : './Data/Shapefiles/NordpoolRegions/geojson',
+    'nordpoolreal' : './Data/Shapefiles/NordpoolRegions/geojson_real',
+    'balmorel2022' : './Data/Shapefiles/2022 BalmorelMap.geojson',
+    'balmorelvreareas' : './Data/Shapefiles/BalmorelVRE/BalmorelVREAreas.gpkg',
+    'antbalm' : './Data/Shapefiles/240112 AntBalmMap.gpkg'
+}
+
 
 ### ------------------------------- ###
 ### 1. Load Geodata and Pre-Process ###
 ### ------------------------------- ###
-def prepared_geofiles(choice: str, plot: bool = False) -> tuple[str, gpd.GeoDataFrame, str]:
-    """
-    Prepared geofiles for various spatial resolutions
-
-    Parameters
-    ----------
-    choice : str
-        Currently supports:\n
-            'DK Municipalities'\n
-            'NUTS1'\n
-            'NUTS2'\n
-            'NUTS3'\n
-            'Nordpool'\n
-            'NordpoolReal'\n
-            'BalmorelVREAreas'\n
-            'Antbalm'\n
-            
-    plot : str
-        Chooses to plot or not
-
-    Returns
-    -------
-    area_names : Array of str
-        The region names.
-        
-    areas : GeoDataFrame
-        The pre-processed shapefile, including all metadata.
-    """
+def read_geofile(choice: str) -> tuple[str, gpd.GeoDataFrame, str]:
+    """Read and pre-process the geofile of a choice from the source files, see prepared_geofiles"""
 
     ## Projections
     # UTM32 = Proj(proj='utm', zone=32, ellps='WGS84', preserve_units=False)
@@ -75,7 +72,7 @@ def prepared_geofiles(choice: str, plot: bool = False) -> tuple[str, gpd.GeoData
     if choice.replace(' ','').lower() == 'dkmunicipalities':
     # Filter away unnescescary columns
     # areas = areas[['NAME_1', 'NAME_2', 'geometry']]
-        areas = gpd.read_file('Data/Shapefiles/Denmark/Adm/gadm36_DNK_2.shp')
+        areas = gpd.read_file(GEOFILE_SOURCES['dkmunicipalities'])
         # # Aggregate hovedstaden - MODIFY TO USE NUTS3 AREAS FOR CAPITAL REGION
         # idx = (areas.NAME_1 == 'Hovedstaden') & (areas.NAME_2 != 'Bornholm') & (areas.NAME_2 != 'Christiansø')
         # hovedstaden = MultiPolygon(areas[idx].geometry.cascaded_union)
@@ -101,7 +98,7 @@ def prepared_geofiles(choice: str, plot: bool = False) -> tuple[str, gpd.GeoData
     if choice.replace(' ','').lower() == 'dkmunicipalities_names':
         # Filter away unnescescary columns
         # areas = areas[['NAME_1', 'NAME_2', 'geometry']]
-        areas = gpd.read_file('Data/Shapefiles/Denmark/Adm/gadm36_DNK_2.shp')
+        areas = gpd.read_file(GEOFILE_SOURCES['dkmunicipalities'])
         # # Aggregate hovedstaden - MODIFY TO USE NUTS3 AREAS FOR CAPITAL REGION
         # idx = (areas.NAME_1 == 'Hovedstaden') & (areas.NAME_2 != 'Bornholm') & (areas.NAME_2 != 'Christiansø')
         # hovedstaden = MultiPolygon(areas[idx].geometry.cascaded_union)
@@ -137,7 +134,7 @@ def prepared_geofiles(choice: str, plot: bool = False) -> tuple[str, gpd.GeoData
         
     # NUTS3 (Also contains NUTS2, and NUTS1)
     elif choice.replace(' ','').lower() == 'nuts1':
-        areas = gpd.read_file('./Data/Shapefiles/NUTS_RG_01M_2021_4326/NUTS_RG_01M_2021_4326.shp')
+        areas = gpd.read_file(GEOFILE_SOURCES['nuts1'])
         areas = areas[(areas.LEVL_CODE == 1)] 
         
         # The index for next file
@@ -147,7 +144,7 @@ def prepared_geofiles(choice: str, plot: bool = False) -> tuple[str, gpd.GeoData
         # areas = areas[areas.NUTS_ID.str.find('DK') != -1]
     
     elif choice.replace(' ','').lower() == 'nuts2':
-        areas = gpd.read_file('./Data/Shapefiles/NUTS_RG_01M_2021_4326/NUTS_RG_01M_2021_4326.shp')
+        areas = gpd.read_file(GEOFILE_SOURCES['nuts2'])
         areas = areas[(areas.LEVL_CODE == 2)] 
         
         # The index for next file
@@ -157,7 +154,7 @@ def prepared_geofiles(choice: str, plot: bool = False) -> tuple[str, gpd.GeoData
         # areas = areas[areas.NUTS_ID.str.find('DK') != -1]
         
     elif choice.replace(' ','').lower() == 'nuts3':
-        areas = gpd.read_file('Data/Shapefiles/NUTS_RG_01M_2021_4326/NUTS_RG_01M_2021_4326.shp')
+        areas = gpd.read_file(GEOFILE_SOURCES['nuts3'])
         areas = areas[(areas.LEVL_CODE == 3)]
         
         # The index for next file
@@ -168,7 +165,7 @@ def prepared_geofiles(choice: str, plot: bool = False) -> tuple[str, gpd.GeoData
         
     # Nordpool market regions
     elif choice.replace(' ','').lower() == 'nordpool':
-        p = './Data/Shapefiles/NordpoolRegions/geojson'
+        p = GEOFILE_SOURCES['nordpool']
         
         areas = gpd.GeoDataFrame()
         for file in os.listdir(p):
@@ -179,7 +176,7 @@ def prepared_geofiles(choice: str, plot: bool = False) -> tuple[str, gpd.GeoData
         # areas = areas[(areas.zoneName == 'DK_1') | (areas.zoneName == 'DK_2')]
     
     elif choice.replace(' ','').lower() == 'nordpoolreal':
-        p = './Data/Shapefiles/NordpoolRegions/geojson_real'
+        p = GEOFILE_SOURCES['nordpoolreal']
         
         i = 0
         areas = gpd.GeoDataFrame({'RRR' : []})
@@ -195,7 +192,7 @@ def prepared_geofiles(choice: str, plot: bool = False) -> tuple[str, gpd.GeoData
         country_code = 'Country'
         
     elif choice.replace(' ','').lower() == 'balmorel2022':
-        p = './Data/Shapefiles/2022 BalmorelMap.geojson'
+        p = GEOFILE_SOURCES['balmorel2022']
         areas = gpd.read_file(p)
         area_names = 'id'
         areas = areas[areas.id != 'RU']
@@ -205,11 +202,11 @@ def prepared_geofiles(choice: str, plot: bool = False) -> tuple[str, gpd.GeoData
         areas = areas[~areas.id.isnull()]
     
     elif choice.replace(' ','').lower() == 'balmorelvreareas':
-        areas = gpd.read_file('./Data/Shapefiles/BalmorelVRE/BalmorelVREAreas.gpkg')
+        areas = gpd.read_file(GEOFILE_SOURCES['balmorelvreareas'])
         area_names = 'Region' 
         country_code = 'Country'
     elif choice.replace(' ','').lower() == 'antbalm':
-        areas = gpd.read_file('./Data/Shapefiles/240112 AntBalmMap.gpkg')
+        areas = gpd.read_file(GEOFILE_SOURCES['antbalm'])
         areas.loc[(areas.ISO_A3 == 'FIN'), 'id'] = 'FIN'
         areas.loc[(areas.ISO_A3 == 'DZA'), 'id'] = 'DZA'
         areas.loc[(areas.ISO_A3 == 'EGY'), 'id'] = 'EGY'
@@ -226,20 +223,138 @@ def prepared_geofiles(choice: str, plot: bool = False) -> tuple[str, gpd.GeoData
     areas.geometry = areas['geometry']
         
         
-    ### 1.2 Visualise current areas
-    # Set projection
-    crs = ccrs.UTM(32)
-    # Make compatible with geopandas
-    # projection = crs.proj4_init # doesn't work, so actually cartopy is useless - continuing only with geopandas
+    if not('country_code' in locals()):
+        country_code = 'No country code'  
+
+    return area_names, areas, country_code
+
+def source_fingerprint(choice: str) -> str:
+    """Identify the source files of a choice by their size and modification time, and read_geofile by its code"""
+    source = GEOFILE_SOURCES[choice]
+    if os.path.isdir(source):
+        files = [os.path.join(source, file) for file in sorted(os.listdir(source))]
+    else:
+        # Including sidecar files, e.g. .dbf and .prj of shapefiles
+        folder, name = os.path.split(source)
+        stem = os.path.splitext(name)[0]
+        files = [os.path.join(folder, file) for file in sorted(os.listdir(folder)) if os.path.splitext(file)[0] == stem]
+
+    sha = hashlib.sha256(inspect.getsource(read_geofile).encode())
+    for file in files:
+        stat = os.stat(file)
+        sha.update(('%s %d %f'%(os.path.abspath(file), stat.st_size, stat.st_mtime)).encode())
+    return sha.hexdigest()
+
+@lru_cache(maxsize=16)
+def load_geofile(choice: str, fingerprint: str, store: str = GEOFILE_STORE) -> tuple[str, gpd.GeoDataFrame, str, list]:
+    """Load a geofile from the store, building it from the source files if it has not been stored before
+
+    The stored GeoParquet contains the pre-processed areas, their centroids (lon, lat), 
+    areas (km2) and the geometries in GEOFILE_PROJECTIONS
+    """
+    path = os.path.join(store, '%s_%s'%(choice, fingerprint[:16]))
+    if os.path.exists(path + '.json'):
+        with open(path + '.json', 'r') as f:
+            metadata = json.load(f)
+        return metadata['area_names'], gpd.read_parquet(path + '.parquet'), metadata['country_code'], metadata['columns']
+
+    area_names, areas, country_code = read_geofile(choice)
+    columns = list(areas.columns)
+
+    stored = areas.copy()
+    if areas.crs is not None:
+        stored = stored.join(area_attributes(areas.geometry))
+        for epsg in GEOFILE_PROJECTIONS:
+            stored['geometry_%d'%epsg] = areas.geometry.to_crs(epsg)
+
+    # Write to temporary files first, so an interrupted write is never used
+    os.makedirs(store, exist_ok=True)
+    stored.to_parquet(path + '.parquet.%d.tmp'%os.getpid())
+    os.replace(path + '.parquet.%d.tmp'%os.getpid(), path + '.parquet')
+    with open(path + '.json.%d.tmp'%os.getpid(), 'w') as f:
+        json.dump({'area_names' : area_names, 'country_code' : country_code, 'columns' : columns}, f)
+    os.replace(path + '.json.%d.tmp'%os.getpid(), path + '.json')
+
+    # Remove versions built from older source files
+    for file in os.listdir(store):
+        name, extension = os.path.splitext(file)
+        if name.rsplit('_', 1)[0] == choice and name != os.path.basename(path) and extension in ['.json', '.parquet']:
+            os.remove(os.path.join(store, file))
+
+    return area_names, stored, country_code, columns
+
+def prepared_geofiles(choice: str, plot: bool = False, 
+                      crs: Union[int, str, None] = None, 
+                      attributes: bool = False) -> tuple[str, gpd.GeoDataFrame, str]:
+    """
+    Prepared geofiles for various spatial resolutions
+
+    Parameters
+    ----------
+    choice : str
+        Currently supports:\n
+            'DK Municipalities'\n
+            'NUTS1'\n
+            'NUTS2'\n
+            'NUTS3'\n
+            'Nordpool'\n
+            'NordpoolReal'\n
+            'BalmorelVREAreas'\n
+            'Antbalm'\n
+            
+    plot : str
+        Chooses to plot or not
+
+    crs : int or str, optional
+        Return geometries in this projection, precomputed for EPSG:4328, 4093, 3035 and 6933
+
+    attributes : bool, optional
+        Include centroid_lon, centroid_lat and area_km2 columns
+
+    Returns
+    -------
+    area_names : Array of str
+        The region names.
+        
+    areas : GeoDataFrame
+        The pre-processed shapefile, including all metadata.
+
+    The pre-processed geofiles are stored as GeoParquet files in Data/Shapefiles/GeofileStore,
+    and kept in memory, so they are only built again if the source files change
+    """
+
+
+    choice = choice.replace(' ','').lower()
+    if choice in GEOFILE_SOURCES:
+        area_names, stored, country_code, columns = load_geofile(choice, source_fingerprint(choice))
+    else:
+        area_names, stored, country_code = read_geofile(choice)
+        columns = list(stored.columns)
 
+    # Copy, so callers can modify their areas
+    areas = stored[columns + (['centroid_lon', 'centroid_lat', 'area_km2'] if attributes else [])].copy()
+    
+    if crs is not None:
+        epsg = CRS.from_user_input(crs).to_epsg()
+        if 'geometry_%s'%epsg in stored.columns:
+            areas = gpd.GeoDataFrame(areas.drop(columns='geometry'), geometry=stored['geometry_%d'%epsg].values, crs=epsg)
+        else:
+            areas = areas.to_crs(crs)
+        
+    ### 1.2 Visualise current areas
     if plot:
+        # Set projection
+        projection = ccrs.UTM(32)
+        # Make compatible with geopandas
+        # projection = crs.proj4_init # doesn't work, so actually cartopy is useless - continuing only with geopandas
+
         # Make figure
-        fig, ax = plt.subplots(figsize=(10, 10), subplot_kw={"projection": crs},
+        fig, ax = plt.subplots(figsize=(10, 10), subplot_kw={"projection": projection},
                                dpi=200)
     
     
         # Add areas
-        ax.add_geometries(areas.geometry, crs = crs,
+        ax.add_geometries(areas.geometry, crs = projection,
                           facecolor=[.9, .9,.9], edgecolor='grey',
                           linewidth=.2)
     
@@ -249,50 +364,186 @@ def prepared_geofiles(choice: str, plot: bool = False) -> tuple[str, gpd.GeoData
     # ax.set_ylim(54.4,58)  
 
 
-    ### 1.3 Load Nordpool regions
-    # NP = pd.read_csv(project_dir/'geo_files/coordinates_RRR.csv')
-    # NP = NP.loc[df_unique['Type'] == 'region', ]
-
-    if not('country_code' in locals()):
+    if country_code == 'No country code':
         print('No country code defined in these shapefiles.')
-        country_code = 'No country code'  
 
     return area_names, areas, country_code
 
+def area_attributes(geometries: gpd.GeoSeries) -> pd.DataFrame:
+    """Centroids (centroid_lon, centroid_lat in the crs of the geometries) and areas (area_km2), 
+    both computed in an equal area projection"""
+    projected = geometries.to_crs(6933)
+    centroids = projected.centroid.to_crs(geometries.crs)
+    return pd.DataFrame({'centroid_lon' : centroids.x,
+                         'centroid_lat' : centroids.y,
+                         'area_km2' : projected.area / 1e6}, index=geometries.index)
+
+def intersection_areas(geometries1: np.ndarray, geometries2: np.ndarray) -> np.ndarray:
+    """Area of the intersection of each pair of geometries"""
+    return shapely.area(shapely.intersection(geometries1, geometries2))
+
 def calculate_intersects(areas_inter1: gpd.GeoDataFrame, 
                     areas_inter2: gpd.GeoDataFrame, 
-                    sum_total: bool = False) -> pd.DataFrame:        
+                    sum_total: bool = False,
+                    output: str = 'dense',
+                    workers: int = 1,
+                    chunksize: int = 10000) -> Union[pd.DataFrame, sparse.csr_matrix]:        
         """Calculates intersection of the series of areas_inter2 to each areas_inter1 element 
 
+        Only pairs with intersecting geometries, found with the spatial index (STRtree) of areas_inter1, are intersected
+
         Args:
-            areas_inter1 (gpd.GeoDataFrame): _description_
-            areas_inter2 (gpd.GeoDataFrame): _description_
-            sum_total (bool, optional): _description_. Defaults to False.
+            areas_inter1 (gpd.GeoDataFrame): The areas intersected with, e.g. aggregated areas (columns)
+            areas_inter2 (gpd.GeoDataFrame): The areas to distribute, e.g. DH shapes (rows)
+            sum_total (bool, optional): Divide by the total area of areas_inter2 instead of the sum of intersected areas. Defaults to False.
+            output (str, optional): 'dense' for a DataFrame with all pairs, 'long' for a DataFrame with a row per intersecting pair
+                                    or 'sparse' for a (areas_inter2 x areas_inter1) csr_matrix. Defaults to 'dense'.
+            workers (int, optional): Processes computing intersections in parallel. Defaults to 1.
+            chunksize (int, optional): Pairs intersected per process at a time. Defaults to 10000.
 
         Returns:
-            pd.DataFrame: _description_
+            Union[pd.DataFrame, sparse.csr_matrix]: The share of each element in areas_inter2 intersecting each element in areas_inter1
         """
+        if not(output in ['dense', 'long', 'sparse']):
+            raise ValueError("Output %s not supported, choose between 'dense', 'long' and 'sparse'"%output)
 
         # Convert to geocentric projection
-        temp_area1 = areas_inter1.to_crs(4328) # To geocentric (meters)
-        temp_area2 = areas_inter2.to_crs(4328) # To geocentric (meters)
+        temp_area1 = areas_inter1.to_crs(4328).geometry.values # To geocentric (meters)
+        temp_area2 = areas_inter2.to_crs(4328).geometry.values # To geocentric (meters)
+
+        # Candidate pairs of DH shapes and aggregated areas
+        rows, columns = shapely.STRtree(temp_area1).query(temp_area2, predicate='intersects')
 
         # Find intersection of DH shapes to each element in aggregated areas
-        df_intercepts = pd.DataFrame()
-        for agg_area in temp_area1.index:
-            df_intercepts[agg_area] = temp_area2.geometry.intersection(temp_area1.geometry[agg_area]).area
+        if workers > 1 and len(rows) > chunksize:
+            chunks = [slice(start, start + chunksize) for start in range(0, len(rows), chunksize)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                values = np.concatenate(list(executor.map(intersection_areas,
+                                                          [temp_area2[rows[chunk]] for chunk in chunks],
+                                                          [temp_area1[columns[chunk]] for chunk in chunks])))
+        else:
+            values = intersection_areas(temp_area2[rows], temp_area1[columns])
         
         if sum_total:
             # Divide by total area:
-            df_intercepts = df_intercepts.div(temp_area2.area, axis=0)
+            totals = shapely.area(temp_area2)
             
         else:
             # Divide by sum of intersected areas
-            df_intercepts = df_intercepts.div(df_intercepts.sum(axis=1), axis=0)
+            totals = np.bincount(rows, weights=values, minlength=len(temp_area2))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = values / totals[rows]
+
+        if output == 'long':
+            return pd.DataFrame({'area_inter2' : areas_inter2.index[rows],
+                                 'area_inter1' : areas_inter1.index[columns],
+                                 'value' : values})
+        
+        df_intercepts = sparse.csr_matrix((values, (rows, columns)), 
+                                          shape=(len(temp_area2), len(temp_area1)))
+        if output == 'sparse':
+            return df_intercepts
+
+        df_intercepts = pd.DataFrame(df_intercepts.toarray(), index=areas_inter2.index, columns=areas_inter1.index)
+        if not(sum_total):
+            # Elements not intersecting any area, as before
+            df_intercepts[totals == 0] = np.nan
         
         return df_intercepts
 
+def assign_points_to_areas(points: gpd.GeoDataFrame,
+                           areas: gpd.GeoDataFrame,
+                           area_column: str) -> pd.Series:
+    """Assigns points to the area they are within, and points outside all areas (e.g. offshore) to the nearest area
+
+    Both joins query the spatial index (STRtree) of the areas, instead of testing every point against every area.
+    If a point is within several (overlapping) areas, the last area is chosen,
+    and if several areas are equally near, the first area is chosen
 
+    Args:
+        points (gpd.GeoDataFrame): The points. Assumed to be in the coordinates of areas if no crs is set
+        areas (gpd.GeoDataFrame): The areas
+        area_column (str): The column of areas with the area names
+
+    Returns:
+        pd.Series: The area name of each point, with the index of points
+    """
+
+    index = points.index
+    points = gpd.GeoDataFrame(geometry=points.geometry.values, index=pd.RangeIndex(len(points)), crs=points.crs)
+    areas = gpd.GeoDataFrame({'area' : areas[area_column].values}, geometry=areas.geometry.values, crs=areas.crs)
+    if points.crs is None:
+        points = points.set_crs(areas.crs)
+    elif areas.crs is not None:
+        points = points.to_crs(areas.crs)
+
+    # Points within an area
+    within = gpd.sjoin(points, areas, how='inner', predicate='within')
+    within = within.sort_values('index_right', kind='stable')
+    within = within[~within.index.duplicated(keep='last')]
+    assigned = pd.Series(pd.NA, index=points.index, dtype=object)
+    assigned[within.index] = within['area']
+
+    # Remaining points to nearest area
+    missing = points[assigned.isna()]
+    if len(missing) > 0:
+        nearest = gpd.sjoin_nearest(missing, areas, how='inner')
+        nearest = nearest.sort_values('index_right', kind='stable')
+        nearest = nearest[~nearest.index.duplicated(keep='first')]
+        assigned[nearest.index] = nearest['area']
+
+    return pd.Series(assigned.values, index=index, name=area_column)
+
+def allocate_lines_to_areas(lines: gpd.GeoDataFrame,
+                            areas: gpd.GeoDataFrame,
+                            values: str,
+                            method: str = 'equal') -> pd.Series:
+    """Allocates a value of each line (e.g. vehicles on a road segment) to the areas it intersects
+
+    Line-area pairs are found with a spatial join, so only areas with overlapping bounding boxes are tested.
+    Lines not intersecting any area are not allocated
+
+    Args:
+        lines (gpd.GeoDataFrame): The lines
+        areas (gpd.GeoDataFrame): The areas
+        values (str): The column of lines with the value to allocate
+        method (str, optional): 'equal' splits the value equally between intersected areas, 
+                                'length' splits it by the length of the line inside each area. Defaults to 'equal'.
+
+    Returns:
+        pd.Series: The allocated value in each area, with the index of areas
+    """
+    if not(method in ['equal', 'length']):
+        raise ValueError("Method %s not supported, choose between 'equal' and 'length'"%method)
+
+    lines = gpd.GeoDataFrame({'value' : lines[values].astype(float).values}, geometry=lines.geometry.values, crs=lines.crs)
+    areas = gpd.GeoDataFrame(geometry=areas.geometry.values, index=areas.index, crs=areas.crs)
+    if lines.crs is None:
+        lines = lines.set_crs(areas.crs)
+    elif areas.crs is not None:
+        lines = lines.to_crs(areas.crs)
+
+    pairs = gpd.sjoin(lines, gpd.GeoDataFrame(geometry=areas.geometry.values, crs=areas.crs), 
+                      how='inner', predicate='intersects')
+    line_index = pairs.index.to_numpy()
+    area_index = pairs['index_right'].to_numpy()
+
+    if method == 'equal':
+        shares = 1 / np.bincount(line_index, minlength=len(lines))[line_index]
+    else:
+        # Length inside each area, in meters
+        geometries = lines.geometry.to_crs(3035).values[line_index]
+        lengths = shapely.length(shapely.intersection(geometries, areas.geometry.to_crs(3035).values[area_index]))
+        totals = np.bincount(line_index, weights=lengths, minlength=len(lines))[line_index]
+        # Lines only touching an area boundary are split equally
+        with np.errstate(invalid='ignore', divide='ignore'):
+            shares = np.where(totals > 0, lengths / totals, 
+                              1 / np.bincount(line_index, minlength=len(lines))[line_index])
+
+    allocated = np.bincount(area_index, weights=lines['value'].values[line_index] * shares, minlength=len(areas))
+
+    return pd.Series(allocated, index=areas.index, name=values)
 
 def assign_area_to_region(A: Union[gpd.GeoSeries, pd.Series],
                           R: Union[gpd.GeoSeries, pd.Series] = gpd.GeoSeries(),
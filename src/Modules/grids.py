@@ -39,31 +39,55 @@ import xarray as xr
 import numpy as np
 import matplotlib.pyplot as plt
 from geofiles import prepared_geofiles
-from scipy.spatial import distance_matrix
+from scipy import sparse
 from Submodules.municipal_template import DataContainer
+from Submodules.distances import distance_matrix, connected_distances
 from Submodules.utils import convert_names
 import yaml
-from pybalmorel import IncFile
+from Submodules.incfiles import IncFile, save_parameter
         
         
 #%% ----------------------------- ###
 ###     2. Calculate Distances    ###
 ### ----------------------------- ###
 
-def get_distance_matrix(areas: gpd.GeoDataFrame):
-    # Convert to geocentric coordinates for meter units
-    areas = areas.to_crs(4328)
-
-    ### 2.1 Calculate Distances
-    # Use distance_matrix
-    d = pd.DataFrame(
-        distance_matrix(areas.geometry.apply(lambda polygon: (polygon.centroid.x, polygon.centroid.y)).tolist(),
-                        areas.geometry.apply(lambda polygon: (polygon.centroid.x, polygon.centroid.y)).tolist()),
-        index=areas.index,
-        columns=areas.index
+def get_distance_matrix(areas: gpd.GeoDataFrame,
+                        method: str = 'projected',
+                        connections: pd.DataFrame = None):
+    """Distances (m) between region centroids from the distance cache (Submodules/distances.py)
+
+    Args:
+        areas (gpd.GeoDataFrame): The regions
+        method (str, optional): 'projected' (geocentric coordinates), 'great_circle' or 'network'. Defaults to 'projected'.
+        connections (pd.DataFrame, optional): Connections between regions (IRRRE x IRRRI), needed for network distances. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The distances, NaN between regions that the network can not reach, so they are left out of the tables like unconnected pairs
+    """
+    connectivity = None
+    if connections is not None:
+        connectivity = sparse.csr_matrix(connections.reindex(index=areas.index, columns=areas.index).fillna(0).values)
+    
+    d = distance_matrix(areas, method, connectivity)
+    
+    return d.where(np.isfinite(d))
+
+def municipality_polygons():
+    """Municipality polygons with names as in the Balmorel grid data (no æøå)"""
+    x = DataContainer()
+    geofile = x.get_polygons()
+    geofile.index = (
+        geofile
+        .index
+        .str.replace('Æ', 'Ae')
+        .str.replace('Ø', 'Oe')
+        .str.replace('Å', 'Aa')
+        .str.replace('æ', 'ae')
+        .str.replace('ø', 'oe')
+        .str.replace('å', 'aa')
     )
     
-    return d
+    return geofile
 
 def get_connections(areas: pd.DataFrame):
     X = pd.DataFrame(np.zeros((len(areas), len(areas))).astype(int),
@@ -79,7 +103,8 @@ def create_grid_incfiles(d: pd.DataFrame,
                          XLOSS_E: float,
                          DCOST_E: float,
                          DLOSS_E: float,
-                         carrier: str):
+                         carrier: str,
+                         edge_list: bool = False):
     
     if carrier == 'electricity':
         carrier_symbol = 'X'
@@ -88,6 +113,24 @@ def create_grid_incfiles(d: pd.DataFrame,
         carrier_symbol = 'XH2'
         prefix = 'HYDROGEN_'
     
+    if edge_list:
+        create_grid_edge_lists(d, X, XE_cost, XCOST_E, XLOSS_E, carrier, carrier_symbol, prefix)
+    else:
+        create_grid_tables(d, X, XE_cost, XCOST_E, XLOSS_E, carrier, carrier_symbol, prefix)
+
+    if carrier == 'electricity':
+        create_distribution_incfiles(X, DCOST_E, DLOSS_E, prefix)
+
+def create_grid_tables(d: pd.DataFrame,
+                       X: pd.DataFrame,
+                       XE_cost: float,
+                       XCOST_E: float,
+                       XLOSS_E: float,
+                       carrier: str,
+                       carrier_symbol: str,
+                       prefix: str):
+    """XINVCOST, XLOSS and XCOST (or the hydrogen equivalents) as square (IRRRE x IRRRI) tables"""
+    
     ### 4.1 Transmission - ASSUMPTIONS
     # It is assumed that costs are symmmetrical
     D = d.sum().sum()/2  # Total, modelled length
@@ -108,11 +151,10 @@ def create_grid_incfiles(d: pd.DataFrame,
     XE = XE.replace(0, '')
     
 
-    with open('./Output/%s%sINVCOST.inc'%(prefix, carrier_symbol), 'w') as f:
-        f.write("TABLE %sINVCOST(YYY,IRRRE,IRRRI)        'Investment cost in new %s transmission capacity (Money/MW)'\n"%(carrier_symbol, carrier.capitalize()))
-        dfAsString = XE.to_string(header=True, index=True)
-        f.write(dfAsString)
-        f.write('\n;')
+    IncFile(name='%s%sINVCOST'%(prefix, carrier_symbol), path='./Output',
+            prefix="TABLE %sINVCOST(YYY,IRRRE,IRRRI)        'Investment cost in new %s transmission capacity (Money/MW)'\n"%(carrier_symbol, carrier.capitalize()),
+            body=XE,
+            suffix='\n;').save()
                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                         
             
     ### 4.3 Energy losses
@@ -124,11 +166,10 @@ def create_grid_incfiles(d: pd.DataFrame,
     XL.index.name = ''
     XL = XL.replace(0, '')
                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                 
-    with open('./Output/%s%sLOSS.inc'%(prefix, carrier_symbol), 'w') as f:
-        f.write("TABLE %sLOSS(IRRRE,IRRRI)        '%s transmission loss between regions (fraction)'\n"%(carrier_symbol, carrier.capitalize()))
-        dfAsString = XL.to_string(header=True, index=True)
-        f.write(dfAsString)
-        f.write('\n;')
+    IncFile(name='%s%sLOSS'%(prefix, carrier_symbol), path='./Output',
+            prefix="TABLE %sLOSS(IRRRE,IRRRI)        '%s transmission loss between regions (fraction)'\n"%(carrier_symbol, carrier.capitalize()),
+            body=XL,
+            suffix='\n;').save()
 
 
 
@@ -141,40 +182,87 @@ def create_grid_incfiles(d: pd.DataFrame,
         .replace(0, '')
     )
 
-    with open('./Output/%s%sCOST.inc'%(prefix, carrier_symbol), 'w') as f:
-        f.write("TABLE %sCOST(IRRRE,IRRRI)  '%s transmission cost between regions (Money/MWh)'\n"%(carrier_symbol, carrier.capitalize()))
-        dfAsString = xcost_e.to_string(header=True, index=True)
+    IncFile(name='%s%sCOST'%(prefix, carrier_symbol), path='./Output',
+            prefix="TABLE %sCOST(IRRRE,IRRRI)  '%s transmission cost between regions (Money/MWh)'\n"%(carrier_symbol, carrier.capitalize()),
+            body=xcost_e,
+            suffix='\n;').save()
+
+def create_grid_edge_lists(d: pd.DataFrame,
+                           X: pd.DataFrame,
+                           XE_cost: float,
+                           XCOST_E: float,
+                           XLOSS_E: float,
+                           carrier: str,
+                           carrier_symbol: str,
+                           prefix: str):
+    """XINVCOST, XLOSS and XCOST (or the hydrogen equivalents) as sparse lists of 'IRRRE . IRRRI  value' records,
+    instead of square tables that are almost only blanks
+    
+    All parameters are only written for connected regions. Losses between regions that are not connected 
+    can not be used, and aggregate_inputs averages losses over the pairs with transmission capacity
+    """
+    
+    regions = d.index.to_numpy().astype(str)
+    connections = connected_distances(d, X)
+    counts = X.reindex(index=d.index, columns=d.columns).fillna(0).values[connections.row, connections.col]
+    
+    ### 4.2 XINVCOST.inc
+    investment = XE_cost * counts * connections.data.astype(float) # € pr. MW
+    keep = investment != 0
+    save_parameter('%s%sINVCOST'%(prefix, carrier_symbol), './Output',
+                   "PARAMETER %sINVCOST(YYY,IRRRE,IRRRI)        'Investment cost in new %s transmission capacity (Money/MW)'"%(carrier_symbol, carrier.capitalize()),
+                   pd.DataFrame({'YYY' : '2050',
+                                 'IRRRE' : regions[connections.row[keep]],
+                                 'IRRRI' : regions[connections.col[keep]],
+                                 'value' : investment[keep]}))
+    
+    ### 4.3 Energy losses
+    losses = XLOSS_E * connections.data.astype(float)
+    keep = losses != 0
+    save_parameter('%s%sLOSS'%(prefix, carrier_symbol), './Output',
+                   "PARAMETER %sLOSS(IRRRE,IRRRI)        '%s transmission loss between regions (fraction)'"%(carrier_symbol, carrier.capitalize()),
+                   pd.DataFrame({'IRRRE' : regions[connections.row[keep]],
+                                 'IRRRI' : regions[connections.col[keep]],
+                                 'value' : losses[keep]}))
+    
+    ### 4.4 XCOST.inc
+    save_parameter('%s%sCOST'%(prefix, carrier_symbol), './Output',
+                   "PARAMETER %sCOST(IRRRE,IRRRI)  '%s transmission cost between regions (Money/MWh)'"%(carrier_symbol, carrier.capitalize()),
+                   pd.DataFrame({'IRRRE' : regions[connections.row],
+                                 'IRRRI' : regions[connections.col],
+                                 'value' : XCOST_E * counts.astype(float)}))
+
+def create_distribution_incfiles(X: pd.DataFrame,
+                                 DCOST_E: float,
+                                 DLOSS_E: float,
+                                 prefix: str):
+    """DISLOSS_E and DISCOST_E of electricity"""
+
+    ### 4.5 Distribution
+    ## DISLOSS_E
+    disloss_e = pd.DataFrame(data={'' : [DLOSS_E]*len(X.index)}, index=X.columns) # create losses
+    disloss_e.index.name = ''
+    disloss_e.columns.name = ''
+
+    with open('./Output/%sDISLOSS_E.inc'%prefix, 'w') as f:
+        f.write("PARAMETER DISLOSS_E(RRR)  'Loss in electricity distribution'              \n")
+        f.write('/')
+        dfAsString = disloss_e.to_string(header=True, index=True)
         f.write(dfAsString)
-        f.write('\n;')
-
-
-
-    if carrier == 'electricity':
-        ### 4.5 Distribution
-        ## DISLOSS_E
-        disloss_e = pd.DataFrame(data={'' : [DLOSS_E]*len(X.index)}, index=X.columns) # create losses
-        disloss_e.index.name = ''
-        disloss_e.columns.name = ''
-
-        with open('./Output/%sDISLOSS_E.inc'%prefix, 'w') as f:
-            f.write("PARAMETER DISLOSS_E(RRR)  'Loss in electricity distribution'              \n")
-            f.write('/')
-            dfAsString = disloss_e.to_string(header=True, index=True)
-            f.write(dfAsString)
-            f.write('\n/;')
-            
-            
-        ## DISCOST_E
-        discost_e = pd.DataFrame(data={'' : [DCOST_E]*len(X.index)}, index=X.columns) # create losses
-        discost_e.index.name = ''
-        discost_e.columns.name = ''
-
-        with open('./Output/%sDISCOST_E.inc'%prefix, 'w') as f:
-            f.write("PARAMETER DISCOST_E(RRR)  'Cost of electricity distribution (Money/MWh)'\n")
-            f.write('/')
-            dfAsString = discost_e.to_string(header=True, index=True)
-            f.write(dfAsString)
-            f.write('\n/;')
+        f.write('\n/;')
+        
+        
+    ## DISCOST_E
+    discost_e = pd.DataFrame(data={'' : [DCOST_E]*len(X.index)}, index=X.columns) # create losses
+    discost_e.index.name = ''
+    discost_e.columns.name = ''
+
+    with open('./Output/%sDISCOST_E.inc'%prefix, 'w') as f:
+        f.write("PARAMETER DISCOST_E(RRR)  'Cost of electricity distribution (Money/MWh)'\n")
+        f.write('/')
+        dfAsString = discost_e.to_string(header=True, index=True)
+        f.write(dfAsString)
+        f.write('\n/;')
 
 def create_tech_specific_distribution_loss(wind_offshore_loss: dict,
                                            industry_loss: float,
@@ -264,21 +352,11 @@ def main():
     XH2T = config['grid_assumptions']['hydrogen']['lifetime'] # Lifetime of grid elements
     XH2LOSS_E = config['grid_assumptions']['hydrogen']['transmission_loss'] # fraction of loss pr. m, From Balmorel DK1-DK2 line
     XH2COST_E = config['grid_assumptions']['hydrogen']['transmission_cost'] # €/MWh Transmission costs
+    distance_method = config['grid_assumptions'].get('distance_method', 'projected') # Distance between region centroids
+    edge_list = config['grid_assumptions'].get('edge_list', False) # Write transmission parameters as sparse lists instead of tables
     
-    # 2. Get Distance Matrix
-    x = DataContainer()
-    geofile = x.get_polygons()
-    geofile.index = (
-        geofile
-        .index
-        .str.replace('Æ', 'Ae')
-        .str.replace('Ø', 'Oe')
-        .str.replace('Å', 'Aa')
-        .str.replace('æ', 'ae')
-        .str.replace('ø', 'oe')
-        .str.replace('å', 'aa')
-    )
-    d = get_distance_matrix(geofile)
+    # 2. Get polygons
+    geofile = municipality_polygons()
     
     # 3. Get connections
     f = xr.load_dataset("Data/BalmorelData/municipal_connectivity.nc")
@@ -298,9 +376,12 @@ def main():
     ## Check validity
     assert np.all(X < 2), 'Double connection counts for some reason?'
     
+    ## Distances, shared with biomass_transport through the distance cache
+    d = get_distance_matrix(geofile, distance_method, X)
+    
     # 4. Generate .inc files
-    create_grid_incfiles(d, X, XE_cost, XCOST_E, XLOSS_E, DCOST_E, DLOSS_E, 'electricity')
-    create_grid_incfiles(d, X, XH2E_cost, XH2COST_E, XH2LOSS_E, DCOST_E, DLOSS_E, 'hydrogen')
+    create_grid_incfiles(d, X, XE_cost, XCOST_E, XLOSS_E, DCOST_E, DLOSS_E, 'electricity', edge_list)
+    create_grid_incfiles(d, X, XH2E_cost, XH2COST_E, XH2LOSS_E, DCOST_E, DLOSS_E, 'hydrogen', edge_list)
 
 
     # 5. Generate tech specific distribution loss
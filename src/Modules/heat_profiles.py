@@ -13,14 +13,16 @@ Created on 14.10.2024
 ### ------------------------------- ###
 
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-from pybalmorel import IncFile
+from Submodules.incfiles import IncFile
 import geopandas as gpd
 import xarray as xr
 import click
 from geofiles import prepared_geofiles
 from Submodules.utils import store_balmorel_input, join_to_gpd
-from pybalmorel import IncFile
+from Submodules.spatial_weights import weight_matrix, apply_weights, METHODS
+from Submodules.incfiles import IncFile
 
 @click.group()
 @click.option('--dark-style', is_flag=True, required=False, help='Dark plot style')
@@ -52,7 +54,8 @@ def CLI(ctx, dark_style: bool, plot_ext: str):
 @click.argument('cutout', type=str)
 @click.option('--weather-year', type=int, required=False, default=2012, help="The weather year")
 @click.option('--plot', is_flag=True, required=False, help="Plot the average temperatures on a map?")
-def generate(ctx, cutout: str, weather_year: int, plot: bool):
+@click.option('--aggfunc', type=click.Choice(METHODS), required=False, default='mean', help="Mean of grid cells inside municipalities, or mean weighted by overlapping area (area_mean) or share of the cells inside municipalities (area_share)")
+def generate(ctx, cutout: str, weather_year: int, plot: bool, aggfunc: str):
         "A command in the CLI"
         
         # Get files
@@ -60,7 +63,7 @@ def generate(ctx, cutout: str, weather_year: int, plot: bool):
         the_index, geofile, c = prepared_geofiles('DKmunicipalities_names')
 
         # Aggregate temperature for coordinates inside municipality polygons
-        agg_temperatures = aggregate_temperatures(temperature, geofile)
+        agg_temperatures = aggregate_temperatures(temperature, geofile, aggfunc)
         
         plot_data(agg_temperatures, 'temperature')
         
@@ -120,53 +123,29 @@ def generate(ctx, cutout: str, weather_year: int, plot: bool):
 ###            2. Utils             ###
 ### ------------------------------- ###
 
-def aggregate_temperatures(temperature: xr.DataArray, 
+def aggregate_temperatures(temperature: xr.DataArray,
                            geofile: gpd.GeoDataFrame,
                            aggfunc: str = 'mean'):
-        
-        agg_temperatures = xr.DataArray(dims=['municipality', 'time'],
-                                        coords={'municipality' : geofile.index.values,
-                                              'time' : temperature.coords['time'].data},
-                                      name='temperature')
-        
-        for municipality in geofile.index:
-                # Get the bounds of the municipality
-                x0, y0, x1, y1 = geofile.loc[municipality, 'geometry'].bounds
-                
-                # Get the coordinates inside the municipality
-                snapshot = (
-                        temperature.loc[:, y0-0.25:y1+0.25, x0-0.25:x1+0.25] # Order of coordinates: time, latitude, longitude. Add buffer equal to grid resolution to ensure the snapshot is not empty
-                        .isel(time=0)                    # A snapshot in time, we just need coordinates at this point
-                        .to_dataframe() 
-                        .reset_index()
-                )
-                coords = gpd.points_from_xy(snapshot['x'], snapshot['y'])
-                idx = coords.within(geofile.loc[municipality, 'geometry'])
-                
-                if len(coords[idx]) == 0:
-                        centroid_distances = (
-                                geofile
-                                # .to_crs('EPSG:4093')
-                                .loc[municipality, 'geometry']
-                                .centroid
-                                .distance(coords)
-                        )
-                        coords = coords[centroid_distances == centroid_distances.min()]
-                        print('No points within %s!'%municipality, 'The closest point was %0.2f m away..'%(centroid_distances.min()))
-                else:
-                        coords = coords[idx]
-                
-                # The mean temperature of coordinates in the municipality
-                aggregated_temperature = getattr(temperature.loc[:, coords.y, coords.x], aggfunc)(dim=['x', 'y'])
+        """Aggregate gridded temperatures to the polygons of the geofile
 
-                # Store it
-                aggregated_temperature = aggregated_temperature.assign_coords({'municipality' : municipality})
-                agg_temperatures.loc[municipality, :] = aggregated_temperature
+        Args:
+            temperature (xr.DataArray): Temperatures with time, y and x dimensions
+            geofile (gpd.GeoDataFrame): The municipalities
+            aggfunc (str, optional): 'mean' of cells inside a municipality, 'area_mean' weighted by overlapping area or 'area_share' weighted by the share of cells inside. Defaults to 'mean'.
+        """
+
+        # Sparse (cells x municipalities) weights, cached for the grid and geofile
+        weights = weight_matrix(temperature.x.data, temperature.y.data, geofile, aggfunc)
+        municipalities = pd.Index(geofile.index.values, name='municipality')
+
+        # The mean temperature of coordinates in each municipality
+        agg_temperatures = apply_weights(temperature, weights, municipalities).rename('temperature')
+
+        # Report it
+        meanstd = np.sqrt((apply_weights(temperature**2, weights, municipalities) - agg_temperatures**2).clip(min=0)).mean('time')
+        for municipality in municipalities:
+                print('Mean standard deviation of temperature data inside %s:'%municipality, float(meanstd.loc[municipality]))
 
-                # Report it
-                meanstd = temperature.loc[:, coords.y, coords.x].std(dim=['x', 'y']).mean()
-                print('Mean standard deviation of temperature data inside %s:'%municipality, float(meanstd))
-                
         # Add polygons for plotting
         geo = geofile['geometry']
         geo.index.name = 'municipality'
@@ -12,17 +12,22 @@ ASSUMPTIONS:
 ### ------------------------------- ###
 
 import os 
+import hashlib
 import pandas as pd
 import numpy as np
 import geopandas as gpd
+import shapely
 from pybalmorel import IncFile
-from geofiles import prepared_geofiles
+from geofiles import prepared_geofiles, allocate_lines_to_areas
 from Submodules.utils import cmap 
 from format_dkstat import load_transport_demand
 import matplotlib.pyplot as plt
 import xarray as xr
 import click
 
+TRAFFIC_DATA = 'Data/Gas, Transport and Industry Data/gdf_all_ETISplus.geojson'
+TRAFFIC_KEYS_FOLDER = os.path.join('Data', 'Gas, Transport and Industry Data', 'TrafficKeys')
+
 #%% ------------------------------- ###
 ###   1. Temporal Profile for Road  ###
 ### ------------------------------- ###
@@ -161,11 +166,29 @@ class FlexDem():
 ###        2. Spatial Spread        ###
 ### ------------------------------- ###
 
-def distribute_road_flex_electricity_demand(plot: bool, choice: str = 'dkmunicipalities_names'):
-    # 2.1 Vehicle Counts on Roads from Ioannis' source 
-    f = gpd.read_file('Data/Gas, Transport and Industry Data/gdf_all_ETISplus.geojson')
+def traffic_keys_path(geo: gpd.GeoDataFrame, allocation: str, 
+                      traffic_data: str = TRAFFIC_DATA) -> str:
+    """Cache file of the traffic counts, identified by the traffic data file, the areas and the allocation method"""
+    stat = os.stat(traffic_data)
+    sha = hashlib.sha256(('%s %d %f %s'%(os.path.abspath(traffic_data), stat.st_size, stat.st_mtime, allocation)).encode())
+    sha.update('\n'.join(geo.index.astype(str)).encode())
+    for wkb in shapely.to_wkb(geo.geometry.values):
+        sha.update(wkb)
+    return os.path.join(TRAFFIC_KEYS_FOLDER, '%s.csv'%sha.hexdigest())
 
+def distribute_road_flex_electricity_demand(plot: bool, choice: str = 'dkmunicipalities_names',
+                                            allocation: str = 'equal'):
     id, geo, c = prepared_geofiles(choice)
+
+    # Use the traffic counts of a previous run, if neither the data nor the areas changed
+    cache_path = traffic_keys_path(geo, allocation)
+    if os.path.exists(cache_path) and not(plot):
+        traffic_count = pd.read_csv(cache_path, index_col=0, dtype={'area' : str}).iloc[:, 0]
+        geo['traffic_count'] = traffic_count.reindex(geo.index.astype(str)).values
+        return geo
+
+    # 2.1 Vehicle Counts on Roads from Ioannis' source 
+    f = gpd.read_file(TRAFFIC_DATA)
     
     if plot: 
         fig, ax = plt.subplots()
@@ -177,14 +200,11 @@ def distribute_road_flex_electricity_demand(plot: bool, choice: str = 'dkmunicip
         ax.axes.set_axis_off()
         fig.savefig('Output/Figures/traffic-gis-data.png', transparent=True)
     
-    geo['traffic_count'] = 0
-    for i, row in f.iterrows():
-        idx = row.geometry.intersects(geo.geometry)
-        muni = geo.loc[idx]
-        if len(muni) != 0:
-            for mun in muni.index:
-                geo.loc[mun, 'traffic_count'] += float(row.vehicles) / len(muni.index)
-            # print('%d intersects %d'%(i, muni.index))
+    # Split vehicles on each road segment between the municipalities it intersects
+    geo['traffic_count'] = allocate_lines_to_areas(f, geo, 'vehicles', allocation)
+
+    os.makedirs(TRAFFIC_KEYS_FOLDER, exist_ok=True)
+    geo['traffic_count'].rename_axis('area').to_csv(cache_path)
     
     return geo
 
@@ -234,9 +254,10 @@ def distribute_dkstat_demand(geo: gpd.GeoDataFrame,
 @click.command()
 @click.option('--chargercap', type=float, required=True, help="Charging capacity in kW pr. vehicle")
 @click.option('--plot-only', is_flag=True, default=False, help="Only plot")
-def main(chargercap: float, plot_only: bool):
+@click.option('--allocation', type=click.Choice(['equal', 'length']), default='equal', help="Split vehicles on road segments equally between intersected municipalities, or by the length inside them")
+def main(chargercap: float, plot_only: bool, allocation: str):
     # Distribute road demand to municipalities using the transport study
-    geo = distribute_road_flex_electricity_demand(plot_only)
+    geo = distribute_road_flex_electricity_demand(plot_only, allocation=allocation)
     road_demand = distribute_dkstat_demand(geo, plot_only)
     
     if not(plot_only):
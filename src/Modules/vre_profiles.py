@@ -27,6 +27,8 @@ from rasterio.plot import show
 import xarray as xr
 from atlite.gis import shape_availability, ExclusionContainer
 from geofiles import prepared_geofiles
+from Submodules.incfiles import IncFile
+from Submodules.spatial_weights import share_matrix
 import logging
 import click
 logging.basicConfig(level=logging.INFO)
@@ -276,7 +278,11 @@ def main(cutout_path: str, weather_year: int, offshore_profiles: bool = False, o
     ### 2.5 Calculate Availability Matrix for all Regions
     # Amat.index = ['Denmark']
     A = A.geometry.set_crs(excluder.crs)
-    Amat = cutout.availabilitymatrix(A, excluder)
+    if len(excluder.rasters) == 0 and len(excluder.geometries) == 0:
+        # Without exclusions, the availability is the share of each weather cell inside the region (cached sparse weights)
+        Amat = share_matrix(cutout.data.x.data, cutout.data.y.data, gpd.GeoDataFrame(geometry=A), A.index.name)
+    else:
+        Amat = cutout.availabilitymatrix(A, excluder)
 
     ### Plot first region availability  
     fig, ax = plt.subplots()
@@ -433,32 +439,33 @@ def main(cutout_path: str, weather_year: int, offshore_profiles: bool = False, o
 
     if not(offshore_profiles):
         # Wind
-        with open('./Output/WND_VAR_T.inc', 'w') as f:
-            f.write('TABLE WND_VAR_T1(SSS,TTT,AAA)            "Variation of the wind generation"\n')
-            # f.write('+') # If adding to another WND_VAR_T
-            dfAsString = W.to_string(header=True, index=True)
-            f.write(dfAsString)
-            f.write('\n;')
-            f.write('\nWND_VAR_T(AAA,SSS,TTT) = WND_VAR_T1(SSS,TTT,AAA);')
-            f.write('\nWND_VAR_T1(SSS,TTT,AAA) = 0;')
-            f.write("\n".join([
-                "",
-                "$onmulti",
-                "$if     EXIST '../data/OFFSHORE_WND_VAR_T.inc'      $INCLUDE '../data/OFFSHORE_WND_VAR_T.inc';",
-                "$if not EXIST '../data/OFFSHORE_WND_VAR_T.inc'      $INCLUDE '../../base/data/OFFSHORE_WND_VAR_T.inc';",
-                "$offmulti"
-            ]))
+        IncFile(name='WND_VAR_T', path='./Output',
+                prefix='TABLE WND_VAR_T1(SSS,TTT,AAA)            "Variation of the wind generation"\n',
+                body=W,
+                suffix="\n".join([
+                    "",
+                    ";",
+                    "WND_VAR_T(AAA,SSS,TTT) = WND_VAR_T1(SSS,TTT,AAA);",
+                    "WND_VAR_T1(SSS,TTT,AAA) = 0;",
+                    "$onmulti",
+                    "$if     EXIST '../data/OFFSHORE_WND_VAR_T.inc'      $INCLUDE '../data/OFFSHORE_WND_VAR_T.inc';",
+                    "$if not EXIST '../data/OFFSHORE_WND_VAR_T.inc'      $INCLUDE '../../base/data/OFFSHORE_WND_VAR_T.inc';",
+                    "$offmulti"
+                ])).save()
             
 
         # Solar
         # f = open('SOLE_VAR_T.inc', 'w')
-        with open('./Output/SOLE_VAR_T.inc', 'w') as f:
-            f.write('TABLE SOLE_VAR_T1(SSS,TTT,AAA)            "Variation of the solar generation"\n')
-            dfAsString = S.to_string(header=True, index=True)
-            f.write(dfAsString)
-            f.write('\n;\n')
-            f.write('SOLE_VAR_T(AAA,SSS,TTT) = SOLE_VAR_T1(SSS,TTT,AAA);\n')
-            f.write('SOLE_VAR_T1(SSS,TTT,AAA) = 0;\n')
+        IncFile(name='SOLE_VAR_T', path='./Output',
+                prefix='TABLE SOLE_VAR_T1(SSS,TTT,AAA)            "Variation of the solar generation"\n',
+                body=S,
+                suffix="\n".join([
+                    "",
+                    ";",
+                    "SOLE_VAR_T(AAA,SSS,TTT) = SOLE_VAR_T1(SSS,TTT,AAA);",
+                    "SOLE_VAR_T1(SSS,TTT,AAA) = 0;",
+                    ""
+                ])).save()
 
 
 
@@ -509,13 +516,16 @@ def main(cutout_path: str, weather_year: int, offshore_profiles: bool = False, o
             f.write('\n/\n;')
         
         
-        with open('./Output/SOLH_VAR_T.inc', 'w') as f:
-            f.write('TABLE SOLH_VAR_T1(SSS,TTT,AAA)            "Variation of the solar generation"\n')
-            dfAsString = S.to_string(header=True, index=True)
-            f.write(dfAsString)
-            f.write('\n;\n')
-            f.write('SOLH_VAR_T(AAA,SSS,TTT) = SOLH_VAR_T1(SSS,TTT,AAA);\n')
-            f.write('SOLH_VAR_T1(SSS,TTT,AAA) = 0;\n')
+        IncFile(name='SOLH_VAR_T', path='./Output',
+                prefix='TABLE SOLH_VAR_T1(SSS,TTT,AAA)            "Variation of the solar generation"\n',
+                body=S,
+                suffix="\n".join([
+                    "",
+                    ";",
+                    "SOLH_VAR_T(AAA,SSS,TTT) = SOLH_VAR_T1(SSS,TTT,AAA);",
+                    "SOLH_VAR_T1(SSS,TTT,AAA) = 0;",
+                    ""
+                ])).save()
 
 
     # 3.4 Potentials